@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import json
 import os
 from pathlib import Path
 
@@ -41,15 +42,18 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "accounts",
-    "contented",
+    "contented.apps.ContentedConfig",
 ]
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "contented.sites.SiteMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "contented.profiling.ProfilingMiddleware",
+    "contented.storage.StorageUnavailableMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -132,11 +136,121 @@ PROJECTS_DIR = Path(os.getenv("PROJECTS_DIR", "dummy_projects"))
 
 # The set of projects that are access-restricted
 # - are defined by the comma-separated env variable "RESTRICTED_PROJECTS";
+# - each entry is a project name or a rule that may match several projects,
+# folders or files (eg, "client-*", "*/raw_data/" or "!client-demo"; see
+# `contented/restrictions.py`);
 # - if that var is missing or an empty string, all projects are
 # assumed to be publicly accessible:
 
 RESTRICTED_PROJECTS = [x for x in os.getenv("RESTRICTED_PROJECTS", "").split(",") if x]
 
+# If set, only the logged-in users in this group (and superusers) can see the
+# restricted projects, or upload files; otherwise, every logged-in user can.
+# Each further site (see "CONTENTED_SITES_FILE" below) names its own group
+
+CONTENTED_SITE_GROUP = os.getenv("CONTENTED_SITE_GROUP", "")
+
+# Artifacts that are derived from the projects (eg, columnar copies of results
+# tables) are cached in this directory. It can be deleted at any time; the
+# artifacts are rebuilt when they are next needed. Uploads that are in progress
+# are also staged here (in `uploads/`), and are lost if it is deleted
+
+CONTENTED_CACHE_DIR = Path(
+    os.getenv("CONTENTED_CACHE_DIR", BASE_DIR / ".contented_cache")
+)
+
+# If the project index is kept up to date (see `./manage.py contented_watch`)
+# the files in each project are listed from the index, rather than by walking
+# the project directory, and open project-pages are updated as files change
+
+CONTENTED_USE_INDEX = bool(os.getenv("CONTENTED_USE_INDEX", ""))
+
+# If set, project listings are read from this memory-mapped file, which is
+# shared by all gunicorn workers (see `contented/shared_index.py`), rather than
+# from the filesystem
+
+CONTENTED_SHARED_INDEX = os.getenv("CONTENTED_SHARED_INDEX", "")
+
+# Further sites (domains) can be served by the same workers, each from its own
+# project collection: "CONTENTED_SITES_FILE" names a JSON file that maps each
+# host name to the config of its site (see `contented/sites.py`). Requests for
+# other hosts are served using the settings above
+
+CONTENTED_SITES = {}
+if os.getenv("CONTENTED_SITES_FILE"):
+    with open(os.environ["CONTENTED_SITES_FILE"]) as sites_file:
+        CONTENTED_SITES = json.load(sites_file)
+    if not DEBUG:
+        ALLOWED_HOSTS += list(CONTENTED_SITES)
+
+# If set, project pages are streamed to the browser: the page header is sent
+# straight away, and the list of files follows as the project is traversed
+
+CONTENTED_STREAM_PROJECT_PAGES = bool(os.getenv("CONTENTED_STREAM_PROJECT_PAGES", ""))
+
+# Signed download URLs (see `contented/signing.py`) are signed with this secret
+# and are valid for at most SIGNED_URL_MAX_AGE seconds. If SIGNED_URL_NGINX is
+# set, the URLs are signed in the format used by nginx's `secure_link` module,
+# so nginx can serve them (see `deploy_tools/nginx.template.conf`)
+
+SIGNED_URL_SECRET = os.getenv("SIGNED_URL_SECRET", SECRET_KEY)
+SIGNED_URL_MAX_AGE = int(os.getenv("SIGNED_URL_MAX_AGE", 7 * 24 * 60 * 60))
+SIGNED_URL_NGINX = bool(os.getenv("SIGNED_URL_NGINX", ""))
+
+# Filesystem calls on the project collection are made in a pool of
+# STORAGE_THREADS threads for each mount (see `contented/storage.py`), with at
+# most STORAGE_QUEUE further calls waiting. A call that takes longer than
+# STORAGE_TIMEOUT seconds is abandoned; after STORAGE_FAILURE_THRESHOLD such
+# calls in a row, the mount is not used for STORAGE_RETRY_AFTER seconds
+
+STORAGE_THREADS = int(os.getenv("STORAGE_THREADS", 4))
+STORAGE_QUEUE = int(os.getenv("STORAGE_QUEUE", 16))
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT", 10))
+STORAGE_FAILURE_THRESHOLD = int(os.getenv("STORAGE_FAILURE_THRESHOLD", 3))
+STORAGE_RETRY_AFTER = int(os.getenv("STORAGE_RETRY_AFTER", 30))
+
+# If set, downloaded files are copied (by a background job) into this
+# directory on local disk, and served from there while they are unchanged; the
+# least recently used copies are removed to keep the directory below
+# LOCAL_CACHE_MAX_BYTES (see `contented/local_cache.py`)
+
+LOCAL_CACHE_DIR = os.getenv("LOCAL_CACHE_DIR", "")
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 10 * 1024**3))
+
+# Downloads are recorded in the access log (see `contented/access_log.py`).
+# Each worker queues its access events and writes them in batches: once
+# ACCESS_LOG_BATCH_SIZE events are queued, or the oldest is
+# ACCESS_LOG_FLUSH_INTERVAL seconds old
+
+ACCESS_LOG_BATCH_SIZE = int(os.getenv("ACCESS_LOG_BATCH_SIZE", 100))
+ACCESS_LOG_FLUSH_INTERVAL = float(os.getenv("ACCESS_LOG_FLUSH_INTERVAL", 10))
+
+# Downloads are throttled (see `contented/throttle.py`) for each user, or for
+# each IP address if the user has not logged in: to THROTTLE_REQUEST_RATE
+# requests per second, in bursts of up to THROTTLE_REQUEST_BURST requests, and
+# to THROTTLE_BANDWIDTH bytes per second, in bursts of up to
+# THROTTLE_BANDWIDTH_BURST bytes. A rate of 0 turns that limit off
+
+THROTTLE_REQUEST_RATE = float(os.getenv("THROTTLE_REQUEST_RATE", 0))
+THROTTLE_REQUEST_BURST = int(os.getenv("THROTTLE_REQUEST_BURST", 20))
+THROTTLE_BANDWIDTH = float(os.getenv("THROTTLE_BANDWIDTH", 0))
+THROTTLE_BANDWIDTH_BURST = int(os.getenv("THROTTLE_BANDWIDTH_BURST", 100 * 1024 * 1024))
+
+# The state of the download throttle is kept in the "throttle" cache, which
+# must be shared by all workers: by default, a file-based cache in
+# CONTENTED_CACHE_DIR
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "throttle": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv(
+            "THROTTLE_CACHE_DIR", str(CONTENTED_CACHE_DIR / "throttle")
+        ),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
 # Move the user to the homepage on login/logout
 
 LOGIN_REDIRECT_URL = "home"
@@ -25,4 +25,38 @@ urlpatterns = [
     path(
         "projects/<str:project_id>/<path:file_name>", views.results_page, name="results"
     ),
+    path(
+        "snapshots/<str:project_id>/<str:version>/<path:file_name>",
+        views.snapshot_page,
+        name="snapshot",
+    ),
+    path("events/<str:project_id>", views.project_events, name="project_events"),
+    path("sign/<str:project_id>", views.sign_page, name="sign"),
+    path("sign/<str:project_id>/<path:file_name>", views.sign_page, name="sign"),
+    path(
+        "signed/<int:expires>/<str:token>/<path:signed_path>",
+        views.signed_download,
+        name="signed",
+    ),
+    path(
+        "signatures/<str:project_id>/<path:file_name>",
+        views.signature_page,
+        name="signature",
+    ),
+    path("manifest/<str:project_id>", views.manifest_page, name="manifest"),
+    path("whats-new/", views.whats_new_page, name="whats_new"),
+    path("search/", views.search_page, name="search"),
+    path("tables/<str:project_id>/<path:file_name>", views.table_page, name="table"),
+    path("tail/<str:project_id>/<path:file_name>", views.tail_page, name="tail"),
+    path(
+        "follow/<str:project_id>/<path:file_name>",
+        views.follow_events,
+        name="follow",
+    ),
+    path("uploads/<uuid:upload_id>", views.upload_page, name="upload"),
+    path(
+        "uploads/<str:project_id>/<path:file_name>",
+        views.upload_start,
+        name="upload_start",
+    ),
 ]
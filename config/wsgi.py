@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
 """
 
+import atexit
 import os
 
 from django.core.wsgi import get_wsgi_application
@@ -14,3 +15,18 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_wsgi_application()
+
+# Map the shared project listing (if one is configured) now: when gunicorn
+# preloads the application, this happens before the workers are forked, so
+# they all share the one mapping
+# pylint: disable=wrong-import-position
+from contented.shared_index import get_shared_index
+
+get_shared_index()
+
+# Write queued access events once they are due, even if the worker is idle,
+# and any that are still queued when the process exits
+from contented import access_log
+
+access_log.start_flush_timer()
+atexit.register(access_log.flush_at_exit)
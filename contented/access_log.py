@@ -0,0 +1,182 @@
+"""
+An append-only log of who downloaded which files (`models.AccessEvent`).
+
+Writing a row while serving each file would make every download wait for the
+database (and, with SQLite, for its write lock). Instead, each worker queues
+its events in memory and writes them in a single batch once
+`ACCESS_LOG_BATCH_SIZE` events are queued, or the oldest queued event is
+`ACCESS_LOG_FLUSH_INTERVAL` seconds old.
+
+The queue is checked when a request has finished (ie, after the response has
+been sent), so a batch is never written while a client is waiting. A worker
+that then sits idle would hold its events until it next served a request, so
+in a web server (see `config/wsgi.py`) a timer also writes them once they are
+due. Any events that are still queued are written when the worker exits; if a
+batch cannot be written, its events are kept and written with the next batch.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .models import AccessEvent
+from .sites import get_current_site
+from .throttle import get_client_ip
+
+logger = logging.getLogger(__name__)
+
+
+class AccessLog:
+    """
+    The queue of access events that have not yet been written.
+    """
+
+    def __init__(self):
+        self._events = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self.flush_on_timer = False
+        self._timer = None
+
+    def __len__(self):
+        return len(self._events)
+
+    def record(self, event):
+        with self._lock:
+            if not self._events:
+                self._oldest = time.monotonic()
+                self._start_timer()
+            self._events.append(event)
+
+    def _start_timer(self):
+        """
+        If `flush_on_timer` is set, and no timer is pending, start a timer that
+        writes the queued events once they are due. Called with the lock held.
+        """
+        if not self.flush_on_timer or self._timer is not None:
+            return
+        self._timer = threading.Timer(
+            settings.ACCESS_LOG_FLUSH_INTERVAL, self._flush_from_timer
+        )
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except DatabaseError:
+            logger.exception("Could not write %d access events", len(self))
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+
+    def is_due(self):
+        """
+        Whether the queued events should be written now.
+        """
+        if not self._events:
+            return False
+        if len(self._events) >= settings.ACCESS_LOG_BATCH_SIZE:
+            return True
+        return time.monotonic() - self._oldest >= settings.ACCESS_LOG_FLUSH_INTERVAL
+
+    def flush(self):
+        """
+        Write all queued events; return the number written. If the write
+        fails, the events are put back on the queue and the error is raised.
+        """
+        with self._lock:
+            events, self._events = self._events, []
+            oldest, self._oldest = self._oldest, None
+        if not events:
+            return 0
+
+        try:
+            AccessEvent.objects.bulk_create(events)
+        except DatabaseError:
+            with self._lock:
+                self._events[:0] = events
+                self._oldest = oldest
+                self._start_timer()
+            raise
+
+        return len(events)
+
+
+_access_log = AccessLog()
+
+
+def record_download(request, project_id, path, size, via=AccessEvent.LOGIN):
+    """
+    Queue an access event for the download of `<project_id>/<path>`.
+
+    For signed URLs (`via=AccessEvent.SIGNED`), the user is not looked up, as
+    that would need the session (and so, the database).
+    """
+    username = ""
+    if via == AccessEvent.LOGIN and request.user.is_authenticated:
+        username = request.user.get_username()
+
+    site = get_current_site()
+    _access_log.record(
+        AccessEvent(
+            timestamp=timezone.now(),
+            site=site.name,
+            username=username,
+            project_id=project_id,
+            path=str(path),
+            size=size,
+            via=via,
+            restricted=site.restrictions.is_restricted_file(project_id, path),
+            remote_addr=get_client_ip(request) or None,
+        )
+    )
+
+
+def flush_if_due():
+    """
+    Write the queued events if a batch is due. Errors are logged rather than
+    raised; the events stay queued until the next attempt.
+    """
+    if not _access_log.is_due():
+        return 0
+    try:
+        return _access_log.flush()
+    except DatabaseError:
+        logger.exception("Could not write %d access events", len(_access_log))
+        return 0
+
+
+def flush():
+    """
+    Write all queued events now; return the number written.
+    """
+    return _access_log.flush()
+
+
+def start_flush_timer():
+    """
+    Write queued events from a timer, once they are due, as well as when a
+    request finishes; called by `config/wsgi.py`, so that the events of a
+    worker that has gone idle are still written. (The timer writes from its
+    own thread, so it is not used by the test client.)
+    """
+    _access_log.flush_on_timer = True
+
+
+def flush_at_exit():
+    """
+    Write the queued events when the process exits; registered (with
+    `atexit`) by `config/wsgi.py`, so it runs when a gunicorn worker is shut
+    down gracefully.
+    """
+    try:
+        flush()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Could not write %d access events", len(_access_log))
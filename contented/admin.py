@@ -1,3 +1,186 @@
+import io
+import marshal
+import pstats
+
 from django.contrib import admin
+from django.db.models import Count, Sum
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from .models import AccessEvent, Job, RequestProfile
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        "kind",
+        "path",
+        "status",
+        "percent_complete",
+        "priority",
+        "attempts",
+        "created",
+        "finished",
+    )
+    list_filter = ("status", "kind")
+    search_fields = ("path",)
+    ordering = ("-created",)
+    readonly_fields = (
+        "source_mtime_ns",
+        "progress",
+        "error",
+        "started",
+        "finished",
+        "worker",
+        "heartbeat",
+    )
+    actions = ["retry_jobs"]
+
+    def percent_complete(self, job):
+        return f"{100 * job.progress:.0f}%"
+
+    def retry_jobs(self, request, queryset):
+        updated = queryset.exclude(status=Job.RUNNING).update(
+            status=Job.QUEUED, attempts=0, progress=0.0, error="", finished=None
+        )
+        self.message_user(request, f"Re-queued {updated} job(s)")
+
+    retry_jobs.short_description = "Re-queue selected jobs"
+
+
+@admin.register(AccessEvent)
+class AccessEventAdmin(admin.ModelAdmin):
+    """
+    The access log is read-only. Above the list of downloads, the number of
+    downloads (and bytes downloaded) is totalled for each project and for each
+    user; the totals follow the filters and search that are in use.
+    """
+
+    list_display = (
+        "timestamp",
+        "site",
+        "username",
+        "project_id",
+        "path",
+        "size",
+        "via",
+    )
+    list_filter = ("site", "restricted", "via", "project_id")
+    search_fields = ("username", "project_id", "path")
+    date_hierarchy = "timestamp"
+    ordering = ("-timestamp",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        try:
+            events = response.context_data["cl"].queryset.order_by()
+        except (AttributeError, KeyError):
+            # A redirect, or an error page
+            return response
+
+        response.context_data["project_totals"] = (
+            events.values("site", "project_id")
+            .annotate(
+                downloads=Count("id"),
+                users=Count("username", distinct=True),
+                total_size=Sum("size"),
+            )
+            .order_by("-downloads", "site", "project_id")
+        )
+        response.context_data["user_totals"] = (
+            events.values("username")
+            .annotate(
+                downloads=Count("id"),
+                projects=Count("project_id", distinct=True),
+                total_size=Sum("size"),
+            )
+            .order_by("-downloads", "username")
+        )
+        return response
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """
+    Profiles are made by adding `?profile=1` to a URL (see
+    `contented.profiling`); they can be viewed, downloaded and deleted here.
+    """
+
+    list_display = ("created", "method", "url", "status_code", "duration", "username")
+    list_filter = ("method", "status_code")
+    search_fields = ("url", "username")
+    ordering = ("-created",)
+    fields = (
+        "created",
+        "method",
+        "url",
+        "status_code",
+        "duration",
+        "username",
+        "download",
+        "top_functions",
+    )
+    readonly_fields = fields
+
+    # Functions shown, sorted by cumulative time, on the page for a profile
+    TOP_FUNCTIONS = 40
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:profile_id>/download/",
+                self.admin_site.admin_view(self.download_view),
+                name="contented_requestprofile_download",
+            )
+        ] + super().get_urls()
+
+    def download_view(self, request, profile_id):
+        profile = get_object_or_404(RequestProfile, pk=profile_id)
+        if not self.has_view_permission(request, profile):
+            return HttpResponse(status=403)
+        response = HttpResponse(
+            bytes(profile.stats), content_type="application/octet-stream"
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="profile-{profile.pk}.prof"'
+        )
+        return response
+
+    def download(self, profile):
+        url = reverse("admin:contented_requestprofile_download", args=[profile.pk])
+        return format_html('<a href="{}">profile-{}.prof</a>', url, profile.pk)
+
+    def top_functions(self, profile):
+        output = io.StringIO()
+        stats = pstats.Stats(_StatsLoader(profile.stats), stream=output)
+        stats.sort_stats("cumulative").print_stats(self.TOP_FUNCTIONS)
+        return format_html("<pre>{}</pre>", output.getvalue())
+
+
+class _StatsLoader:
+    """
+    Stands in for a profiler, so that `pstats.Stats` can load stored stats.
+    """
+
+    def __init__(self, stats):
+        self.stats = marshal.loads(bytes(stats))
 
-# Register your models here.
+    def create_stats(self):
+        pass
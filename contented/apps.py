@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ContentedConfig(AppConfig):
     name = "contented"
+
+    def ready(self):
+        # Connect the signal receivers
+        from . import receivers  # pylint: disable=import-outside-toplevel,unused-import
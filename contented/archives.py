@@ -0,0 +1,291 @@
+"""
+Projects that are stored as a single `.zip` or (uncompressed) `.tar` archive
+in the project collection, rather than as a directory.
+
+An archive `<project_id>.zip` is listed as the project `<project_id>` (unless
+there is also a directory of that name, which is served instead), and its
+members are served without extracting anything: each member is read from
+its offset in the archive. Members that are stored uncompressed (all members
+of a tar file, and 'stored' members of a zip file) can be read from any
+position, so ranged requests cost no more than the bytes that are sent;
+deflated zip members are decompressed as they are streamed.
+
+Finding the members of an archive means reading its central directory (zip)
+or every member header (tar), so the member index is cached: as JSON, in the
+`archives` directory of the site's cache (`CONTENTED_CACHE_DIR`, by default;
+see `contented.sites`), and in the memory of each process. The cached index
+records the size and modification-time of the archive, and is rebuilt if the
+archive changes.
+"""
+
+import json
+import os
+import posixpath
+import re
+import struct
+import tarfile
+import zipfile
+import zlib
+from pathlib import Path
+from typing import NamedTuple
+
+from . import storage
+from .cache_files import get_cache_path, get_temp_path
+from .sites import get_current_site, get_site_for_path
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar")
+
+READ_CHUNK_SIZE = 512 * 1024
+
+# The version of the layout of cached member indexes; indexes of an older
+# layout are rebuilt
+INDEX_FORMAT = 2
+
+# The fixed-size part of a zip file's local file header
+ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+
+RANGE_PATTERN = re.compile(r"^bytes=(?P<start>\d*)-(?P<end>\d*)$")
+
+
+class RangeNotSatisfiable(ValueError):
+    """
+    Raised when a requested byte-range lies outside of a member.
+    """
+
+
+class ArchiveMember(NamedTuple):
+    """
+    A file in an archive: `offset` is the position of its (possibly
+    compressed) data in the archive, and `compress_type` is the zip
+    compression method (`zipfile.ZIP_STORED` for tar members).
+    """
+
+    name: str
+    size: int
+    offset: int
+    compressed_size: int
+    compress_type: int
+
+    @property
+    def is_stored(self):
+        return self.compress_type == zipfile.ZIP_STORED
+
+
+def get_project_id(entry_name):
+    """
+    The project id for an entry in the project collection: the name of an
+    archive without its extension, otherwise the entry name itself.
+    """
+    for extension in ARCHIVE_EXTENSIONS:
+        if entry_name.endswith(extension) and len(entry_name) > len(extension):
+            return entry_name[: -len(extension)]
+    return entry_name
+
+
+def get_project_ids(entry_names):
+    """
+    The sorted project ids for the entries in a project collection. A
+    directory and an archive (or two archives) with the same project id are
+    listed once: the directory is served in preference to an archive.
+    """
+    return sorted({get_project_id(entry_name) for entry_name in entry_names})
+
+
+def find_archive(project_id, projects_dir=None):
+    """
+    The path of the archive that holds a project, or None if the project is
+    not stored as an archive.
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir)
+    for extension in ARCHIVE_EXTENSIONS:
+        archive_path = projects_dir / f"{project_id}{extension}"
+        if storage.is_file(archive_path):
+            return archive_path
+    return None
+
+
+def read_zip_members(archive_path):
+    """
+    The members of a zip file, read from its central directory; the offset of
+    each member's data is found from its local header.
+    """
+    members = []
+    with open(archive_path, "rb") as archive, zipfile.ZipFile(archive) as zip_file:
+        for info in zip_file.infolist():
+            if info.is_dir():
+                continue
+            archive.seek(info.header_offset)
+            header = ZIP_LOCAL_HEADER.unpack(archive.read(ZIP_LOCAL_HEADER.size))
+            name_length, extra_length = header[9], header[10]
+            members.append(
+                ArchiveMember(
+                    name=info.filename,
+                    size=info.file_size,
+                    offset=info.header_offset
+                    + ZIP_LOCAL_HEADER.size
+                    + name_length
+                    + extra_length,
+                    compressed_size=info.compress_size,
+                    compress_type=info.compress_type,
+                )
+            )
+    return members
+
+
+def read_tar_members(archive_path):
+    """
+    The (regular file) members of an uncompressed tar file. Member names are
+    normalised (eg, `./x` is listed as `x`), as they are in links.
+    """
+    with tarfile.open(archive_path, mode="r:") as tar_file:
+        return [
+            ArchiveMember(
+                name=posixpath.normpath(info.name),
+                size=info.size,
+                offset=info.offset_data,
+                compressed_size=info.size,
+                compress_type=zipfile.ZIP_STORED,
+            )
+            for info in tar_file
+            if info.isfile()
+        ]
+
+
+def get_index_path(archive_path):
+    """
+    Path of the cached member index for the archive at `archive_path`.
+    """
+    cache_dir = get_site_for_path(archive_path).cache_dir
+    return get_cache_path(cache_dir / "archives", archive_path, ".json")
+
+
+_loaded_indexes = {}
+
+
+def get_members(archive_path):
+    """
+    The members of an archive, as a dictionary from member name to
+    `ArchiveMember`, in the order they appear in the archive.
+
+    The index is read from the cache if it was built from the archive as it
+    is now; otherwise the archive is read, and the index is cached.
+    """
+    archive_stat = storage.run(archive_path, os.stat, archive_path)
+    version = [INDEX_FORMAT, archive_stat.st_size, archive_stat.st_mtime_ns]
+    key = os.path.abspath(archive_path)
+
+    loaded = _loaded_indexes.get(key)
+    if loaded is not None and loaded[0] == version:
+        return loaded[1]
+
+    index_path = get_index_path(archive_path)
+    members = None
+    try:
+        with open(index_path) as index_file:
+            cached = json.load(index_file)
+        if cached["version"] == version:
+            members = [ArchiveMember(*member) for member in cached["members"]]
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    if members is None:
+        if str(archive_path).endswith(".zip"):
+            members = read_zip_members(archive_path)
+        else:
+            members = read_tar_members(archive_path)
+
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = get_temp_path(index_path)
+        with open(tmp_path, "w") as index_file:
+            json.dump({"version": version, "members": members}, index_file)
+        os.replace(tmp_path, index_path)
+
+    members = {member.name: member for member in members}
+    _loaded_indexes[key] = (version, members)
+    return members
+
+
+def parse_range(range_header, size):
+    """
+    The `(start, end)` (end exclusive) of a single byte-range in a `Range`
+    header, or None if the header does not ask for a single range. Raises
+    `RangeNotSatisfiable` for a range outside of `size` bytes.
+    """
+    match = RANGE_PATTERN.match(range_header or "")
+    if not match or not (match.group("start") or match.group("end")):
+        return None
+
+    if not match.group("start"):
+        start, end = max(size - int(match.group("end")), 0), size
+    else:
+        start = int(match.group("start"))
+        end = min(int(match.group("end")) + 1, size) if match.group("end") else size
+
+    if start >= end:
+        raise RangeNotSatisfiable(range_header)
+    return start, end
+
+
+def iter_member(archive_path, member, start=0, end=None):
+    """
+    Yield bytes `start` to `end` (exclusive; default: the end of the member)
+    of an archive member, in chunks.
+
+    Stored members are read directly from the requested position; compressed
+    members are decompressed from the start, and the bytes before `start` are
+    skipped.
+    """
+    end = member.size if end is None else end
+    with storage.open_file(archive_path, "rb") as archive:
+        if member.is_stored:
+            archive.seek(member.offset + start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = archive.read(min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+            return
+
+        if member.compress_type == zipfile.ZIP_DEFLATED:
+            chunks = _inflate(archive, member)
+        else:
+            # Other methods (bzip2, lzma) are rare: let zipfile handle them
+            chunks = _read_with_zipfile(archive, member)
+
+        position = 0
+        for chunk in chunks:
+            chunk_start, position = position, position + len(chunk)
+            chunk = chunk[max(start - chunk_start, 0) : max(end - chunk_start, 0)]
+            if chunk:
+                yield chunk
+            if position >= end:
+                break
+
+
+def _inflate(archive, member):
+    """
+    Yield the decompressed data of a deflated zip member, in chunks of at most
+    `READ_CHUNK_SIZE` bytes (however well the data is compressed).
+    """
+    archive.seek(member.offset)
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    remaining = member.compressed_size
+    while remaining > 0:
+        compressed = archive.read(min(READ_CHUNK_SIZE, remaining))
+        if not compressed:
+            break
+        remaining -= len(compressed)
+        while True:
+            chunk = decompressor.decompress(compressed, READ_CHUNK_SIZE)
+            yield chunk
+            compressed = decompressor.unconsumed_tail
+            if not compressed and len(chunk) < READ_CHUNK_SIZE:
+                break
+    yield decompressor.flush()
+
+
+def _read_with_zipfile(archive, member):
+    with zipfile.ZipFile(archive) as zip_file, zip_file.open(member.name) as source:
+        yield from iter(lambda: source.read(READ_CHUNK_SIZE), b"")
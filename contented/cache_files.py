@@ -0,0 +1,35 @@
+"""
+Paths for the files that are derived from the project collection (eg, cached
+tables, archive member indexes, signatures and local copies of deliverables).
+
+Each derived file is keyed by the absolute path of the file that it is derived
+from, so that files with the same relative path in different collections do
+not collide. Derived files are written under a temporary name and then renamed
+into place, so that a reader never sees a partly-written file.
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+
+def get_cache_path(cache_dir, source_path, suffix=""):
+    """
+    Path, in `cache_dir`, of the file derived from the file at `source_path`:
+    `<cache_dir>/<key[:2]>/<key><suffix>`, where `key` is a digest of the
+    absolute path of the source file.
+    """
+    key = hashlib.sha1(str(os.path.abspath(source_path)).encode("utf8")).hexdigest()
+    return Path(cache_dir) / key[:2] / f"{key}{suffix}"
+
+
+def get_temp_path(path):
+    """
+    A temporary path, alongside `path`, to write a file to before it is
+    renamed to `path`. The name is hidden, and includes the process and thread
+    ids, so that workers (and the threads of a worker) that write the same
+    file at once each write their own temporary file.
+    """
+    path = Path(path)
+    return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
@@ -0,0 +1,123 @@
+"""
+Content-hashes for the files in the project index.
+
+Hashes are used by mirroring clients (see `views.manifest_page`) to decide
+which files they need to fetch. Each file is hashed once, by a background job,
+and the hash is kept in the index until the file changes. Storing a hash moves
+the file to a new generation of the index (recorded as a 'hashed' event), so
+that a client that has already fetched the manifest without the hash is sent
+it by its next request for the changes since then.
+
+BLAKE3 is used if the `blake3` package is installed (it is much faster than
+SHA-256 for large files); otherwise SHA-256 is used.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .index import get_collection_key
+from .models import FileEvent, ProjectFile
+from .sites import get_current_site
+
+try:
+    import blake3
+except ImportError:  # pragma: no cover - depends on the environment
+    blake3 = None
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Files are hashed in this many threads; hashlib and blake3 release the GIL
+# while hashing, so the threads do run in parallel
+HASH_THREADS = 4
+
+
+def get_hash_algorithm():
+    """
+    The name of the algorithm that new hashes are computed with.
+    """
+    return "blake3" if blake3 is not None else "sha256"
+
+
+def hash_file(path):
+    """
+    The hex-digest of the contents of the file at `path`.
+    """
+    hasher = blake3.blake3() if blake3 is not None else hashlib.sha256()
+    with open(path, "rb") as file_object:
+        for chunk in iter(lambda: file_object.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def _hash_entry(projects_dir, entry):
+    """
+    Hash the file for an index entry, provided it is unchanged since it was
+    indexed. Returns the digest, or None if the file has changed (it will be
+    re-indexed and hashed again later).
+    """
+    path = Path(projects_dir) / entry.project_id / entry.path
+    try:
+        before = os.stat(path)
+        if (before.st_size, before.st_mtime_ns) != (entry.size, entry.mtime_ns):
+            return None
+        digest = hash_file(path)
+        after = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    if (after.st_size, after.st_mtime_ns) != (entry.size, entry.mtime_ns):
+        return None
+    return digest
+
+
+def hash_project_files(project_id, projects_dir=None, report_progress=None):
+    """
+    Hash every file in a project that has no content-hash in the index.
+
+    A hash is only stored if the index entry still describes the file that was
+    hashed, so a file that changes while it is being hashed is not given a
+    stale hash. The files that are given a hash are moved to the generation of
+    a new 'hashed' event. Returns the number of files that were hashed.
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir)
+    collection = get_collection_key(projects_dir)
+    algorithm = get_hash_algorithm()
+    entries = list(
+        ProjectFile.objects.filter(
+            collection=collection,
+            project_id=project_id,
+            removed=False,
+            content_hash="",
+        )
+    )
+
+    hashed = 0
+    event = None
+    with ThreadPoolExecutor(HASH_THREADS) as pool:
+        digests = pool.map(lambda entry: _hash_entry(projects_dir, entry), entries)
+        for count, (entry, digest) in enumerate(zip(entries, digests), start=1):
+            if digest is not None:
+                if event is None:
+                    event = FileEvent.objects.create(
+                        collection=collection,
+                        project_id=project_id,
+                        path="",
+                        kind=FileEvent.HASHED,
+                    )
+                # Any change to the file since it was indexed has moved its
+                # entry to a later generation
+                hashed += ProjectFile.objects.filter(
+                    pk=entry.pk, generation=entry.generation
+                ).update(
+                    content_hash=digest,
+                    hash_algorithm=algorithm,
+                    generation=event.id,
+                )
+            if report_progress:
+                report_progress(count / len(entries))
+
+    return hashed
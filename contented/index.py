@@ -0,0 +1,350 @@
+"""
+The project index: a record, in the database, of every file in each project of
+a collection, and of every change made to those files.
+
+The index is kept up to date either by a full scan (`scan_collection`, see
+`./manage.py contented_index`) or, incrementally, by the filesystem watcher
+(`./manage.py contented_watch`). Each change is stored as a `FileEvent`, whose
+id is the generation of the index at which the change was made, and is
+announced using the `file_changed` signal so that derived artifacts can be
+invalidated. The per-project statistics in `ProjectSummary` are updated
+alongside each event.
+"""
+
+import datetime
+import os
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import FileEvent, ProjectFile, ProjectSummary
+from .signals import file_changed
+from .sites import get_current_site
+
+
+def get_collection_key(projects_dir=None):
+    """
+    The key under which a collection's files are stored in the index: the
+    absolute path of the collection directory.
+    """
+    return str(Path(projects_dir or get_current_site().projects_dir).resolve())
+
+
+def record_change(project_id, relative_path, projects_dir=None):
+    """
+    Compare the file at `<projects_dir>/<project_id>/<relative_path>` with its
+    entry in the index, and record any difference as a `FileEvent`. Hidden
+    entries of the collection (eg, `.snapshots`) are not projects: any files
+    that were indexed in them are recorded as removed.
+
+    Returns the new event, or None if the file is unchanged.
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir)
+    collection = get_collection_key(projects_dir)
+    relative_path = str(relative_path)
+    path = projects_dir / project_id / relative_path
+
+    try:
+        stat = path.stat()
+        exists = path.is_file() and not project_id.startswith(".")
+    except (FileNotFoundError, NotADirectoryError):
+        exists = False
+
+    with transaction.atomic():
+        entry = ProjectFile.objects.filter(
+            collection=collection, project_id=project_id, path=relative_path
+        ).first()
+
+        if exists:
+            if entry is None or entry.removed:
+                kind = FileEvent.CREATED
+            elif (entry.size, entry.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                kind = FileEvent.MODIFIED
+            else:
+                return None
+        elif entry is not None and not entry.removed:
+            kind = FileEvent.REMOVED
+        else:
+            return None
+
+        event = FileEvent.objects.create(
+            collection=collection, project_id=project_id, path=relative_path, kind=kind
+        )
+        new_size = stat.st_size if exists else 0
+        new_mtime_ns = stat.st_mtime_ns if exists else 0
+        old_size = entry.size if entry is not None and not entry.removed else 0
+
+        ProjectFile.objects.update_or_create(
+            collection=collection,
+            project_id=project_id,
+            path=relative_path,
+            defaults={
+                "size": new_size,
+                "mtime_ns": new_mtime_ns,
+                "generation": event.id,
+                "removed": not exists,
+                "content_hash": "",
+                "hash_algorithm": "",
+            },
+        )
+        if exists:
+            updated = datetime.datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        else:
+            updated = event.timestamp
+        update_summary(
+            collection,
+            project_id,
+            relative_path,
+            kind=kind,
+            size_change=new_size - old_size,
+            updated=updated,
+        )
+
+    file_changed.send(
+        sender=FileEvent,
+        path=path.resolve(),
+        project_id=project_id,
+        relative_path=relative_path,
+        kind=kind,
+    )
+    return event
+
+
+def get_file_type(relative_path):
+    """
+    The type of a file, as counted in `ProjectSummary.type_counts`: its
+    lower-cased extension, without the leading dot.
+    """
+    _, file_extension = os.path.splitext(str(relative_path))
+    return file_extension.lstrip(".").lower() or "(none)"
+
+
+def update_summary(collection, project_id, relative_path, kind, size_change, updated):
+    """
+    Apply the effect of a single change to a project's `ProjectSummary`; this
+    costs the same however many files the project contains.
+    """
+    summary, _ = ProjectSummary.objects.select_for_update().get_or_create(
+        collection=collection, project_id=project_id
+    )
+    file_type = get_file_type(relative_path)
+
+    if kind == FileEvent.CREATED:
+        summary.file_count += 1
+        summary.type_counts[file_type] = summary.type_counts.get(file_type, 0) + 1
+    elif kind == FileEvent.REMOVED:
+        summary.file_count -= 1
+        remaining = summary.type_counts.get(file_type, 0) - 1
+        if remaining > 0:
+            summary.type_counts[file_type] = remaining
+        else:
+            summary.type_counts.pop(file_type, None)
+
+    summary.total_size += size_change
+    if summary.last_updated is None or updated > summary.last_updated:
+        summary.last_updated = updated
+
+    summary.save()
+
+
+def get_summaries(projects_dir=None, project_ids=None):
+    """
+    The `ProjectSummary` for each indexed project in a collection (or just
+    for the projects in `project_ids`), as a dictionary keyed by project id.
+    """
+    summaries = ProjectSummary.objects.filter(
+        collection=get_collection_key(projects_dir)
+    )
+    if project_ids is not None:
+        summaries = summaries.filter(project_id__in=project_ids)
+    return {summary.project_id: summary for summary in summaries}
+
+
+def scan_project(project_id, projects_dir=None):
+    """
+    Bring the index for one project into line with the filesystem. Returns the
+    list of events that were recorded.
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir)
+    collection = get_collection_key(projects_dir)
+    project_path = projects_dir / project_id
+
+    on_disk = set()
+    if not project_id.startswith("."):
+        for root, _, files in os.walk(project_path):
+            relative_root = Path(root).relative_to(project_path)
+            for file_name in files:
+                on_disk.add(str(relative_root / file_name))
+
+    indexed = set(
+        ProjectFile.objects.filter(
+            collection=collection, project_id=project_id, removed=False
+        ).values_list("path", flat=True)
+    )
+
+    events = []
+    for relative_path in sorted(on_disk | indexed):
+        event = record_change(project_id, relative_path, projects_dir)
+        if event is not None:
+            events.append(event)
+
+    return events
+
+
+def scan_collection(projects_dir=None):
+    """
+    Bring the index for every project in a collection into line with the
+    filesystem, including projects that have been removed (and hidden entries
+    that were indexed as projects). Returns the list of events that were
+    recorded.
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir)
+    collection = get_collection_key(projects_dir)
+
+    project_ids = {
+        p
+        for p in os.listdir(projects_dir)
+        if not p.startswith(".") and (projects_dir / p).is_dir()
+    }
+    project_ids |= set(
+        ProjectFile.objects.filter(collection=collection, removed=False)
+        .values_list("project_id", flat=True)
+        .distinct()
+    )
+
+    events = []
+    for project_id in sorted(project_ids):
+        events.extend(scan_project(project_id, projects_dir))
+
+    return events
+
+
+def get_indexed_files(project_id, projects_dir=None):
+    """
+    The paths (relative to the project directory) of all files in the index for
+    a project, in sorted order.
+    """
+    return list(iter_indexed_files(project_id, projects_dir))
+
+
+def iter_indexed_files(project_id, projects_dir=None):
+    """
+    Yield the paths returned by `get_indexed_files`, without loading them all
+    from the database at once.
+    """
+    return (
+        ProjectFile.objects.filter(
+            collection=get_collection_key(projects_dir),
+            project_id=project_id,
+            removed=False,
+        )
+        .order_by("path")
+        .values_list("path", flat=True)
+        .iterator()
+    )
+
+
+def get_generation(project_id=None, projects_dir=None):
+    """
+    The current generation of the index (the id of the most recent event),
+    optionally restricted to a single project. Returns 0 for an empty index.
+    """
+    events = FileEvent.objects.filter(collection=get_collection_key(projects_dir))
+    if project_id is not None:
+        events = events.filter(project_id=project_id)
+
+    return events.aggregate(generation=Max("id"))["generation"] or 0
+
+
+def get_project_generations(projects_dir=None):
+    """
+    The generation of each project in the index (see `get_generation`), as a
+    dictionary from project id to generation.
+    """
+    events = FileEvent.objects.filter(collection=get_collection_key(projects_dir))
+    return dict(
+        events.values("project_id")
+        .annotate(generation=Max("id"))
+        .values_list("project_id", "generation")
+    )
+
+
+def get_events_since(generation, project_id=None, projects_dir=None):
+    """
+    All changes to files recorded after `generation`, in the order they were
+    recorded ('hashed' events are left out).
+    """
+    events = FileEvent.objects.filter(
+        collection=get_collection_key(projects_dir), id__gt=generation
+    ).exclude(kind=FileEvent.HASHED)
+    if project_id is not None:
+        events = events.filter(project_id=project_id)
+
+    return events.order_by("id")
+
+
+def get_changes_since(generation, project_ids=None, limit=None, projects_dir=None):
+    """
+    The net change to each file after `generation`, optionally restricted to
+    some projects, and to the first `limit` events.
+
+    Returns `(changes, last_generation)`: `changes` holds the last event for
+    each file whose state differs from that at `generation`, with `kind` set
+    to the overall change (a file that was created and then modified is
+    'created'; one that was created and then removed is left out), in the
+    order of those events. `last_generation` is the generation of the last
+    event that was read, so the next call can continue from there.
+
+    Only the events after `generation` are read, so the cost depends on the
+    number of changes rather than the number of files.
+    """
+    events = get_events_since(generation, projects_dir=projects_dir)
+    if project_ids is not None:
+        events = events.filter(project_id__in=list(project_ids))
+    if limit is not None:
+        events = events[:limit]
+
+    first_kinds, last_events = {}, {}
+    last_generation = generation
+    for event in events:
+        key = (event.project_id, event.path)
+        first_kinds.setdefault(key, event.kind)
+        last_events.pop(key, None)
+        last_events[key] = event
+        last_generation = event.id
+
+    changes = []
+    for key, event in last_events.items():
+        if first_kinds[key] == FileEvent.CREATED:
+            if event.kind == FileEvent.REMOVED:
+                continue
+            event.kind = FileEvent.CREATED
+        elif event.kind != FileEvent.REMOVED:
+            event.kind = FileEvent.MODIFIED
+        changes.append(event)
+
+    return changes, last_generation
+
+
+def get_manifest_entries(project_id, since=0, until=None, projects_dir=None):
+    """
+    The index entries for a project, in path order.
+
+    With `since=0`, all files that are present in the project are returned.
+    Otherwise, only the entries that changed after generation `since`
+    (including files that were removed, with `removed=True`) are returned.
+    Entries that changed after generation `until` are omitted.
+    """
+    entries = ProjectFile.objects.filter(
+        collection=get_collection_key(projects_dir), project_id=project_id
+    )
+    if since:
+        entries = entries.filter(generation__gt=since)
+    else:
+        entries = entries.filter(removed=False)
+    if until is not None:
+        entries = entries.filter(generation__lte=until)
+
+    return entries.order_by("path")
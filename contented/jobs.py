@@ -0,0 +1,293 @@
+"""
+A small, database-backed queue of background jobs.
+
+Views add work to the queue with `enqueue`; the work is carried out by
+`./manage.py contented_worker`, outside of the request/response cycle. Each
+kind of job has a handler, registered with `@register_job("<kind>")`, that is
+called with the `Job` and a callback for reporting progress.
+"""
+
+import datetime
+import os
+import socket
+from pathlib import Path
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import hashing, index, local_cache, signatures, tables
+from .models import Job
+from .sites import get_current_site
+
+JOB_HANDLERS = {}
+
+# For each kind of job that has one, a function that says whether the artifact
+# made from the file at a path is still present
+JOB_OUTPUT_CHECKS = {}
+
+# A failed job is run again, if it is asked for, once this long has passed
+FAILED_JOB_RETRY_AFTER = datetime.timedelta(minutes=10)
+
+# A running job whose worker has not reported on it for this long is taken to
+# have been abandoned
+RUNNING_JOB_TIMEOUT = datetime.timedelta(minutes=30)
+
+
+def register_job(kind, has_output=None):
+    """
+    Register the decorated function as the handler for jobs of type `kind`.
+
+    `has_output(path)`, if given, says whether the artifact made by a job is
+    still present; a finished job whose artifact has gone (eg, the cache was
+    cleared) is run again when it is next asked for.
+    """
+
+    def decorator(handler):
+        JOB_HANDLERS[kind] = handler
+        if has_output is not None:
+            JOB_OUTPUT_CHECKS[kind] = has_output
+        return handler
+
+    return decorator
+
+
+def enqueue(kind, path, priority=0, version=None):
+    """
+    Ask for the artifact of type `kind` to be computed from the file at `path`.
+
+    If a job for the same artifact, path and file modification-time already
+    exists, that job is returned rather than adding a new one. The job is put
+    back on the queue if it finished but its artifact has since gone, or if it
+    failed more than `FAILED_JOB_RETRY_AFTER` ago.
+
+    Jobs whose source is not a single file (eg, a whole project) can pass a
+    `version` (such as the generation of the project index) to be used in
+    place of the modification-time.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type '{kind}'")
+
+    path = os.path.abspath(path)
+    source_mtime_ns = os.stat(path).st_mtime_ns if version is None else version
+    lookup = {"kind": kind, "path": path, "source_mtime_ns": source_mtime_ns}
+
+    job = Job.objects.filter(**lookup).first()
+    if job is not None:
+        if needs_rerun(job):
+            Job.objects.filter(pk=job.pk, status=job.status).update(
+                status=Job.QUEUED,
+                priority=max(job.priority, priority),
+                progress=0.0,
+                attempts=0,
+                error="",
+                finished=None,
+            )
+            job.refresh_from_db()
+        return job
+
+    try:
+        with transaction.atomic():
+            return Job.objects.create(priority=priority, **lookup)
+    except IntegrityError:
+        # Another process enqueued the same job in the meantime
+        return Job.objects.get(**lookup)
+
+
+def needs_rerun(job):
+    """
+    Should a job that has already been enqueued be run again?
+    """
+    if job.status == Job.FAILED:
+        return (
+            job.finished is None
+            or timezone.now() - job.finished >= FAILED_JOB_RETRY_AFTER
+        )
+    if job.status == Job.DONE and job.kind in JOB_OUTPUT_CHECKS:
+        return not JOB_OUTPUT_CHECKS[job.kind](job.path)
+    return False
+
+
+def claim_next_job():
+    """
+    Mark the highest-priority queued job as running and return it.
+
+    The job is claimed with a conditional update, so if several workers try to
+    claim the same job, only one of them will get it. Returns None if there is
+    no work to do.
+    """
+    while True:
+        job = (
+            Job.objects.filter(status=Job.QUEUED)
+            .order_by("-priority", "created")
+            .first()
+        )
+        if job is None:
+            return None
+
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            started=now,
+            progress=0.0,
+            worker=get_worker_id(),
+            heartbeat=now,
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run_job(job):
+    """
+    Run the handler for a claimed job, recording success or failure.
+
+    A failing job is put back on the queue until it has been attempted
+    `job.max_attempts` times.
+    """
+
+    def report_progress(fraction):
+        Job.objects.filter(pk=job.pk).update(
+            progress=min(max(fraction, 0.0), 1.0), heartbeat=timezone.now()
+        )
+
+    job.attempts += 1
+    try:
+        JOB_HANDLERS[job.kind](job, report_progress)
+    except Exception as error:  # pylint: disable=broad-except
+        job.error = f"{type(error).__name__}: {error}"
+        job.status = Job.QUEUED if job.attempts < job.max_attempts else Job.FAILED
+        job.finished = timezone.now() if job.status == Job.FAILED else None
+    else:
+        job.error = ""
+        job.status = Job.DONE
+        job.progress = 1.0
+        job.finished = timezone.now()
+
+    job.save(update_fields=["attempts", "error", "status", "progress", "finished"])
+    return job
+
+
+def run_pending_jobs():
+    """
+    Run queued jobs, in priority order, until the queue is empty. Returns the
+    number of jobs that were run.
+    """
+    count = 0
+    job = claim_next_job()
+    while job is not None:
+        run_job(job)
+        count += 1
+        job = claim_next_job()
+
+    return count
+
+
+def get_worker_id():
+    """
+    Identify the current process, as the worker that is running a job
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_worker_alive(worker):
+    """
+    Is the worker identified by `worker` (see `get_worker_id`) still running?
+
+    Only workers on this host can be checked; those on other hosts are
+    assumed to be alive. The current process has not claimed any jobs yet
+    when this is called, so a job recorded against its pid was left by an
+    earlier process.
+    """
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def requeue_interrupted_jobs():
+    """
+    Put jobs that were left 'running' (eg, by a worker that was killed) back
+    on the queue.
+
+    A job is only taken from its worker if that worker is a process on this
+    host that has gone, or if it has not reported on the job (see
+    `report_progress` in `run_job`) for `RUNNING_JOB_TIMEOUT`; jobs being run
+    by other live workers are left alone.
+    """
+    cutoff = timezone.now() - RUNNING_JOB_TIMEOUT
+    running = Job.objects.filter(status=Job.RUNNING)
+    stale = Q(heartbeat__lt=cutoff) | Q(heartbeat__isnull=True, started__lt=cutoff)
+    abandoned = set(running.filter(stale).values_list("pk", flat=True))
+    abandoned.update(
+        pk
+        for pk, worker in running.exclude(stale).values_list("pk", "worker")
+        if not is_worker_alive(worker)
+    )
+    return running.filter(pk__in=abandoned).update(status=Job.QUEUED)
+
+
+def enqueue_project_hashing(project_id, projects_dir=None):
+    """
+    Ask for the files in a project that have no content-hash to be hashed. The
+    job is deduplicated by the generation of the project in the index.
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir)
+    return enqueue(
+        "hash",
+        projects_dir / project_id,
+        version=index.get_generation(project_id, projects_dir),
+    )
+
+
+# Handlers
+
+
+@register_job("table", has_output=tables.is_table_cache_fresh)
+def build_table(job, report_progress):
+    """
+    Build the columnar cache for a .csv / .tsv file
+    """
+    if not tables.is_table_cache_fresh(job.path):
+        tables.build_table_cache(job.path, report_progress=report_progress)
+
+
+@register_job(
+    "signature",
+    has_output=lambda path: signatures.get_cached_signature(path) is not None,
+)
+def build_signature(job, report_progress):
+    """
+    Compute the block signature of a results file
+    """
+    if signatures.get_cached_signature(job.path) is None:
+        signatures.build_signature_cache(job.path, report_progress=report_progress)
+
+
+@register_job("hash")
+def hash_project(job, report_progress):
+    """
+    Compute the content-hash of every file in a project that does not have one
+    """
+    project_path = os.path.normpath(job.path)
+    hashing.hash_project_files(
+        os.path.basename(project_path),
+        os.path.dirname(project_path),
+        report_progress=report_progress,
+    )
+
+
+@register_job("local_cache", has_output=local_cache.has_local_copy)
+def copy_to_local_cache(job, report_progress):
+    """
+    Copy a deliverable into the local read-through cache
+    """
+    local_cache.copy_to_local_cache(job.path, report_progress=report_progress)
@@ -0,0 +1,153 @@
+"""
+A read-through cache of deliverables on fast local disk.
+
+If `settings.LOCAL_CACHE_DIR` is set, files that are downloaded from the
+project collection are copied (by a background job) into that directory, and
+later downloads are served from the local copy. A local copy is only used if
+its size and modification-time match those of the original file, so a file
+that changes in the collection is never served stale.
+
+The cache holds at most `LOCAL_CACHE_MAX_BYTES`; once it is full, the least
+recently used copies are removed. Each use of a copy sets its access-time
+explicitly, so this works however the local disk is mounted (eg, `noatime`).
+"""
+
+import os
+import time
+
+from django.conf import settings
+
+from .cache_files import get_cache_path, get_temp_path
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def get_local_path(source_path):
+    """
+    Path of the local copy of the file at `source_path`; copies are keyed by
+    the absolute path of the original file.
+    """
+    return get_cache_path(settings.LOCAL_CACHE_DIR, source_path)
+
+
+def should_cache(source_stat):
+    """
+    Should a file (with stat result `source_stat`) be copied to local disk?
+    Files that would fill the whole cache are not.
+    """
+    return source_stat.st_size <= settings.LOCAL_CACHE_MAX_BYTES
+
+
+def find_local_copy(source_path, source_stat):
+    """
+    The path of a valid local copy of the file at `source_path` (whose stat
+    result is `source_stat`), or None if there is no such copy.
+    """
+    local_path = get_local_path(source_path)
+    try:
+        local_stat = os.stat(local_path)
+    except FileNotFoundError:
+        return None
+
+    if (local_stat.st_size, local_stat.st_mtime_ns) != (
+        source_stat.st_size,
+        source_stat.st_mtime_ns,
+    ):
+        return None
+
+    # Record the use of the copy, for least-recently-used eviction
+    os.utime(local_path, ns=(time.time_ns(), local_stat.st_mtime_ns))
+    return local_path
+
+
+def has_local_copy(source_path):
+    """
+    Is there a valid local copy of the file at `source_path`?
+    """
+    return find_local_copy(source_path, os.stat(source_path)) is not None
+
+
+def copy_to_local_cache(source_path, report_progress=None):
+    """
+    Copy the file at `source_path` into the local cache, then evict copies
+    until the cache is within its budget. Returns the path of the copy, or
+    None if the file changed while it was being copied (it will be copied
+    again when it is next downloaded).
+
+    The copy is written under a temporary name and moved into place, and is
+    given the modification-time of the original, which marks it as valid.
+    """
+    source_stat = os.stat(source_path)
+    local_path = find_local_copy(source_path, source_stat)
+    if local_path is not None:
+        return local_path
+
+    local_path = get_local_path(source_path)
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = get_temp_path(local_path)
+    try:
+        with open(source_path, "rb") as source, open(tmp_path, "wb") as copy:
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+                copy.write(chunk)
+                if report_progress and source_stat.st_size:
+                    report_progress(source.tell() / source_stat.st_size)
+
+        after = os.stat(source_path)
+        if (after.st_size, after.st_mtime_ns) != (
+            source_stat.st_size,
+            source_stat.st_mtime_ns,
+        ):
+            return None
+
+        os.utime(tmp_path, ns=(time.time_ns(), source_stat.st_mtime_ns))
+        os.replace(tmp_path, local_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    evict_local_copies()
+    return local_path
+
+
+def remove_local_copy(source_path):
+    """
+    Remove the local copy of a file, if there is one.
+    """
+    try:
+        get_local_path(source_path).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def evict_local_copies(max_bytes=None):
+    """
+    Remove the least recently used copies until the cache holds at most
+    `max_bytes` (default: `LOCAL_CACHE_MAX_BYTES`). Returns the number of
+    copies that were removed.
+    """
+    max_bytes = settings.LOCAL_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    copies = []
+    for root, _, file_names in os.walk(settings.LOCAL_CACHE_DIR):
+        for file_name in file_names:
+            if file_name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            copies.append((stat.st_atime_ns, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in copies)
+    removed = 0
+    for _, size, path in sorted(copies):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        removed += 1
+
+    return removed
@@ -0,0 +1,33 @@
+"""
+Build (or rebuild) the filename search index (see `contented.search`) of
+`PROJECTS_DIR`, and that of each site (see `contented.sites`). Once it has
+been built, the index is kept up to date as changes are recorded in the
+project index (eg, by `contented_watch`); otherwise, run this periodically.
+"""
+
+from django.core.management.base import BaseCommand
+
+from contented import search, sites
+
+
+class Command(BaseCommand):
+    help = "Build the index used to search for files across projects"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from-index",
+            action="store_true",
+            help="build from the project index rather than by crawling PROJECTS_DIR",
+        )
+
+    def handle(self, *args, **options):
+        for site in sites.get_all_sites():
+            with sites.use_site(site):
+                n_files = search.build_search_index(
+                    projects_dir=site.projects_dir,
+                    cache_dir=site.cache_dir,
+                    from_project_index=options["from_index"],
+                )
+            self.stdout.write(
+                f"{site.name or 'Default site'}: indexed {n_files} file(s)"
+            )
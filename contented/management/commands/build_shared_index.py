@@ -0,0 +1,38 @@
+"""
+Build (or rebuild) the shared, memory-mapped listing of `PROJECTS_DIR` at
+`CONTENTED_SHARED_INDEX`, and that of each site that has a `shared_index` (see
+`contented.sites`). Running gunicorn workers pick up the new listings within a
+few seconds.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contented import shared_index, sites
+
+
+class Command(BaseCommand):
+    help = "Build the shared project listings used by the gunicorn workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from-index",
+            action="store_true",
+            help="build from the project index rather than by crawling PROJECTS_DIR",
+        )
+
+    def handle(self, *args, **options):
+        indexed_sites = [site for site in sites.get_all_sites() if site.shared_index]
+        if not indexed_sites:
+            raise CommandError("CONTENTED_SHARED_INDEX is not set")
+
+        for site in indexed_sites:
+            shared_index.build_shared_index(
+                site.shared_index,
+                projects_dir=site.projects_dir,
+                from_project_index=options["from_index"],
+            )
+            index = shared_index.SharedIndex(site.shared_index)
+            self.stdout.write(
+                f"{site.name or 'Default site'}: indexed {index.n_files} file(s) "
+                f"in {index.n_projects} project(s)"
+            )
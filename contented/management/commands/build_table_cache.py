@@ -0,0 +1,60 @@
+"""
+Convert every .csv / .tsv file in the project collection into its columnar
+(Arrow IPC) form, so that the first query against a table does not have to
+parse it.
+
+Run this in the background (eg, from cron, or after new deliverables have been
+copied into `PROJECTS_DIR`); tables whose cached copy is still fresh are
+skipped. With `--enqueue`, the tables are converted by `contented_worker`
+rather than by this command. With `--site <host>`, the tables in the
+collection of that site are converted instead.
+"""
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contented import jobs, sites, tables
+
+
+class Command(BaseCommand):
+    help = "Build the columnar cache for all tables in PROJECTS_DIR"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--enqueue",
+            action="store_true",
+            help="queue a background job for each stale table instead of converting it",
+        )
+        parser.add_argument(
+            "--site",
+            default="",
+            help="host name of the site to use (default: the site set up in .env)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            site = sites.get_named_site(options["site"])
+        except KeyError:
+            raise CommandError(f"No site named {options['site']}") from None
+
+        built = 0
+        for root, _, files in os.walk(site.projects_dir):
+            for file_name in files:
+                source_path = os.path.join(root, file_name)
+                if not tables.is_table(source_path):
+                    continue
+                if tables.is_table_cache_fresh(source_path):
+                    continue
+                if options["enqueue"]:
+                    jobs.enqueue("table", source_path)
+                    built += 1
+                    continue
+                try:
+                    tables.build_table_cache(source_path)
+                    built += 1
+                except Exception as error:  # pylint: disable=broad-except
+                    self.stderr.write(f"Could not convert {source_path}: {error}")
+
+        action = "Queued" if options["enqueue"] else "Built"
+        self.stdout.write(f"{action} {built} cached table(s)")
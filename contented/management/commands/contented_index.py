@@ -0,0 +1,39 @@
+"""
+Bring the project index for `PROJECTS_DIR` (or the collection of a site, see
+`--site`) into line with the filesystem, and queue the hashing of any files
+that have no content-hash.
+
+Run this once before relying on the index (see `CONTENTED_USE_INDEX`), and
+periodically if the collection is changed without `contented_watch` running
+(eg, from another host of a network filesystem).
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contented import index, jobs, sites
+
+
+class Command(BaseCommand):
+    help = "Scan PROJECTS_DIR and update the project index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--site",
+            default="",
+            help="host name of the site to use (default: the site set up in .env)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            site = sites.get_named_site(options["site"])
+        except KeyError:
+            raise CommandError(f"No site named {options['site']}") from None
+        with sites.use_site(site):
+            events = index.scan_collection(site.projects_dir)
+            for project_id in sorted({e.project_id for e in events}):
+                if (site.projects_dir / project_id).is_dir():
+                    jobs.enqueue_project_hashing(project_id)
+            self.stdout.write(
+                f"Recorded {len(events)} change(s); index is at generation "
+                f"{index.get_generation()}"
+            )
@@ -0,0 +1,49 @@
+"""
+Publish a directory of deliverables as a new snapshot of a project (see
+`contented.snapshots`), and make it the latest snapshot.
+
+The directory is moved into `PROJECTS_DIR/.snapshots/<project_id>/`, so it
+must be on the same filesystem as the project collection. The project
+directory must be a symlink to an earlier snapshot, or must not exist yet.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from contented import index, sites, snapshots
+
+
+class Command(BaseCommand):
+    help = "Publish a directory as the latest snapshot of a project"
+
+    def add_arguments(self, parser):
+        parser.add_argument("project_id")
+        parser.add_argument("source_dir", help="the directory to publish")
+        parser.add_argument(
+            "--name",
+            default="",
+            help="name of the snapshot (default: the current UTC time)",
+        )
+        parser.add_argument(
+            "--site",
+            default="",
+            help="host name of the site to use (default: the site set up in .env)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            site = sites.get_named_site(options["site"])
+        except KeyError:
+            raise CommandError(f"No site named {options['site']}") from None
+        with sites.use_site(site):
+            try:
+                version = snapshots.publish_snapshot(
+                    options["project_id"], options["source_dir"], options["name"]
+                )
+            except (snapshots.SnapshotError, OSError) as error:
+                raise CommandError(str(error)) from None
+            if settings.CONTENTED_USE_INDEX:
+                index.scan_project(options["project_id"], site.projects_dir)
+            self.stdout.write(
+                f"Published snapshot {version} of {options['project_id']}"
+            )
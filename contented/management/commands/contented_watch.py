@@ -0,0 +1,42 @@
+"""
+Watch `PROJECTS_DIR` (or the collection of a site, see `--site`) using
+inotify and keep the project index (and any derived artifacts) up to date as
+files are created, modified and removed.
+
+Linux only; see `./deploy_tools/contented-watch-systemd.template.service`.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contented import sites, watcher
+
+
+class Command(BaseCommand):
+    help = "Watch PROJECTS_DIR for changes and update the project index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--settle-time",
+            type=float,
+            default=0.5,
+            help="seconds to collect changes for before applying them",
+        )
+        parser.add_argument(
+            "--site",
+            default="",
+            help="host name of the site to use (default: the site set up in .env)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            site = sites.get_named_site(options["site"])
+        except KeyError:
+            raise CommandError(f"No site named {options['site']}") from None
+        with sites.use_site(site):
+            self.stdout.write(f"Watching {site.projects_dir}")
+            try:
+                watcher.watch_collection(
+                    site.projects_dir, settle_time=options["settle_time"]
+                )
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,74 @@
+"""
+Run the background jobs that have been queued by `contented` (see
+`contented.jobs`) using a pool of worker processes.
+
+    ./manage.py contented_worker --processes 4
+
+Use `--once` to run the jobs that are currently queued and then exit (eg, when
+running the worker from cron rather than as a service).
+"""
+
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from contented import jobs
+
+
+def work(poll_interval, once):
+    """
+    Repeatedly claim and run jobs; wait for `poll_interval` seconds whenever
+    the queue is empty.
+    """
+    while True:
+        ran = jobs.run_pending_jobs()
+        if once:
+            return
+        if not ran:
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (derived artifacts etc) for contented"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes", type=int, default=1, help="number of worker processes"
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="seconds to wait before checking an empty queue again",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="exit once the queue is empty"
+        )
+
+    def handle(self, *args, **options):
+        requeued = jobs.requeue_interrupted_jobs()
+        if requeued:
+            self.stdout.write(f"Re-queued {requeued} interrupted job(s)")
+
+        if options["processes"] <= 1:
+            work(options["poll_interval"], options["once"])
+            return
+
+        # Each child process must open its own database connection
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(
+                target=work, args=(options["poll_interval"], options["once"])
+            )
+            for _ in range(options["processes"])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -0,0 +1,38 @@
+"""
+Export the public projects of `PROJECTS_DIR` (or of a site, see `--site`) as
+static pages and hard-linked deliverables, for nginx to serve to users who
+are not logged in (see `contented.static_export`, and the `/projects/`
+locations in deploy_tools/nginx.template.conf).
+
+Only the projects that have changed since the last export are exported
+again, so this can be run frequently (eg, from cron, or after each
+`contented_index`).
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contented import sites, static_export
+
+
+class Command(BaseCommand):
+    help = "Export the public projects as a static site for nginx"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output_dir", help="directory to export into")
+        parser.add_argument(
+            "--site",
+            default="",
+            help="host name of the site to use (default: the site set up in .env)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            site = sites.get_named_site(options["site"])
+        except KeyError:
+            raise CommandError(f"No site named {options['site']}") from None
+        with sites.use_site(site):
+            counts = static_export.export_static(options["output_dir"])
+        self.stdout.write(
+            f"Exported {counts['exported']} project(s); "
+            f"{counts['unchanged']} unchanged, {counts['removed']} removed"
+        )
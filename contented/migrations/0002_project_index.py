@@ -0,0 +1,75 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contented", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileEvent",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("collection", models.CharField(max_length=1024)),
+                ("project_id", models.CharField(max_length=255)),
+                ("path", models.CharField(max_length=1024)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("created", "Created"),
+                            ("modified", "Modified"),
+                            ("removed", "Removed"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ProjectFile",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("collection", models.CharField(max_length=1024)),
+                ("project_id", models.CharField(max_length=255)),
+                ("path", models.CharField(max_length=1024)),
+                ("size", models.BigIntegerField()),
+                ("mtime_ns", models.BigIntegerField()),
+                ("generation", models.BigIntegerField()),
+                ("removed", models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="projectfile",
+            index=models.Index(
+                fields=["collection", "project_id", "generation"],
+                name="contented_p_collect_518037_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="projectfile",
+            constraint=models.UniqueConstraint(
+                fields=("collection", "project_id", "path"), name="unique_project_file"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="fileevent",
+            index=models.Index(
+                fields=["collection", "project_id", "id"],
+                name="contented_f_collect_0ceaed_idx",
+            ),
+        ),
+    ]
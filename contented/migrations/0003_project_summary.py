@@ -0,0 +1,74 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:08
+
+import datetime
+import os
+
+from django.db import migrations, models
+
+
+def summarise_indexed_projects(apps, schema_editor):
+    """
+    Build the summaries for any projects that were indexed before summaries
+    were maintained.
+    """
+    ProjectFile = apps.get_model("contented", "ProjectFile")
+    ProjectSummary = apps.get_model("contented", "ProjectSummary")
+
+    summaries = {}
+    for entry in ProjectFile.objects.filter(removed=False).iterator():
+        key = (entry.collection, entry.project_id)
+        summary = summaries.setdefault(
+            key,
+            ProjectSummary(collection=entry.collection, project_id=entry.project_id),
+        )
+        file_type = os.path.splitext(entry.path)[1].lstrip(".").lower() or "(none)"
+        updated = datetime.datetime.fromtimestamp(
+            entry.mtime_ns / 1e9, tz=datetime.timezone.utc
+        )
+        summary.file_count += 1
+        summary.total_size += entry.size
+        summary.type_counts[file_type] = summary.type_counts.get(file_type, 0) + 1
+        if summary.last_updated is None or updated > summary.last_updated:
+            summary.last_updated = updated
+
+    ProjectSummary.objects.bulk_create(summaries.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contented", "0002_project_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProjectSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("collection", models.CharField(max_length=1024)),
+                ("project_id", models.CharField(max_length=255)),
+                ("file_count", models.BigIntegerField(default=0)),
+                ("total_size", models.BigIntegerField(default=0)),
+                ("last_updated", models.DateTimeField(blank=True, null=True)),
+                ("type_counts", models.JSONField(default=dict)),
+            ],
+            options={
+                "verbose_name_plural": "project summaries",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="projectsummary",
+            constraint=models.UniqueConstraint(
+                fields=("collection", "project_id"), name="unique_project_summary"
+            ),
+        ),
+        migrations.RunPython(summarise_indexed_projects, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contented", "0003_project_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="projectfile",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="projectfile",
+            name="hash_algorithm",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
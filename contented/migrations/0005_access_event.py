@@ -0,0 +1,46 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contented", "0004_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AccessEvent",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("timestamp", models.DateTimeField()),
+                ("username", models.CharField(blank=True, max_length=150)),
+                ("project_id", models.CharField(max_length=255)),
+                ("path", models.CharField(max_length=1024)),
+                ("size", models.BigIntegerField()),
+                (
+                    "via",
+                    models.CharField(
+                        choices=[("login", "Project page"), ("signed", "Signed URL")],
+                        max_length=16,
+                    ),
+                ),
+                ("restricted", models.BooleanField(default=False)),
+                ("remote_addr", models.GenericIPAddressField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="accessevent",
+            index=models.Index(
+                fields=["project_id", "timestamp"],
+                name="contented_a_project_21b183_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="accessevent",
+            index=models.Index(
+                fields=["username", "timestamp"], name="contented_a_usernam_52af52_idx"
+            ),
+        ),
+    ]
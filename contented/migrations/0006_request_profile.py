@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contented", "0005_access_event"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RequestProfile",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("method", models.CharField(max_length=16)),
+                ("url", models.CharField(max_length=2048)),
+                ("status_code", models.PositiveSmallIntegerField()),
+                ("duration", models.FloatField(help_text="Time taken, in seconds")),
+                ("username", models.CharField(max_length=150)),
+                ("stats", models.BinaryField()),
+            ],
+        ),
+    ]
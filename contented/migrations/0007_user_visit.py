@@ -0,0 +1,46 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("contented", "0006_request_profile"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserVisit",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("collection", models.CharField(max_length=1024)),
+                ("seen_generation", models.BigIntegerField(default=0)),
+                ("visited", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="uservisit",
+            constraint=models.UniqueConstraint(
+                fields=("user", "collection"), name="unique_user_visit"
+            ),
+        ),
+    ]
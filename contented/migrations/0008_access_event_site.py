@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contented", "0007_user_visit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="accessevent",
+            name="site",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+    ]
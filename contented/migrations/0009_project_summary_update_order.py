@@ -0,0 +1,20 @@
+# Generated by Django 3.1.14 on 2026-10-19 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contented", "0008_access_event_site"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="projectsummary",
+            index=models.Index(
+                fields=["collection", "-last_updated", "project_id"],
+                name="contented_p_collect_ef9f53_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-19 05:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contented", "0010_upload"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="fileevent",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("created", "Created"),
+                    ("modified", "Modified"),
+                    ("removed", "Removed"),
+                    ("hashed", "Hashed"),
+                ],
+                max_length=16,
+            ),
+        ),
+    ]
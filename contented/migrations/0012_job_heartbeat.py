@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-19 05:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contented", "0011_fileevent_hashed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="heartbeat",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="worker",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -1,3 +1,263 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class Job(models.Model):
+    """
+    A request to compute an artifact that is derived from a file in the project
+    collection (eg, a columnar copy of a table).
+
+    Jobs are deduplicated by the kind of artifact, the path of the source file
+    and the modification-time of that file: requesting the same artifact for an
+    unchanged file does not add a second job.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=64)
+    path = models.CharField(max_length=1024)
+    source_mtime_ns = models.BigIntegerField()
+    priority = models.IntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.FloatField(default=0.0)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    # The "<host>:<pid>" of the worker running the job, and when that worker
+    # last reported on it
+    worker = models.CharField(max_length=255, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "path", "source_mtime_ns"], name="unique_job"
+            )
+        ]
+        indexes = [models.Index(fields=["status", "-priority", "created"])]
+
+    def __str__(self):
+        return f"{self.kind}: {self.path}"
+
+
+class FileEvent(models.Model):
+    """
+    A change (creation, modification or removal) to a file in a project.
+
+    Events are numbered in the order that they were recorded; that number is
+    the 'generation' of the project index at which the change was made.
+
+    A 'hashed' event (with an empty path) records that content-hashes were
+    stored for some files of a project, which moves those files to the new
+    generation; it is not a change to the files themselves.
+    """
+
+    CREATED = "created"
+    MODIFIED = "modified"
+    REMOVED = "removed"
+    HASHED = "hashed"
+    KIND_CHOICES = [
+        (CREATED, "Created"),
+        (MODIFIED, "Modified"),
+        (REMOVED, "Removed"),
+        (HASHED, "Hashed"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    collection = models.CharField(max_length=1024)
+    project_id = models.CharField(max_length=255)
+    path = models.CharField(max_length=1024)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["collection", "project_id", "id"])]
+
+    def __str__(self):
+        return f"{self.kind}: {self.project_id}/{self.path}"
+
+
+class ProjectFile(models.Model):
+    """
+    An entry in the project index: the size and modification-time of a file in
+    a project, as of the most recent `FileEvent` for that file.
+
+    Files that have been removed are kept (as `removed=True`) so that clients
+    can find out what has been deleted since a given generation.
+    """
+
+    collection = models.CharField(max_length=1024)
+    project_id = models.CharField(max_length=255)
+    path = models.CharField(max_length=1024)
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    generation = models.BigIntegerField()
+    removed = models.BooleanField(default=False)
+    # Digest of the file's contents; cleared whenever the file changes and
+    # recomputed by a background job (see `contented.hashing`)
+    content_hash = models.CharField(max_length=64, blank=True)
+    hash_algorithm = models.CharField(max_length=16, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["collection", "project_id", "path"], name="unique_project_file"
+            )
+        ]
+        indexes = [models.Index(fields=["collection", "project_id", "generation"])]
+
+    def __str__(self):
+        return f"{self.project_id}/{self.path}"
+
+
+class ProjectSummary(models.Model):
+    """
+    Aggregate statistics for a project in the project index.
+
+    The statistics are updated each time a `FileEvent` is recorded for the
+    project (rather than being recomputed from its files), so that they can be
+    shown for every project on the home page cheaply.
+    """
+
+    collection = models.CharField(max_length=1024)
+    project_id = models.CharField(max_length=255)
+    file_count = models.BigIntegerField(default=0)
+    total_size = models.BigIntegerField(default=0)
+    last_updated = models.DateTimeField(null=True, blank=True)
+    # Number of files with each (lower-cased) file extension
+    type_counts = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["collection", "project_id"], name="unique_project_summary"
+            )
+        ]
+        # For listing the projects by their last update (see `home_page`)
+        indexes = [models.Index(fields=["collection", "-last_updated", "project_id"])]
+        verbose_name_plural = "project summaries"
+
+    def __str__(self):
+        return self.project_id
+
+    def type_breakdown(self):
+        """
+        The file extensions in the project, with the number of files that have
+        each one; most common first.
+        """
+        return sorted(self.type_counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+class AccessEvent(models.Model):
+    """
+    A download (or view) of a file from a project.
+
+    Access events are only ever added; they are queued in each worker and
+    written in batches (see `contented.access_log`), so `timestamp` is the time
+    of the download rather than the time the row was written.
+    """
+
+    LOGIN = "login"
+    SIGNED = "signed"
+    VIA_CHOICES = [(LOGIN, "Project page"), (SIGNED, "Signed URL")]
+
+    id = models.BigAutoField(primary_key=True)
+    timestamp = models.DateTimeField()
+    # The host name of the site that served the download (see
+    # `contented.sites`); empty for the default site
+    site = models.CharField(max_length=255, blank=True, default="")
+    # Empty for users who have not logged in (and for signed URLs, which are
+    # not tied to a session)
+    username = models.CharField(max_length=150, blank=True)
+    project_id = models.CharField(max_length=255)
+    path = models.CharField(max_length=1024)
+    size = models.BigIntegerField()
+    via = models.CharField(max_length=16, choices=VIA_CHOICES)
+    restricted = models.BooleanField(default=False)
+    remote_addr = models.GenericIPAddressField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["project_id", "timestamp"]),
+            models.Index(fields=["username", "timestamp"]),
+        ]
+
+    def __str__(self):
+        return f"{self.username or '(anonymous)'}: {self.project_id}/{self.path}"
+
+
+class RequestProfile(models.Model):
+    """
+    A profile of a single request, made at the request of a staff user (see
+    `contented.profiling`). `stats` holds the profile in the format written by
+    `cProfile.Profile.dump_stats`, so it can be loaded with `pstats` or
+    viewed with tools like snakeviz.
+    """
+
+    created = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=16)
+    url = models.CharField(max_length=2048)
+    status_code = models.PositiveSmallIntegerField()
+    duration = models.FloatField(help_text="Time taken, in seconds")
+    username = models.CharField(max_length=150)
+    stats = models.BinaryField()
+
+    def __str__(self):
+        return f"{self.method} {self.url}"
+
+
+class UserVisit(models.Model):
+    """
+    The generation of the project index that a user had seen when they last
+    looked at their "what's new" feed; the feed lists the changes made after
+    it.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    collection = models.CharField(max_length=1024)
+    seen_generation = models.BigIntegerField(default=0)
+    visited = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "collection"], name="unique_user_visit"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.seen_generation}"
+
+
+class Upload(models.Model):
+    """
+    A file that is being uploaded into a project (see `contented.uploads`);
+    `received` is the number of bytes that have been written to its staging
+    file so far.
+    """
+
+    id = models.UUIDField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    site = models.CharField(max_length=255, blank=True, default="")
+    project_id = models.CharField(max_length=255)
+    path = models.CharField(max_length=1024)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    received = models.BigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.project_id}/{self.path}"
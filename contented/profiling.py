@@ -0,0 +1,101 @@
+"""
+On-demand profiling of single requests.
+
+A staff user can profile any request by adding `?profile=1` to its URL, or
+by sending an `X-Profile` header. The request is run under `cProfile`, and the
+profile is saved as a `models.RequestProfile`, which can be browsed (and
+downloaded, as a `.prof` file) in the Django admin. The admin URL of the
+profile is returned in the `X-Profile` header of the response.
+
+Requests that do not ask to be profiled only pay for the check of the query
+string and headers; the user is not looked up for them.
+"""
+
+import cProfile
+import marshal
+import time
+
+from django.http import FileResponse
+from django.urls import reverse
+
+from .models import RequestProfile
+
+PROFILE_PARAMETER = "profile"
+PROFILE_HEADER = "HTTP_X_PROFILE"
+
+
+def wants_profile(request):
+    """
+    Whether a request asks to be profiled (the user is not checked here).
+    """
+    return PROFILE_PARAMETER in request.GET or PROFILE_HEADER in request.META
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests that ask for it, if they are made by a staff user. Must
+    come after `AuthenticationMiddleware`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not wants_profile(request) or not request.user.is_staff:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - start
+
+        profiler.create_stats()
+        profile = RequestProfile.objects.create(
+            method=request.method,
+            url=request.get_full_path(),
+            status_code=response.status_code,
+            duration=duration,
+            username=request.user.get_username(),
+            stats=marshal.dumps(profiler.stats),
+        )
+        response["X-Profile"] = reverse(
+            "admin:contented_requestprofile_change", args=[profile.pk]
+        )
+        # Include the generation of streamed pages in the profile, as they are
+        # sent (files are sent as they are, so are left out)
+        if response.streaming and not isinstance(response, FileResponse):
+            response.streaming_content = profile_stream(
+                response.streaming_content, profiler, profile
+            )
+        return response
+
+
+def profile_stream(content, profiler, profile):
+    """
+    Yield the chunks of a streamed response, profiling the generation of each
+    one (but not the wait for the client to take it), without holding the
+    response in memory. The stored `profile` is updated once the stream ends.
+    """
+    chunks = iter(content)
+    duration = profile.duration
+    try:
+        while True:
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                chunk = next(chunks, None)
+            finally:
+                profiler.disable()
+                duration += time.perf_counter() - start
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        profiler.create_stats()
+        RequestProfile.objects.filter(pk=profile.pk).update(
+            duration=duration, stats=marshal.dumps(profiler.stats)
+        )
@@ -0,0 +1,79 @@
+"""
+Receivers for the signals in `contented.signals`, which keep derived artifacts
+in step with the files in the project collection, and for Django's own
+signals.
+"""
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import access_log, jobs, local_cache, search, signatures, tables
+from .models import FileEvent
+from .signals import file_changed
+
+
+@receiver(file_changed)
+def invalidate_table_cache(sender, path, kind, **kwargs):
+    """
+    Drop the columnar copy of a table that has changed; large tables are
+    queued for conversion straight away, so they are ready when next queried.
+    """
+    if not tables.is_table(path):
+        return
+
+    tables.remove_table_cache(path)
+    if kind == FileEvent.REMOVED or not path.is_file():
+        return
+    if path.stat().st_size > tables.INLINE_BUILD_MAX_BYTES:
+        jobs.enqueue("table", path)
+
+
+@receiver(file_changed)
+def invalidate_local_copy(sender, path, **kwargs):
+    """
+    Drop the local copy of a file that has changed (a stale copy would not be
+    served, but this frees its space straight away).
+    """
+    if settings.LOCAL_CACHE_DIR:
+        local_cache.remove_local_copy(path)
+
+
+@receiver(file_changed)
+def invalidate_signature(sender, path, **kwargs):
+    """
+    Drop the cached block signature of a file that has changed.
+    """
+    signatures.remove_signature_cache(path)
+
+
+@receiver(file_changed)
+def update_search_index(sender, path, project_id, relative_path, kind, **kwargs):
+    """
+    Add a new file to the search index (see `contented.search`), or remove a
+    file that has been removed from the collection.
+    """
+    search.update_file(
+        path, project_id, relative_path, removed=kind == FileEvent.REMOVED
+    )
+
+
+@receiver(request_finished)
+def write_access_log(sender, **kwargs):
+    """
+    Write the queued access events, if a batch is due, once the response has
+    been sent.
+    """
+    access_log.flush_if_due()
+
+
+@receiver(connection_created)
+def use_sqlite_wal(sender, connection, **kwargs):
+    """
+    Put SQLite databases into write-ahead-logging mode, so that pages can be
+    read while a batch of access events (or index changes) is being written.
+    """
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=WAL")
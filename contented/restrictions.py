@@ -0,0 +1,89 @@
+"""
+Restriction rules: which projects, folders and files can only be seen by
+logged-in users.
+
+Each rule is a pattern that is matched against paths of the form
+`<project_id>` or `<project_id>/<path-in-project>`:
+
+- `client-*` restricts every project whose name starts with `client-`;
+- `*/raw_data/` restricts the `raw_data` folder of every project;
+- `my_project/notes.txt` restricts a single file;
+- `re:client-\\d+` is a regular expression, rather than a glob.
+
+In globs, `*` and `?` match within a single path component, and `**` matches
+across components. A rule that matches a project or folder also matches
+everything in it. A rule that starts with `!` allows the paths that it
+matches, as an exception to the rules before it: where several rules match a
+path, the last of them decides (so `client-*` followed by `!client-demo`
+restricts every client project except `client-demo`).
+
+The rules are compiled into a single regular expression, so checking a path
+costs one match however many rules there are; compiled rules are cached for
+each list of rules.
+"""
+
+import functools
+import re
+
+ALLOW_PREFIX = "!"
+REGEX_PREFIX = "re:"
+
+
+def glob_to_regex(pattern):
+    """
+    The regular expression for a glob pattern (see above); a trailing `/` is
+    dropped, as a rule matches the contents of a folder anyway.
+    """
+    parts = re.split(r"(\*\*|\*|\?)", pattern.rstrip("/"))
+    wildcards = {"**": ".*", "*": "[^/]*", "?": "[^/]"}
+    return "".join(wildcards.get(part, re.escape(part)) for part in parts)
+
+
+class RestrictionRules:
+    """
+    A compiled list of restriction rules.
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rule.strip() for rule in rules if rule.strip())
+
+        # The rules are tried from the last to the first, so the first
+        # alternative that matches is the rule that decides
+        alternatives = []
+        for number in reversed(range(len(self.rules))):
+            rule = self.rules[number]
+            kind = "allow" if rule.startswith(ALLOW_PREFIX) else "deny"
+            pattern = rule[len(ALLOW_PREFIX) :] if kind == "allow" else rule
+            if pattern.startswith(REGEX_PREFIX):
+                regex = pattern[len(REGEX_PREFIX) :]
+            else:
+                regex = glob_to_regex(pattern)
+            alternatives.append(f"(?P<{kind}_{number}>(?:{regex})(?:/.*)?)")
+
+        self._matcher = None
+        if alternatives:
+            self._matcher = re.compile("|".join(alternatives), re.DOTALL)
+
+    def __bool__(self):
+        return self._matcher is not None
+
+    def is_restricted(self, path):
+        """
+        Does a rule restrict `path` (`<project_id>` or
+        `<project_id>/<path-in-project>`)?
+        """
+        if self._matcher is None:
+            return False
+        match = self._matcher.fullmatch(str(path))
+        return match is not None and match.lastgroup.startswith("deny")
+
+    def is_restricted_file(self, project_id, file_name):
+        return self.is_restricted(f"{project_id}/{file_name}")
+
+
+@functools.lru_cache(maxsize=64)
+def compile_rules(rules):
+    """
+    The `RestrictionRules` for a tuple of rules.
+    """
+    return RestrictionRules(rules)
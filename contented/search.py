@@ -0,0 +1,258 @@
+"""
+Search for files, by name or path, across every project in a collection.
+
+The paths (`<project_id>/<path-in-project>`) are kept in a SQLite database in
+the site's cache directory, with an FTS5 trigram index over them, so a
+substring of a path is found without scanning every path. A search first
+looks for paths that contain each of its words; if that finds too few, it
+falls back to a fuzzy search, for paths that share most of the trigrams of
+the words (which tolerates typos, eg, "volcnao_plot").
+
+The trigram tokenizer needs SQLite 3.34 or later. With an older SQLite (eg,
+3.31 on Ubuntu 20.04), the index holds just the paths, and each search scans
+all of them: the results are the same, but searches of large collections are
+slower.
+
+The index is built by `./manage.py build_search_index`, and is then kept up
+to date, one file at a time, as changes are recorded in the project index
+(see `contented.receivers`).
+"""
+
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+from . import shared_index
+from .cache_files import get_temp_path
+from .sites import get_current_site, get_site_for_path
+
+SEARCH_INDEX_NAME = "search.sqlite3"
+
+# Words shorter than this can't be looked up in a trigram index; they are
+# checked against each path found by the other words instead
+MIN_TERM_LENGTH = 3
+
+# A path matches a fuzzy search if it contains at least this fraction of the
+# trigrams in the search
+FUZZY_THRESHOLD = 0.6
+
+# A fuzzy search ranks at most this many candidates for each result it returns
+FUZZY_CANDIDATES_PER_RESULT = 20
+
+# Whether the paths can be given a trigram index (FTS5's trigram tokenizer was
+# added in SQLite 3.34)
+HAS_TRIGRAM_INDEX = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    project_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    full_path TEXT NOT NULL,
+    UNIQUE (project_id, path)
+);
+"""
+
+TRIGRAM_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS trigrams USING fts5(
+    full_path, content='files', content_rowid='id', tokenize='trigram'
+);
+"""
+
+
+def get_search_index_path(cache_dir=None):
+    return Path(cache_dir or get_current_site().cache_dir) / SEARCH_INDEX_NAME
+
+
+def connect(index_path):
+    # The index is replaced by renaming a new file over it, so it is not put
+    # into WAL mode: a left-over log would be applied to the new file
+    return sqlite3.connect(index_path, timeout=30)
+
+
+def build_search_index(projects_dir=None, cache_dir=None, from_project_index=False):
+    """
+    Build the search index for a collection from scratch, from the project
+    directories (or from the project index). The new index replaces the old
+    one atomically. Returns the number of files indexed.
+    """
+    index_path = get_search_index_path(cache_dir)
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = get_temp_path(index_path)
+
+    if from_project_index:
+        projects = shared_index.collect_from_project_index(projects_dir)
+    else:
+        projects = shared_index.collect_from_filesystem(projects_dir)
+
+    n_files = 0
+    with closing(sqlite3.connect(partial_path)) as connection:
+        connection.executescript(SCHEMA)
+        for project_id, files in projects:
+            connection.executemany(
+                "INSERT INTO files (project_id, path, full_path) VALUES (?, ?, ?)",
+                ((project_id, path, f"{project_id}/{path}") for path in files),
+            )
+            n_files += len(files)
+        if HAS_TRIGRAM_INDEX:
+            connection.executescript(TRIGRAM_SCHEMA)
+            connection.execute("INSERT INTO trigrams (trigrams) VALUES ('rebuild')")
+        connection.commit()
+
+    os.replace(partial_path, index_path)
+    return n_files
+
+
+def update_file(path, project_id, relative_path, removed):
+    """
+    Add a file to, or remove it from, the search index of the collection that
+    holds it (`path`), if that index has been built.
+    """
+    index_path = get_search_index_path(get_site_for_path(path).cache_dir)
+    if not index_path.exists():
+        return
+
+    with closing(connect(index_path)) as connection, connection:
+        row = connection.execute(
+            "SELECT id, full_path FROM files WHERE project_id = ? AND path = ?",
+            (project_id, relative_path),
+        ).fetchone()
+        if removed and row is not None:
+            if HAS_TRIGRAM_INDEX:
+                connection.execute(
+                    "INSERT INTO trigrams (trigrams, rowid, full_path) "
+                    "VALUES ('delete', ?, ?)",
+                    row,
+                )
+            connection.execute("DELETE FROM files WHERE id = ?", (row[0],))
+        elif not removed and row is None:
+            full_path = f"{project_id}/{relative_path}"
+            cursor = connection.execute(
+                "INSERT INTO files (project_id, path, full_path) VALUES (?, ?, ?)",
+                (project_id, relative_path, full_path),
+            )
+            if HAS_TRIGRAM_INDEX:
+                connection.execute(
+                    "INSERT INTO trigrams (rowid, full_path) VALUES (?, ?)",
+                    (cursor.lastrowid, full_path),
+                )
+
+
+def get_trigrams(text):
+    text = text.lower()
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def quote(term):
+    """
+    An FTS5 string for `term`, which matches it anywhere in a path.
+    """
+    return '"' + term.replace('"', '""') + '"'
+
+
+def like_pattern(term):
+    """
+    A LIKE pattern (with `\\` as its escape character) that matches `term`
+    anywhere in a path.
+    """
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search(query, restrictions, limit=50, fuzzy=True):
+    """
+    The files in the current site's collection whose paths match `query`, as
+    `(project_id, path)` pairs, leaving out files that are restricted by
+    `restrictions`. Returns `(results, fuzzy)`, where `fuzzy` says whether the
+    results came from a fuzzy search.
+
+    Returns None if the search index has not been built. Raises ValueError for
+    a query that has no word of at least `MIN_TERM_LENGTH` characters.
+    """
+    index_path = get_search_index_path()
+    if not index_path.exists():
+        return None
+
+    terms = [term.lower() for term in query.split()]
+    long_terms = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+    if not long_terms:
+        raise ValueError(
+            f"Search for at least one word of {MIN_TERM_LENGTH} or more characters"
+        )
+
+    with closing(connect(index_path)) as connection:
+        results = find_substrings(connection, terms, restrictions, limit)
+        if len(results) >= limit or not fuzzy:
+            return results, False
+
+        fuzzy_results = find_similar(connection, long_terms, restrictions, limit)
+        found = set(results)
+        results.extend(r for r in fuzzy_results if r not in found)
+        return results[:limit], len(results) > len(found)
+
+
+def find_substrings(connection, terms, restrictions, limit):
+    """
+    Up to `limit` files whose paths contain every one of `terms`.
+    """
+    long_terms = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+    short_terms = [term for term in terms if len(term) < MIN_TERM_LENGTH]
+    if HAS_TRIGRAM_INDEX:
+        rows = connection.execute(
+            "SELECT files.project_id, files.path, files.full_path "
+            "FROM trigrams JOIN files ON files.id = trigrams.rowid "
+            "WHERE trigrams MATCH ?",
+            (" ".join(quote(term) for term in long_terms),),
+        )
+    else:
+        # LIKE is case-insensitive (for ASCII), as the trigram index is
+        rows = connection.execute(
+            "SELECT project_id, path, full_path FROM files WHERE "
+            + " AND ".join("full_path LIKE ? ESCAPE '\\'" for _ in long_terms),
+            [like_pattern(term) for term in long_terms],
+        )
+
+    results = []
+    for project_id, path, full_path in rows:
+        lowered = full_path.lower()
+        if any(term not in lowered for term in short_terms):
+            continue
+        if restrictions.is_restricted_file(project_id, path):
+            continue
+        results.append((project_id, path))
+        if len(results) >= limit:
+            break
+    return results
+
+
+def find_similar(connection, terms, restrictions, limit):
+    """
+    Up to `limit` files whose paths contain most of the trigrams of `terms`,
+    best matches first.
+    """
+    query_trigrams = set().union(*(get_trigrams(term) for term in terms))
+    if HAS_TRIGRAM_INDEX:
+        rows = connection.execute(
+            "SELECT files.project_id, files.path, files.full_path "
+            "FROM trigrams JOIN files ON files.id = trigrams.rowid "
+            "WHERE trigrams MATCH ? ORDER BY rank LIMIT ?",
+            (
+                " OR ".join(quote(trigram) for trigram in sorted(query_trigrams)),
+                limit * FUZZY_CANDIDATES_PER_RESULT,
+            ),
+        )
+    else:
+        rows = connection.execute("SELECT project_id, path, full_path FROM files")
+
+    scored = []
+    for project_id, path, full_path in rows:
+        shared = len(query_trigrams & get_trigrams(full_path))
+        score = shared / len(query_trigrams)
+        if score < FUZZY_THRESHOLD:
+            continue
+        if restrictions.is_restricted_file(project_id, path):
+            continue
+        scored.append((-score, len(full_path), project_id, path))
+
+    return [(project_id, path) for _, _, project_id, path in sorted(scored)[:limit]]
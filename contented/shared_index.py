@@ -0,0 +1,259 @@
+"""
+A compact, memory-mapped listing of the projects in a collection and of the
+files in each project.
+
+The listing is written to a single file (`settings.CONTENTED_SHARED_INDEX`, or
+the `shared_index` of a site; see `contented.sites`).
+Each gunicorn worker memory-maps that file, so every worker shares one copy of
+the listing (in the page cache) rather than crawling the collection and
+holding its own copy. When run with `deploy_tools/gunicorn.conf.py`, the file
+is built once, in the gunicorn master, before any worker is forked.
+
+To pick up changes to the collection, the file is rebuilt under a temporary
+name and renamed over the old one; workers notice the new file (by its inode)
+and re-map it. The file can be rebuilt with `./manage.py build_shared_index`,
+and is rebuilt by `./manage.py contented_watch` as changes are seen.
+
+File layout (all integers are native-endian unsigned 64-bit):
+
+    header: magic, number of projects (P), number of files (F), blob size
+    project_starts: P + 1 indexes into the files; project i owns files
+        project_starts[i] up to project_starts[i + 1]
+    string_offsets: P + F + 1 offsets into the blob; string i is
+        blob[string_offsets[i]:string_offsets[i + 1]]; strings 0..P-1 are
+        the (sorted) project names, and string P + j is the path of file j
+    blob: the UTF-8 encoded strings
+"""
+
+import array
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+from . import archives
+from .cache_files import get_temp_path
+from .index import get_collection_key
+from .models import ProjectFile
+from .sites import get_all_sites, get_current_site
+
+MAGIC = b"CTDIDX01"
+HEADER = struct.Struct("=8sQQQ")
+
+# Workers check whether the index file has been replaced at most this often
+RELOAD_CHECK_INTERVAL = 2.0
+
+
+def collect_from_filesystem(projects_dir=None):
+    """
+    Yield `(project_id, [relative file paths])` for each project in a
+    collection, by walking the project directories (or, for projects that are
+    stored as archives, by listing the archive members).
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir)
+    for project_id in sorted(os.listdir(projects_dir)):
+        project_path = projects_dir / project_id
+        if project_id.startswith(".") or not project_path.is_dir():
+            continue
+        files = []
+        for root, _, file_names in os.walk(project_path):
+            relative_root = Path(root).relative_to(project_path)
+            files.extend(str(relative_root / f) for f in file_names)
+        yield project_id, sorted(files)
+
+    yield from collect_archives(projects_dir)
+
+
+def collect_archives(projects_dir):
+    """
+    Yield `(project_id, [member paths])` for each project in a collection
+    that is stored as an archive (and not also as a directory, which is served
+    instead).
+    """
+    seen = set()
+    for entry in sorted(os.listdir(projects_dir)):
+        archive_path = Path(projects_dir) / entry
+        project_id = archives.get_project_id(entry)
+        if entry.startswith(".") or project_id == entry or not archive_path.is_file():
+            continue
+        if project_id in seen or (Path(projects_dir) / project_id).is_dir():
+            continue
+        seen.add(project_id)
+        yield project_id, sorted(archives.get_members(archive_path))
+
+
+def collect_from_project_index(projects_dir=None):
+    """
+    Yield `(project_id, [relative file paths])` for each project in a
+    collection, from the project index in the database (see
+    `contented.index`) rather than from the filesystem. Projects that are
+    stored as archives are not in the project index; their members are read
+    from the archives.
+    """
+    entries = (
+        ProjectFile.objects.filter(
+            collection=get_collection_key(projects_dir), removed=False
+        )
+        .order_by("project_id", "path")
+        .values_list("project_id", "path")
+    )
+    project_id, files = None, []
+    for entry_project_id, path in entries.iterator():
+        if entry_project_id != project_id:
+            if project_id is not None:
+                yield project_id, files
+            project_id, files = entry_project_id, []
+        files.append(path)
+    if project_id is not None:
+        yield project_id, files
+
+    yield from collect_archives(projects_dir or get_current_site().projects_dir)
+
+
+def write_shared_index(output_path, projects):
+    """
+    Write the listing `projects`, an iterable of `(project_id, [paths])`, to
+    `output_path`; the file is replaced atomically.
+    """
+    project_names = []
+    project_starts = array.array("Q", [0])
+    file_paths = []
+    for project_id, files in sorted(projects):
+        project_names.append(project_id)
+        file_paths.extend(files)
+        project_starts.append(len(file_paths))
+
+    string_offsets = array.array("Q", [0])
+    blob = bytearray()
+    for string in project_names + file_paths:
+        blob += string.encode("utf8")
+        string_offsets.append(len(blob))
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = get_temp_path(output_path)
+    with open(tmp_path, "wb") as output:
+        output.write(HEADER.pack(MAGIC, len(project_names), len(file_paths), len(blob)))
+        project_starts.tofile(output)
+        string_offsets.tofile(output)
+        output.write(blob)
+    os.replace(tmp_path, output_path)
+
+
+def build_shared_index(output_path=None, projects_dir=None, from_project_index=False):
+    """
+    Write the shared index file for a collection, either by crawling the
+    collection or (if `from_project_index`) from the project index.
+    """
+    if from_project_index:
+        projects = collect_from_project_index(projects_dir)
+    else:
+        projects = collect_from_filesystem(projects_dir)
+
+    write_shared_index(output_path or get_current_site().shared_index, projects)
+
+
+class SharedIndex:
+    """
+    Read-only view of a shared index file. Strings are only decoded when they
+    are asked for, so mapping the index costs (almost) nothing.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as index_file:
+            self.inode = os.fstat(index_file.fileno()).st_ino
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.n_projects, self.n_files, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a contented shared index")
+
+        view = memoryview(self._mmap)
+        start = HEADER.size
+        end = start + 8 * (self.n_projects + 1)
+        self._project_starts = view[start:end].cast("Q")
+        start, end = end, end + 8 * (self.n_projects + self.n_files + 1)
+        self._string_offsets = view[start:end].cast("Q")
+        self._blob_start = end
+
+    def _string(self, i):
+        start = self._blob_start + self._string_offsets[i]
+        end = self._blob_start + self._string_offsets[i + 1]
+        return self._mmap[start:end].decode("utf8")
+
+    def _find_project(self, project_id):
+        low, high = 0, self.n_projects
+        while low < high:
+            middle = (low + high) // 2
+            if self._string(middle) < project_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_projects and self._string(low) == project_id:
+            return low
+        return None
+
+    def __contains__(self, project_id):
+        return self._find_project(project_id) is not None
+
+    def projects(self):
+        """
+        The names of all projects, in sorted order.
+        """
+        return [self._string(i) for i in range(self.n_projects)]
+
+    def files(self, project_id):
+        """
+        The paths of the files in a project (relative to the project
+        directory), in sorted order. Raises KeyError for an unknown project.
+        """
+        i = self._find_project(project_id)
+        if i is None:
+            raise KeyError(project_id)
+        first, last = self._project_starts[i], self._project_starts[i + 1]
+        return [self._string(self.n_projects + j) for j in range(first, last)]
+
+
+# The mapped index, and when it was last checked, for each index file
+_loaded = {}
+
+
+def get_shared_index():
+    """
+    The shared index for the current site, or None if no shared index is
+    configured (or it has not been built).
+
+    The index file is re-mapped if it has been replaced since it was last
+    mapped; this is checked at most every `RELOAD_CHECK_INTERVAL` seconds.
+    """
+    path = get_current_site().shared_index
+    if not path:
+        return None
+
+    now = time.monotonic()
+    current, checked = _loaded.get(path, (None, 0.0))
+    if current is not None and now - checked < RELOAD_CHECK_INTERVAL:
+        return current
+
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        _loaded.pop(path, None)
+        return None
+
+    if current is None or current.inode != inode:
+        current = SharedIndex(path)
+    _loaded[path] = (current, now)
+
+    return current
+
+
+def build_site_indexes():
+    """
+    Build the shared index of every site that has one configured (see
+    `contented.sites`).
+    """
+    for site in get_all_sites():
+        if site.shared_index:
+            build_shared_index(site.shared_index, projects_dir=site.projects_dir)
@@ -0,0 +1,16 @@
+"""
+Signals sent by `contented`.
+
+`file_changed` is sent whenever the project index records that a file has been
+created, modified or removed. Receivers are called with:
+- `path`: the absolute path of the file;
+- `project_id` and `relative_path`: where the file is within the collection;
+- `kind`: one of `FileEvent.CREATED`, `FileEvent.MODIFIED`, `FileEvent.REMOVED`.
+
+Any cached artifact that is derived from the file should be invalidated by a
+receiver of this signal.
+"""
+
+from django.dispatch import Signal
+
+file_changed = Signal()
@@ -0,0 +1,175 @@
+"""
+Block signatures, so that mirrors can fetch only the parts of a large file
+that have changed since they last fetched it (as rsync and zsync do).
+
+A file is split into blocks of `block_size` bytes (the last block may be
+shorter), and each block is given a weak checksum (Adler-32, which a client
+can compute cheaply at every offset of its old copy using a rolling update)
+and a strong checksum (the first 16 bytes of its BLAKE2b digest). A client
+that has an old copy of the file:
+
+1. fetches the signature (`views.signature_page`);
+2. slides a window of `block_size` bytes over its old copy, and wherever the
+   weak checksum of the window matches that of a block, checks the strong
+   checksum, to find the blocks that it already has;
+3. fetches the other blocks with `?blocks=<ranges>` from the results page,
+   sending the `etag` of the signature in `If-Match` so that the file cannot
+   change between the two requests.
+
+Signatures are cached (as JSON) in the cache directory of the site that holds
+the file, and are rebuilt when the file's size or modification-time changes.
+Signatures of large files are built by a background job.
+"""
+
+import hashlib
+import json
+import math
+import os
+import zlib
+
+from .cache_files import get_cache_path, get_temp_path
+from .sites import get_site_for_path
+
+MIN_BLOCK_SIZE = 4 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+STRONG_DIGEST_SIZE = 16
+
+# Signatures of files larger than this are built by a background job, rather
+# than while the request waits
+INLINE_BUILD_MAX_BYTES = 64 * 1024 * 1024
+
+
+def get_block_size(file_size):
+    """
+    The block size for a file: about the square root of its size (as used by
+    rsync), rounded up to a power of two, so that the signature and the
+    number of blocks to fetch grow slowly with the size of the file.
+    """
+    if file_size <= MIN_BLOCK_SIZE:
+        return MIN_BLOCK_SIZE
+    block_size = 2 ** math.ceil(math.log2(math.sqrt(file_size) * 8))
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+
+
+def get_etag(source_stat):
+    """
+    The ETag of a version of a file: it changes whenever the file is
+    rewritten.
+    """
+    return f'"{source_stat.st_size:x}-{source_stat.st_mtime_ns:x}"'
+
+
+def get_signature_cache_path(source_path):
+    """
+    Path of the cached signature of the file at `source_path` (see
+    `contented.cache_files`).
+    """
+    cache_dir = get_site_for_path(source_path).cache_dir
+    return get_cache_path(cache_dir / "signatures", source_path, ".json")
+
+
+def compute_signature(source_path, report_progress=None):
+    """
+    The signature of the file at `source_path`: a dictionary with its `size`,
+    `etag`, `block_size` and the `[weak, strong]` checksums of each block
+    (weak as an integer, strong as a hex string).
+    """
+    with open(source_path, "rb") as source_file:
+        source_stat = os.fstat(source_file.fileno())
+        block_size = get_block_size(source_stat.st_size)
+        blocks = []
+        for block in iter(lambda: source_file.read(block_size), b""):
+            strong = hashlib.blake2b(block, digest_size=STRONG_DIGEST_SIZE)
+            blocks.append([zlib.adler32(block), strong.hexdigest()])
+            if report_progress and source_stat.st_size:
+                report_progress(source_file.tell() / source_stat.st_size)
+
+    return {
+        "size": source_stat.st_size,
+        "etag": get_etag(source_stat),
+        "block_size": block_size,
+        "blocks": blocks,
+    }
+
+
+def build_signature_cache(source_path, report_progress=None):
+    """
+    Compute the signature of the file at `source_path` and write it to the
+    cache (under a temporary name, then moved into place). Returns the
+    signature.
+    """
+    signature = compute_signature(source_path, report_progress=report_progress)
+    cache_path = get_signature_cache_path(source_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = get_temp_path(cache_path)
+    with open(tmp_path, "w") as cache_file:
+        json.dump(signature, cache_file)
+    os.replace(tmp_path, cache_path)
+    return signature
+
+
+def get_cached_signature(source_path):
+    """
+    The cached signature of the file at `source_path`, or None if there is
+    none for the current version of the file.
+    """
+    try:
+        with open(get_signature_cache_path(source_path)) as cache_file:
+            signature = json.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if signature["etag"] != get_etag(os.stat(source_path)):
+        return None
+    return signature
+
+
+def remove_signature_cache(source_path):
+    """
+    Delete the cached signature of the file at `source_path`, if there is one.
+    """
+    try:
+        os.remove(get_signature_cache_path(source_path))
+    except FileNotFoundError:
+        pass
+
+
+def parse_blocks(blocks_string, n_blocks):
+    """
+    The block numbers in `blocks_string` (eg, "0,4-7,12"), as a sorted list
+    of `(first, last)` runs of consecutive blocks. Raises ValueError if the
+    string is malformed, or refers to a block after the last one.
+    """
+    runs = []
+    for part in blocks_string.split(","):
+        first, _, last = part.partition("-")
+        first, last = int(first), int(last or first)
+        if not 0 <= first <= last < n_blocks:
+            raise ValueError(f"No such blocks: {part}")
+        runs.append((first, last))
+
+    # Merge overlapping and adjacent runs, so each is read in one go
+    merged = []
+    for first, last in sorted(runs):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def iter_blocks(file_object, runs, block_size, chunk_size):
+    """
+    Yield the contents of the blocks in `runs` (see `parse_blocks`) from an
+    open file, in order, in pieces of at most `chunk_size` bytes.
+    """
+    with file_object:
+        for first, last in runs:
+            file_object.seek(first * block_size)
+            remaining = (last - first + 1) * block_size
+            while remaining > 0:
+                data = file_object.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
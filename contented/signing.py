@@ -0,0 +1,111 @@
+"""
+Signed, expiring URLs for downloading a file, or any file in a folder, without
+logging in.
+
+A signed URL looks like one of:
+
+    /signed/<expires>/<token>/<project_id>/<file-path>/-
+    /signed/<expires>/<token>/<project_id>/<folder-path>/-/<path-in-folder>
+
+where `<expires>` is a unix timestamp and `<token>` signs the expiry time and
+the 'scope' (the part before `/-`). The token can be checked without any
+session or database lookup.
+
+Each site (see `contented.sites`) signs its URLs with its own secret, so a
+URL only works on the site that issued it.
+
+Tokens are HMAC-SHA256 digests. If `settings.SIGNED_URL_NGINX` is set, they
+are instead built like nginx's `secure_link_md5 "$expires$scope $secret"`, so
+that nginx can check them and serve the file itself (see
+`deploy_tools/nginx.template.conf`).
+"""
+
+import base64
+import hashlib
+import hmac
+import posixpath
+import re
+import time
+
+from django.conf import settings
+from django.urls import reverse
+
+from .sites import get_current_site
+
+SIGNED_PATH_PATTERN = re.compile(r"^(?P<scope>.+?)/-(?P<rest>/.*)?$")
+
+
+class SignatureError(Exception):
+    """
+    Raised when a signed URL is malformed, or its token does not match.
+    """
+
+
+class SignatureExpired(SignatureError):
+    """
+    Raised when a signed URL was correctly signed, but has expired.
+    """
+
+
+def make_token(scope, expires):
+    """
+    The token that signs access to `scope` (a project, folder or file path)
+    until the unix time `expires`.
+    """
+    secret = get_current_site().signing_secret
+    if settings.SIGNED_URL_NGINX:
+        digest = hashlib.md5(f"{expires}{scope} {secret}".encode("utf8")).digest()
+    else:
+        digest = hmac.new(
+            secret.encode("utf8"), f"{expires}:{scope}".encode("utf8"), hashlib.sha256
+        ).digest()
+
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def make_signed_url(project_id, path="", max_age=None):
+    """
+    A signed URL for the file or folder at `<project_id>/<path>` (the whole
+    project, if `path` is empty) that is valid for `max_age` seconds.
+
+    For a folder, the returned URL lists the files in the folder; each file
+    can be downloaded by appending its path (relative to the folder).
+    """
+    max_age = min(max_age or settings.SIGNED_URL_MAX_AGE, settings.SIGNED_URL_MAX_AGE)
+    expires = int(time.time()) + max_age
+    scope = posixpath.join(project_id, path) if path else project_id
+    token = make_token(scope, expires)
+    is_folder = (get_current_site().projects_dir / scope).is_dir()
+
+    return reverse(
+        "signed",
+        args=[expires, token, f"{scope}/-/" if is_folder else f"{scope}/-"],
+    )
+
+
+def verify_signed_path(expires, token, signed_path, now=None):
+    """
+    Check the token for a signed URL, and return the path (relative to the
+    project collection) that it gives access to.
+
+    Raises `SignatureExpired` if the URL has expired, and `SignatureError` if
+    the URL is malformed, the token is wrong, or the requested path lies
+    outside the signed scope.
+    """
+    match = SIGNED_PATH_PATTERN.match(signed_path)
+    if not match:
+        raise SignatureError("Malformed signed URL")
+
+    scope, rest = match.group("scope"), match.group("rest") or ""
+    if not hmac.compare_digest(make_token(scope, expires), token):
+        raise SignatureError("Invalid signature")
+    if expires < (now if now is not None else time.time()):
+        raise SignatureExpired("Signed URL has expired")
+
+    relative_path = posixpath.normpath(scope + rest)
+    if relative_path != scope and not relative_path.startswith(scope + "/"):
+        raise SignatureError("Path is outside of the signed folder")
+    if relative_path.startswith(("/", "..")):
+        raise SignatureError("Path is outside of the project collection")
+
+    return relative_path
@@ -0,0 +1,247 @@
+"""
+Several sites (domains), each with its own project collection, served by one
+deployment.
+
+`settings.CONTENTED_SITES` (read from the JSON file named by
+`CONTENTED_SITES_FILE`) maps each host name to the config of its site:
+
+    {
+        "results.client-a.org": {
+            "projects_dir": "/data/client_a",
+            "restricted_projects": ["hidden-project"],
+            "shared_index": "/var/cache/contented/client_a.idx",
+            "cache_dir": "/var/cache/contented/client_a",
+            "group": "client-a"
+        }
+    }
+
+Only `projects_dir` is required. Requests for any other host (eg, `SITENAME`)
+are served from the site described by the usual settings (`PROJECTS_DIR`,
+`RESTRICTED_PROJECTS` etc).
+
+`SiteMiddleware` picks the site for each request from its `Host` header, and
+makes it the current site while the request is handled (and while a streamed
+response is sent). Code that needs the collection asks for
+`get_current_site()` rather than reading the settings. Management commands
+use the default site unless they are given `--site <host>`.
+
+Each site is kept apart from the others: the project index is keyed by the
+collection directory, and derived artifacts (table and archive caches) are
+stored in the `cache_dir` of the site whose collection holds their source.
+
+Users are shared by every site, but a user only sees the restricted projects
+(and can only upload files) on the sites that they are a member of: those
+whose `group` (by default, the host name) they belong to. Members of the
+default site are those in `CONTENTED_SITE_GROUP`, or, if that is not set,
+every logged-in user.
+"""
+
+import contextlib
+import contextvars
+import os
+from pathlib import Path
+from typing import NamedTuple
+
+from django.conf import settings
+from django.http.request import split_domain_port
+
+from .restrictions import compile_rules
+
+
+class Site(NamedTuple):
+    """
+    The collection served for one host name; `name` is empty for the default
+    site.
+    """
+
+    name: str
+    projects_dir: Path
+    restricted_projects: list
+    shared_index: str
+    cache_dir: Path
+    group: str
+
+    @property
+    def restrictions(self):
+        """
+        The compiled restriction rules of the site (see
+        `contented.restrictions`).
+        """
+        return compile_rules(tuple(self.restricted_projects))
+
+    @property
+    def signing_secret(self):
+        """
+        The secret for signed URLs (see `contented.signing`); each site has
+        its own, so that a link for one site cannot be used on another.
+        """
+        if not self.name:
+            return settings.SIGNED_URL_SECRET
+        return f"{settings.SIGNED_URL_SECRET}:{self.name}"
+
+    def is_member(self, user):
+        """
+        Is `user` a member of the site: a logged-in user who belongs to the
+        site's group (or any logged-in user, if the site has no group), or a
+        superuser?
+
+        The answer is cached on the user object (as Django caches permissions),
+        which lasts for one request, so the groups are queried at most once
+        per request.
+        """
+        if not user.is_authenticated:
+            return False
+        if user.is_superuser or not self.group:
+            return True
+        if not hasattr(user, "_site_membership_cache"):
+            user._site_membership_cache = {}
+        if self.group not in user._site_membership_cache:
+            user._site_membership_cache[self.group] = user.groups.filter(
+                name=self.group
+            ).exists()
+        return user._site_membership_cache[self.group]
+
+
+def get_default_site():
+    """
+    The site described by the project settings.
+    """
+    return Site(
+        name="",
+        projects_dir=Path(settings.PROJECTS_DIR),
+        restricted_projects=settings.RESTRICTED_PROJECTS,
+        shared_index=settings.CONTENTED_SHARED_INDEX,
+        cache_dir=Path(settings.CONTENTED_CACHE_DIR),
+        group=settings.CONTENTED_SITE_GROUP,
+    )
+
+
+def make_site(name, config):
+    """
+    A `Site` from its entry in `settings.CONTENTED_SITES`.
+    """
+    return Site(
+        name=name,
+        projects_dir=Path(config["projects_dir"]),
+        restricted_projects=list(config.get("restricted_projects", [])),
+        shared_index=config.get("shared_index", ""),
+        cache_dir=Path(
+            config.get("cache_dir") or Path(settings.CONTENTED_CACHE_DIR) / name
+        ),
+        group=config.get("group") or name,
+    )
+
+
+def get_site(host):
+    """
+    The site that serves requests for `host` (which may include a port); the
+    default site, if no site is configured for the host.
+    """
+    domain, _ = split_domain_port(host)
+    config = settings.CONTENTED_SITES.get(domain)
+    if config is None:
+        return get_default_site()
+    return make_site(domain, config)
+
+
+def get_named_site(name):
+    """
+    The site for the host name `name` in `settings.CONTENTED_SITES` (the
+    default site, if `name` is empty). Raises KeyError for an unknown site.
+    """
+    if not name:
+        return get_default_site()
+    return make_site(name, settings.CONTENTED_SITES[name])
+
+
+def get_all_sites():
+    """
+    The default site, followed by each configured site.
+    """
+    return [get_default_site()] + [
+        make_site(name, config) for name, config in settings.CONTENTED_SITES.items()
+    ]
+
+
+def get_site_for_path(path):
+    """
+    The site whose collection holds `path`: the one with the deepest
+    `projects_dir` that contains it (the default site, if none do).
+    """
+    path = os.path.abspath(path)
+    found, found_length = get_default_site(), -1
+    for site in get_all_sites():
+        projects_dir = os.path.abspath(site.projects_dir)
+        if path.startswith(projects_dir.rstrip("/") + "/"):
+            if len(projects_dir) > found_length:
+                found, found_length = site, len(projects_dir)
+    return found
+
+
+_current_site = contextvars.ContextVar("contented_site", default=None)
+
+
+def get_current_site():
+    """
+    The site for the request that is being handled (see `SiteMiddleware`), or
+    the default site.
+    """
+    return _current_site.get() or get_default_site()
+
+
+@contextlib.contextmanager
+def use_site(site):
+    """
+    Make `site` the current site within a `with` block (None: the default
+    site).
+    """
+    token = _current_site.set(site)
+    try:
+        yield site
+    finally:
+        _current_site.reset(token)
+
+
+def _stream_in_site(site, content):
+    """
+    Yield the chunks of a streamed response, with `site` as the current site
+    while each chunk is made.
+    """
+    chunks = iter(content)
+    while True:
+        with use_site(site):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class SiteMiddleware:
+    """
+    Serve each request from the site for its host name; the site is also
+    available as `request.site`.
+
+    A file response is left as it is (reading a file does not depend on the
+    site), so that it can still be sent with `wsgi.file_wrapper`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.site = get_site(request.get_host())
+        # The default site is left to follow the settings
+        site = request.site if request.site.name else None
+
+        with use_site(site):
+            response = self.get_response(request)
+
+        if (
+            site is not None
+            and response.streaming
+            and getattr(response, "file_to_stream", None) is None
+        ):
+            response.streaming_content = _stream_in_site(
+                site, response.streaming_content
+            )
+        return response
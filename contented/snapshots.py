@@ -0,0 +1,121 @@
+"""
+Projects that are published as a series of immutable snapshots.
+
+A snapshot is a directory of deliverables that is never changed once it is
+published. The snapshots of a project are kept in
+`<projects_dir>/.snapshots/<project_id>/<version>/`, and the project directory
+itself is a symlink to the latest of them:
+
+    projects/my_project -> .snapshots/my_project/20240501T120000
+
+A new snapshot is published (see `./manage.py contented_snapshot`) by moving
+its directory into place and then replacing the symlink, in a single rename;
+so a reader sees either the old snapshot or the new one, never a mixture.
+
+Since the file at `/snapshots/<project_id>/<version>/<path>` can never change,
+it is served with an `immutable` Cache-Control header and an ETag; the usual
+`/projects/<project_id>/<path>` URL of a file redirects to the URL of the file
+in the latest snapshot.
+"""
+
+import datetime
+import os
+from pathlib import Path
+
+from . import storage
+from .sites import get_current_site
+
+SNAPSHOTS_DIR_NAME = ".snapshots"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def get_snapshots_dir(project_id, projects_dir=None):
+    """
+    The directory that holds the snapshots of a project.
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir)
+    return projects_dir / SNAPSHOTS_DIR_NAME / project_id
+
+
+def is_valid_version(version):
+    return bool(version) and not version.startswith(".") and "/" not in version
+
+
+def get_latest_version(project_id, projects_dir=None):
+    """
+    The version of the snapshot that a project currently points to, or None if
+    the project is not published as snapshots.
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir)
+    project_path = projects_dir / project_id
+    try:
+        target = storage.run(project_path, os.readlink, project_path)
+    except OSError:
+        # Not a symlink (or no such project)
+        return None
+
+    snapshot_path = os.path.normpath(os.path.join(project_path.parent, target))
+    if os.path.dirname(snapshot_path) != os.path.normpath(
+        get_snapshots_dir(project_id, projects_dir)
+    ):
+        return None
+    return os.path.basename(snapshot_path)
+
+
+def get_snapshot_path(project_id, version):
+    """
+    The directory of one snapshot of a project, or None if there is no such
+    snapshot.
+    """
+    if not is_valid_version(version):
+        return None
+    snapshot_path = get_snapshots_dir(project_id) / version
+    return snapshot_path if storage.is_dir(snapshot_path) else None
+
+
+def list_versions(project_id):
+    """
+    The versions of the snapshots of a project, oldest first (versions are
+    expected to sort in the order they were published).
+    """
+    try:
+        names = storage.listdir(get_snapshots_dir(project_id))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if is_valid_version(name))
+
+
+def publish_snapshot(project_id, source_dir, version=None):
+    """
+    Publish the directory `source_dir` as a new snapshot of a project, and make
+    it the latest snapshot. The directory is moved (so it must be on the same
+    filesystem as the project collection). Returns the version of the
+    snapshot; by default, this is the current UTC time.
+    """
+    version = version or datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    if not is_valid_version(version):
+        raise SnapshotError(f"Invalid version: {version}")
+
+    projects_dir = get_current_site().projects_dir
+    project_path = projects_dir / project_id
+    if project_path.exists() and not project_path.is_symlink():
+        raise SnapshotError(
+            f"{project_path} is a directory; move it into "
+            f"{get_snapshots_dir(project_id)} and replace it with a symlink first"
+        )
+
+    snapshot_path = get_snapshots_dir(project_id) / version
+    if snapshot_path.exists():
+        raise SnapshotError(f"Snapshot {version} of {project_id} already exists")
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    os.rename(source_dir, snapshot_path)
+
+    # Make the new symlink under a temporary name, then move it over the old
+    # one, so that the project always points to a complete snapshot
+    link_path = projects_dir / f".{project_id}.{version}.link"
+    os.symlink(os.path.relpath(snapshot_path, projects_dir), link_path)
+    os.replace(link_path, project_path)
+    return version
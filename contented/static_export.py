@@ -0,0 +1,255 @@
+"""
+A static copy of the public parts of a project collection, for nginx to serve
+to users who are not logged in, without involving Django.
+
+The export (see `./manage.py export_static`) is laid out as:
+
+    <output_dir>/index.html                   the home page
+    <output_dir>/pages/<project_id>.html      each project page
+    <output_dir>/projects/<project_id>/<path> each deliverable (a hard link to
+                                              the file in the collection)
+
+Only projects and files that no restriction rule applies to are exported; the
+pages are rendered as they would be for a user who is not logged in.
+
+Exports are incremental: a fingerprint of each project (the path, size and
+modification-time of each of its public files) is kept in the export, and a
+project is only exported again when its fingerprint changes. With
+`CONTENTED_USE_INDEX`, the generation of each project in the index is kept
+too, and a project whose generation, snapshot and restriction rules have not
+changed since the last export is not even walked. A project is
+exported into a temporary directory that then replaces the old one, and pages
+are written under temporary names and moved into place, so nginx never serves
+half an export (it falls back to Django for anything that is missing).
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.template import loader
+
+from . import archives, index, snapshots, storage
+from .cache_files import get_temp_path
+from .sites import get_current_site
+
+STATE_FILE_NAME = ".export-state.json"
+
+
+def write_if_changed(path, text):
+    """
+    Write `text` to `path`, atomically, unless the file already holds it.
+    Returns True if the file was written.
+    """
+    path = Path(path)
+    try:
+        if path.read_text() == text:
+            return False
+    except FileNotFoundError:
+        pass
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = get_temp_path(path)
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+    return True
+
+
+def link_file(source_path, link_path):
+    """
+    Hard-link a deliverable into the export; if that is not possible (eg, the
+    export is on another filesystem), make a symlink to it instead.
+    """
+    try:
+        os.link(source_path, link_path)
+    except OSError as error:
+        if error.errno not in {errno.EXDEV, errno.EPERM, errno.EMLINK}:
+            raise
+        os.symlink(os.path.abspath(source_path), link_path)
+
+
+def list_public_files(project_id, restrictions):
+    """
+    The public files in a project, as a sorted list of `(relative path, stat
+    result)`.
+    """
+    project_path = get_current_site().projects_dir / project_id
+    files = []
+    for root, _, file_names in storage.walk(project_path):
+        relative_root = Path(root).relative_to(project_path)
+        for file_name in file_names:
+            relative_path = str(relative_root / file_name)
+            if restrictions.is_restricted_file(project_id, relative_path):
+                continue
+            file_path = Path(root) / file_name
+            files.append((relative_path, storage.run(file_path, os.stat, file_path)))
+    return sorted(files)
+
+
+def get_fingerprint(files, snapshot=None):
+    """
+    A digest of the path, size and modification-time of each file in a
+    project (and of the snapshot it is at, which is shown on its page).
+    """
+    hasher = hashlib.sha1(f"{snapshot}\n".encode())
+    for relative_path, stat in files:
+        hasher.update(f"{relative_path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return hasher.hexdigest()
+
+
+def remove_project(output_dir, project_id):
+    shutil.rmtree(output_dir / "projects" / project_id, ignore_errors=True)
+    try:
+        os.remove(output_dir / "pages" / f"{project_id}.html")
+    except FileNotFoundError:
+        pass
+
+
+def export_project(output_dir, project_id, files):
+    """
+    Link the files of a project into the export, and render its page.
+    """
+    project_path = get_current_site().projects_dir / project_id
+    export_path = output_dir / "projects" / project_id
+    new_path = export_path.with_name(f".{project_id}.new")
+    old_path = export_path.with_name(f".{project_id}.old")
+    shutil.rmtree(new_path, ignore_errors=True)
+    new_path.mkdir(parents=True)
+
+    for relative_path, _ in files:
+        link_path = new_path / relative_path
+        link_path.parent.mkdir(parents=True, exist_ok=True)
+        link_file(project_path / relative_path, link_path)
+
+    if export_path.exists():
+        os.rename(export_path, old_path)
+    os.rename(new_path, export_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+    page = loader.render_to_string(
+        "project.html",
+        {
+            "project_id": project_id,
+            "generation": None,
+            "snapshot": snapshots.get_latest_version(project_id),
+            "results_files": [relative_path for relative_path, _ in files],
+            "user": AnonymousUser(),
+        },
+    )
+    write_if_changed(output_dir / "pages" / f"{project_id}.html", page)
+
+
+def export_home_page(output_dir, project_ids):
+    """
+    Render the home page, listing every public project (without the paging
+    of the dynamic home page). Returns True if the page changed.
+    """
+    summaries = index.get_summaries(project_ids=project_ids)
+    page = loader.render_to_string(
+        "home.html",
+        {
+            "project_ids": project_ids,
+            "project_rows": [
+                {"project_id": project_id, "summary": summaries.get(project_id)}
+                for project_id in project_ids
+            ],
+            "sort": "name",
+            "user": AnonymousUser(),
+        },
+    )
+    return write_if_changed(output_dir / "index.html", page)
+
+
+def read_state(state_path):
+    """
+    The state of the last export: the restriction rules it was made with, and
+    the `fingerprint` (and index `generation` and `snapshot`) of each project.
+    The state of an export made before generations were kept holds only the
+    fingerprints.
+    """
+    try:
+        state = json.loads(state_path.read_text())
+    except (FileNotFoundError, ValueError):
+        state = {}
+
+    if not isinstance(state.get("projects"), dict):
+        state = {
+            "rules": None,
+            "projects": {
+                project_id: {"fingerprint": fingerprint}
+                for project_id, fingerprint in state.items()
+            },
+        }
+    return state
+
+
+def export_static(output_dir):
+    """
+    Bring the static export of the current site's public projects in
+    `output_dir` up to date. Returns a dictionary that counts the projects
+    that were `exported`, `unchanged` and `removed`.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    state_path = output_dir / STATE_FILE_NAME
+    state = read_state(state_path)
+
+    site = get_current_site()
+    restrictions = site.restrictions
+    entries = [
+        entry
+        for entry in sorted(storage.listdir(site.projects_dir))
+        if not entry.startswith(".")
+        and not restrictions.is_restricted(archives.get_project_id(entry))
+    ]
+
+    rules = list(restrictions.rules)
+    rules_unchanged = state["rules"] == rules
+    generations = {}
+    if settings.CONTENTED_USE_INDEX:
+        generations = index.get_project_generations()
+
+    counts = {"exported": 0, "unchanged": 0, "removed": 0}
+    projects = {}
+    for project_id in entries:
+        # Projects that are stored as archives are left to Django
+        if not storage.is_dir(site.projects_dir / project_id):
+            continue
+        previous = state["projects"].get(project_id, {})
+        current = {
+            "generation": generations.get(project_id, 0),
+            "snapshot": snapshots.get_latest_version(project_id),
+        }
+        if (
+            current["generation"]
+            and rules_unchanged
+            and all(previous.get(key) == value for key, value in current.items())
+        ):
+            projects[project_id] = previous
+            counts["unchanged"] += 1
+            continue
+
+        files = list_public_files(project_id, restrictions)
+        current["fingerprint"] = get_fingerprint(files, current["snapshot"])
+        projects[project_id] = current
+        if previous.get("fingerprint") == current["fingerprint"]:
+            counts["unchanged"] += 1
+            continue
+        export_project(output_dir, project_id, files)
+        counts["exported"] += 1
+
+    for project_id in set(state["projects"]) - set(projects):
+        remove_project(output_dir, project_id)
+        counts["removed"] += 1
+
+    export_home_page(output_dir, archives.get_project_ids(entries))
+    write_if_changed(
+        state_path,
+        json.dumps({"rules": rules, "projects": projects}, indent=1, sort_keys=True),
+    )
+    return counts
@@ -0,0 +1,279 @@
+"""
+Filesystem calls that cannot hang the site when a storage mount stalls.
+
+Calls on files in a mount (eg, the NFS share behind `PROJECTS_DIR`) are run in
+a small thread pool for that mount, and the caller waits at most
+`STORAGE_TIMEOUT` seconds for each call. A stalled call keeps its thread, but
+not the worker that asked for it; and each mount has a bounded number of
+threads and waiting calls (`STORAGE_THREADS`, `STORAGE_QUEUE`), so one stalled
+mount cannot use up every thread either.
+
+Each mount has a circuit breaker: after `STORAGE_FAILURE_THRESHOLD` timeouts in
+a row, calls on the mount fail straight away for `STORAGE_RETRY_AFTER`
+seconds, after which a single call is let through to test the mount.
+
+Calls that cannot be made raise `StorageUnavailable`; the views answer these
+with a cached listing where they can, and otherwise
+`StorageUnavailableMiddleware` returns `503 Service Unavailable` with a
+`Retry-After` header.
+
+Errors raised by the calls themselves (eg, `FileNotFoundError`) are passed on
+as usual: they show that the mount is responding.
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.http import HttpResponse
+
+
+class StorageUnavailable(Exception):
+    """
+    Raised when a mount is too slow to answer, or its circuit breaker is open.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class MountExecutor:
+    """
+    The thread pool and circuit breaker for one storage mount.
+    """
+
+    def __init__(self, mount_point, threads=None, queue=None):
+        self.mount_point = mount_point
+        threads = threads or settings.STORAGE_THREADS
+        self._pool = ThreadPoolExecutor(
+            threads, thread_name_prefix=f"storage:{mount_point}"
+        )
+        self._slots = threading.BoundedSemaphore(
+            threads + (queue if queue is not None else settings.STORAGE_QUEUE)
+        )
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0.0
+        self._trial_running = False
+
+    def _check_breaker(self):
+        """
+        Raise `StorageUnavailable` if the breaker is open. Once the breaker has
+        been open for `STORAGE_RETRY_AFTER` seconds, one call is let through;
+        returns True for that trial call.
+        """
+        with self._lock:
+            if self.failures < settings.STORAGE_FAILURE_THRESHOLD:
+                return False
+            now = time.monotonic()
+            if now < self.open_until or self._trial_running:
+                retry_after = max(self.open_until - now, 1)
+                raise StorageUnavailable(
+                    f"{self.mount_point} is not responding", retry_after
+                )
+            self._trial_running = True
+            return True
+
+    def _end_trial(self):
+        with self._lock:
+            self._trial_running = False
+
+    def _record(self, succeeded):
+        with self._lock:
+            if succeeded:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= settings.STORAGE_FAILURE_THRESHOLD:
+                self.open_until = time.monotonic() + settings.STORAGE_RETRY_AFTER
+
+    def run(self, function, *args, timeout=None):
+        """
+        Call `function(*args)` in the mount's thread pool, and return its
+        result; raise `StorageUnavailable` if it does not finish within
+        `timeout` seconds (default: `STORAGE_TIMEOUT`).
+        """
+        is_trial = self._check_breaker()
+        try:
+            if not self._slots.acquire(blocking=False):
+                raise StorageUnavailable(
+                    f"Too many calls waiting on {self.mount_point}",
+                    settings.STORAGE_RETRY_AFTER,
+                )
+
+            try:
+                future = self._pool.submit(function, *args)
+            except BaseException:
+                self._slots.release()
+                raise
+            future.add_done_callback(lambda _: self._slots.release())
+
+            try:
+                result = future.result(timeout or settings.STORAGE_TIMEOUT)
+            except FutureTimeoutError:
+                self._record(succeeded=False)
+                raise StorageUnavailable(
+                    f"{self.mount_point} did not respond in time",
+                    settings.STORAGE_RETRY_AFTER,
+                ) from None
+            except Exception:
+                self._record(succeeded=True)
+                raise
+
+            self._record(succeeded=True)
+            return result
+        finally:
+            # However the trial call ends (even if it never reaches the pool),
+            # it must not keep the breaker from letting another through
+            if is_trial:
+                self._end_trial()
+
+
+def get_mount_points():
+    """
+    The mount points of this host, longest first (from /proc/self/mounts; just
+    "/" if that cannot be read).
+    """
+    try:
+        with open("/proc/self/mounts") as mounts:
+            mount_points = {
+                line.split()[1].replace("\\040", " ") for line in mounts if line.strip()
+            }
+    except OSError:
+        mount_points = set()
+
+    mount_points.add("/")
+    return sorted(mount_points, key=len, reverse=True)
+
+
+_executors = {"pid": None, "mount_points": None, "by_mount": {}}
+_executors_lock = threading.Lock()
+
+
+def get_executor(path):
+    """
+    The executor for the mount that `path` is on. The mount is found from the
+    path alone, so finding it never touches the (possibly stalled)
+    filesystem.
+    """
+    path = os.path.abspath(path)
+    with _executors_lock:
+        if _executors["pid"] != os.getpid():
+            # Threads do not survive a fork: start afresh in each worker
+            _executors.update(
+                pid=os.getpid(), mount_points=get_mount_points(), by_mount={}
+            )
+
+        for mount_point in _executors["mount_points"]:
+            if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+                break
+
+        executor = _executors["by_mount"].get(mount_point)
+        if executor is None:
+            executor = MountExecutor(mount_point)
+            _executors["by_mount"][mount_point] = executor
+
+    return executor
+
+
+def run(path, function, *args):
+    """
+    Call `function(*args)` (which acts on `path`) in the executor for the
+    mount that `path` is on.
+    """
+    return get_executor(path).run(function, *args)
+
+
+def listdir(path):
+    return run(path, os.listdir, path)
+
+
+def is_dir(path):
+    return run(path, os.path.isdir, path)
+
+
+def is_file(path):
+    return run(path, os.path.isfile, path)
+
+
+def exists(path):
+    return run(path, os.path.exists, path)
+
+
+def walk(path):
+    """
+    Like `os.walk`, but each directory is read in the mount's executor.
+    """
+    executor = get_executor(path)
+    walker = os.walk(path)
+    while True:
+        entry = executor.run(next, walker, None)
+        if entry is None:
+            return
+        yield entry
+
+
+def open_file(path, mode="rb"):
+    """
+    Open a file; reads from the returned file are made in the mount's executor
+    too.
+    """
+    executor = get_executor(path)
+    return GuardedFile(executor, executor.run(open, path, mode))
+
+
+class GuardedFile:
+    """
+    A file whose reads are made in a mount executor. Other attributes are
+    those of the underlying file.
+    """
+
+    def __init__(self, executor, file_object):
+        self._executor = executor
+        self._file = file_object
+
+    def read(self, size=-1):
+        return self._executor.run(self._file.read, size)
+
+    def fstat(self):
+        return self._executor.run(os.fstat, self._file.fileno())
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+class StorageUnavailableMiddleware:
+    """
+    Answer requests that could not reach a storage mount with
+    `503 Service Unavailable` (and a `Retry-After` header).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, StorageUnavailable):
+            return None
+
+        response = HttpResponse(
+            "The project files are temporarily unavailable; please try again "
+            "later\n",
+            content_type="text/plain",
+            status=503,
+        )
+        response["Retry-After"] = str(math.ceil(exception.retry_after))
+        return response
@@ -0,0 +1,267 @@
+"""
+Columnar cache for the tabular deliverables (.csv / .tsv) in a project
+collection.
+
+Each table is converted, once, into an Arrow IPC file in the cache directory
+of its site (`settings.CONTENTED_CACHE_DIR`, by default). The IPC file is
+memory-mapped when it is queried, so filtering, sorting and column-selection
+are vectorised over the cached columns rather than re-parsing the text file on
+every request.
+
+A cached table records the size and modification-time of the file that it was
+built from; if the original file changes, the cached copy is considered stale
+and is rebuilt.
+"""
+
+import io
+import json
+import os
+import re
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as pa_ipc
+
+from .cache_files import get_cache_path, get_temp_path
+from .sites import get_site_for_path
+
+TABLE_DELIMITERS = {".csv": ",", ".tsv": "\t"}
+
+# Tables that are smaller than this are converted while the user waits; larger
+# tables are converted by a background job
+INLINE_BUILD_MAX_BYTES = 8 * 1024 * 1024
+
+FILTER_OPERATORS = {
+    "<=": pc.less_equal,
+    ">=": pc.greater_equal,
+    "!=": pc.not_equal,
+    "==": pc.equal,
+    "=": pc.equal,
+    "<": pc.less,
+    ">": pc.greater,
+}
+
+FILTER_PATTERN = re.compile(
+    r"^(?P<column>.+?)(?P<operator><=|>=|!=|==|=|<|>|~)(?P<value>.*)$"
+)
+
+SOURCE_SIZE_KEY = b"contented.source_size"
+SOURCE_MTIME_KEY = b"contented.source_mtime_ns"
+
+
+class TableQueryError(ValueError):
+    """
+    Raised when the user asks for a column, filter or sort-order that cannot be
+    applied to a table.
+    """
+
+
+def is_table(file_name):
+    """
+    Is `file_name` a delimited text file that can be held in the columnar
+    cache?
+    """
+    _, file_extension = os.path.splitext(str(file_name))
+    return file_extension in TABLE_DELIMITERS
+
+
+def get_table_cache_path(source_path):
+    """
+    Path to the cached (Arrow IPC) copy of the table at `source_path`.
+
+    The cache is keyed by the absolute path of the original file, so tables
+    with the same relative path in different project collections do not
+    collide, and is kept in the cache directory of the site whose collection
+    holds the file.
+    """
+    cache_dir = get_site_for_path(source_path).cache_dir
+    return get_cache_path(cache_dir / "tables", source_path, ".arrow")
+
+
+def is_table_cache_fresh(source_path):
+    """
+    A cached table is fresh if it exists and was built from a file with the
+    same size and modification-time as `source_path` currently has.
+    """
+    cache_path = get_table_cache_path(source_path)
+    if not cache_path.exists():
+        return False
+
+    source_stat = os.stat(source_path)
+    with pa.memory_map(str(cache_path), "r") as source:
+        metadata = pa_ipc.open_file(source).schema.metadata or {}
+
+    return metadata.get(SOURCE_SIZE_KEY) == str(source_stat.st_size).encode() and (
+        metadata.get(SOURCE_MTIME_KEY) == str(source_stat.st_mtime_ns).encode()
+    )
+
+
+def build_table_cache(source_path, report_progress=None):
+    """
+    Convert the delimited text file at `source_path` into an Arrow IPC file.
+
+    The text file is parsed in blocks, so memory use is bounded by the block
+    size rather than by the size of the table. The IPC file is written under a
+    temporary name and then moved into place, so readers never see a
+    partially-written cache.
+
+    If provided, `report_progress` is called with the fraction of the text file
+    that has been converted after each block.
+    """
+    _, file_extension = os.path.splitext(str(source_path))
+    cache_path = get_table_cache_path(source_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = get_temp_path(cache_path)
+
+    source_stat = os.stat(source_path)
+    try:
+        with open(source_path, "rb") as source_file:
+            reader = pa_csv.open_csv(
+                source_file,
+                parse_options=pa_csv.ParseOptions(
+                    delimiter=TABLE_DELIMITERS[file_extension]
+                ),
+            )
+            schema = reader.schema.with_metadata(
+                {
+                    SOURCE_SIZE_KEY: str(source_stat.st_size),
+                    SOURCE_MTIME_KEY: str(source_stat.st_mtime_ns),
+                }
+            )
+            with pa.OSFile(str(tmp_path), "wb") as sink:
+                with pa_ipc.new_file(sink, schema) as writer:
+                    for batch in reader:
+                        writer.write_batch(batch)
+                        if report_progress and source_stat.st_size:
+                            report_progress(source_file.tell() / source_stat.st_size)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    return cache_path
+
+
+def remove_table_cache(source_path):
+    """
+    Delete the cached copy of the table at `source_path`, if there is one.
+    """
+    cache_path = get_table_cache_path(source_path)
+    if cache_path.exists():
+        cache_path.unlink()
+
+
+def open_table(source_path):
+    """
+    Return the cached copy of the table at `source_path` as a `pyarrow.Table`.
+
+    The cache is (re)built if it is missing or stale. The returned table is
+    backed by a memory-map of the cache file, so no column data is copied
+    until it is used.
+    """
+    if not is_table_cache_fresh(source_path):
+        build_table_cache(source_path)
+
+    source = pa.memory_map(str(get_table_cache_path(source_path)), "r")
+    return pa_ipc.open_file(source).read_all()
+
+
+def parse_filter(table, filter_string):
+    """
+    Convert a filter of the form `<column><operator><value>` (eg, `pvalue<0.05`
+    or `gene~BRCA`) into a boolean mask over the rows of `table`.
+
+    The operators `<`, `<=`, `>`, `>=`, `=` (or `==`) and `!=` compare the
+    column to `value` after converting `value` to the column's type. The `~`
+    operator checks whether a (text) column contains `value`.
+    """
+    match = FILTER_PATTERN.match(filter_string)
+    if not match:
+        raise TableQueryError(f"Could not parse filter '{filter_string}'")
+
+    column, operator, value = match.group("column", "operator", "value")
+    if column not in table.column_names:
+        raise TableQueryError(f"Unknown column '{column}'")
+
+    values = table[column]
+    if operator == "~":
+        return pc.match_substring(pc.cast(values, pa.string()), value)
+
+    try:
+        scalar = pc.cast(pa.scalar(value), values.type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as error:
+        raise TableQueryError(
+            f"Could not compare column '{column}' to '{value}'"
+        ) from error
+
+    return FILTER_OPERATORS[operator](values, scalar)
+
+
+def query_table(table, columns=None, filters=(), sort=(), offset=0, limit=None):
+    """
+    Filter, sort, select columns from and paginate a table.
+
+    - `columns`: the names of the columns to keep (all columns, if None)
+    - `filters`: filter-strings (see `parse_filter`); all must be satisfied
+    - `sort`: column names; prefix a name with "-" to sort in descending order
+    - `offset` and `limit`: the range of (filtered, sorted) rows to return
+    """
+    for filter_string in filters:
+        table = table.filter(parse_filter(table, filter_string))
+
+    sort_keys = []
+    for key in sort:
+        if key.startswith("-"):
+            column, order = key[1:], "descending"
+        else:
+            column, order = key, "ascending"
+        if column not in table.column_names:
+            raise TableQueryError(f"Unknown column '{column}'")
+        sort_keys.append((column, order))
+    if sort_keys:
+        table = table.sort_by(sort_keys)
+
+    if columns:
+        unknown = [c for c in columns if c not in table.column_names]
+        if unknown:
+            raise TableQueryError(f"Unknown column(s): {', '.join(unknown)}")
+        table = table.select(columns)
+
+    return table.slice(offset, limit)
+
+
+def iter_table_csv(table, chunk_size=10000):
+    """
+    Yield a table as chunks of CSV-formatted bytes; the header is only included
+    in the first chunk.
+    """
+    include_header = True
+    for batch in table.to_batches(max_chunksize=chunk_size):
+        buffer = io.BytesIO()
+        pa_csv.write_csv(
+            batch,
+            buffer,
+            write_options=pa_csv.WriteOptions(include_header=include_header),
+        )
+        include_header = False
+        yield buffer.getvalue()
+
+    if include_header:
+        buffer = io.BytesIO()
+        pa_csv.write_csv(table, buffer)
+        yield buffer.getvalue()
+
+
+def iter_table_json(table, chunk_size=10000):
+    """
+    Yield a table as chunks of a JSON array, with one object per row.
+    """
+    yield "["
+    separator = ""
+    for batch in table.to_batches(max_chunksize=chunk_size):
+        rows = batch.to_pylist()
+        if rows:
+            yield separator + ",".join(json.dumps(row, default=str) for row in rows)
+            separator = ","
+    yield "]"
@@ -0,0 +1,101 @@
+"""
+The end of a (possibly very large, and still growing) text file, such as the
+log of a pipeline that is running.
+
+`read_tail` finds the last lines of a file by reading backwards from its end,
+one block at a time, so it reads little more than the lines that are shown
+(and never more than `TAIL_MAX_BYTES`, however long the lines are).
+`iter_appended` then follows the file from a byte offset: it polls the size of
+the file, and reads only the bytes that have been appended since. Both
+read the file in the storage executor for its mount (see `contented.storage`).
+"""
+
+import os
+import time
+
+from . import storage
+
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# At most this many bytes are read from the end of a file; if the lines to
+# show are longer than that, the first of them is cut short
+TAIL_MAX_BYTES = 1024 * 1024
+
+# Appended text is sent in pieces of at most this many bytes; a piece ends at
+# the end of a line where it can
+FOLLOW_CHUNK_SIZE = 64 * 1024
+
+
+def read_tail(path, lines, block_size=TAIL_BLOCK_SIZE, max_bytes=TAIL_MAX_BYTES):
+    """
+    The last `lines` lines of the file at `path`, as bytes, and the size of
+    the file when it was read (the offset from which to follow it).
+
+    An incomplete last line (one that does not yet end in a newline) is
+    included in the lines. At most the last `max_bytes` bytes of the file are
+    read, so the first line may be cut short.
+    """
+    with storage.open_file(path, "rb") as file_object:
+        size = file_object.fstat().st_size
+        position, blocks, newlines = size, [], 0
+        first_position = max(size - max_bytes, 0)
+
+        # Stop when the block read holds more newlines than there are lines to
+        # show (the newline at the very end of the file does not start a line)
+        while position > first_position and newlines <= lines:
+            start = max(position - block_size, first_position)
+            file_object.seek(start)
+            block = file_object.read(position - start)
+            blocks.append(block)
+            newlines += block.count(b"\n", 0, len(block) - (position == size))
+            position = start
+
+    text = b"".join(reversed(blocks))
+    ends_with_newline = text.endswith(b"\n")
+    tail_lines = text.split(b"\n")
+    if ends_with_newline:
+        tail_lines.pop()
+    tail = b"\n".join(tail_lines[-lines:]) if lines > 0 else b""
+    if ends_with_newline and tail:
+        tail += b"\n"
+    return tail, size
+
+
+def iter_appended(path, offset, duration, poll_interval):
+    """
+    Follow the file at `path` from byte `offset` for up to `duration` seconds,
+    checking its size every `poll_interval` seconds.
+
+    Yields `(offset, data)` for each piece of appended data, where `offset` is
+    the position in the file after `data`. If the file shrinks or is replaced
+    (eg, when a log is rotated), it is followed from its start, and `(0, None)`
+    is yielded first.
+    """
+    deadline = time.monotonic() + duration
+    file_object = storage.open_file(path, "rb")
+    try:
+        while True:
+            stat = storage.run(path, os.stat, path)
+            if stat.st_size < offset or stat.st_ino != file_object.fstat().st_ino:
+                file_object.close()
+                file_object = storage.open_file(path, "rb")
+                offset = 0
+                yield 0, None
+
+            while offset < stat.st_size:
+                file_object.seek(offset)
+                data = file_object.read(min(stat.st_size - offset, FOLLOW_CHUNK_SIZE))
+                # Keep a partial last line back until the rest of it arrives,
+                # unless it fills a whole piece
+                end = data.rfind(b"\n") + 1
+                if end == 0 and len(data) < FOLLOW_CHUNK_SIZE:
+                    break
+                data = data[:end] if end else data
+                offset += len(data)
+                yield offset, data
+
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(poll_interval)
+    finally:
+        file_object.close()
@@ -5,13 +5,72 @@ Tests for views:
 - result-page
 """
 
+import base64
+import cProfile
+import datetime
+import hashlib
+import io
+import json
+import marshal
+import math
 import os
-
+import shutil
+import socket
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+
+from collections import Counter
 from pathlib import Path
+from unittest import mock
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase, override_settings
+from django.contrib.auth.models import Group, Permission
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.http import FileResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from contented import (
+    access_log,
+    archives,
+    hashing,
+    index,
+    jobs,
+    local_cache,
+    restrictions,
+    search,
+    shared_index,
+    signatures,
+    signing,
+    sites,
+    snapshots,
+    static_export,
+    storage,
+    tables,
+    tail,
+    throttle,
+    uploads,
+    views,
+    watcher,
+)
+from contented.models import (
+    AccessEvent,
+    FileEvent,
+    Job,
+    ProjectFile,
+    ProjectSummary,
+    RequestProfile,
+    UserVisit,
+)
 
 
 def get_relative_results_files(project_path):
@@ -46,6 +105,100 @@ def get_collection_details(collection_id):
     return {"path": path, "project_ids": project_ids, "file_paths": file_paths}
 
 
+def read_chars():
+    """
+    The number of bytes that this process has read (using `read` and similar
+    system calls) so far, or None if this is not known (on non-Linux systems).
+    """
+    try:
+        with open("/proc/self/io") as io_stats:
+            for line in io_stats:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class RequestCost:
+    """
+    Measure the cost of handling a request: the number of database queries,
+    the number of filesystem calls of each kind (`listdir`, `scandir`, `stat`
+    and `open`) and the number of bytes read.
+    """
+
+    FILESYSTEM_CALLS = {
+        "listdir": ["os.listdir"],
+        "scandir": ["os.scandir"],
+        "stat": ["os.stat", "os.lstat"],
+        "open": ["builtins.open", "io.open"],
+    }
+
+    def __init__(self, client, url, **params):
+        self.calls = Counter()
+        # Queued access events are written once a batch is due; write them
+        # now, so that the batch is not charged to this request
+        access_log.flush()
+
+        patches = [
+            mock.patch(target, self.counted(call, target))
+            for call, targets in self.FILESYSTEM_CALLS.items()
+            for target in targets
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            chars_before = read_chars()
+            for patch in patches:
+                patch.start()
+            try:
+                self.response = client.get(url, params)
+                if self.response.streaming:
+                    self.content = b"".join(self.response.streaming_content)
+                else:
+                    self.content = self.response.content
+            finally:
+                for patch in patches:
+                    patch.stop()
+            chars_after = read_chars()
+
+        self.queries = len(queries)
+        self.bytes_read = None
+        if chars_before is not None:
+            self.bytes_read = chars_after - chars_before
+
+    def counted(self, call, target):
+        module_name, function_name = target.split(".")
+        original = getattr(__import__(module_name), function_name)
+
+        def counted_call(*args, **kwargs):
+            self.calls[call] += 1
+            return original(*args, **kwargs)
+
+        return counted_call
+
+    def __repr__(self):
+        return (
+            f"RequestCost(queries={self.queries}, calls={dict(self.calls)}, "
+            f"bytes_read={self.bytes_read})"
+        )
+
+
+class ContentedTestCase(TestCase):
+    """
+    A test case with a temporary directory (`self.temp_dir`), and settings that
+    are overridden for the whole of a test (`use_settings`); both are undone
+    when the test finishes.
+    """
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def use_settings(self, **kwargs):
+        overrides = self.settings(**kwargs)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+
 class HomePageTest(TestCase):
     """
     The home-page for contented-based websites contains
@@ -119,6 +272,130 @@ class HomePageTest(TestCase):
                         response, hyperlink_stub.format(proj=project_id), html=True
                     )
 
+
+class HomePagePaginationTest(ContentedTestCase):
+    """
+    Collections with many projects are listed a page at a time, sorted and
+    filtered on the server.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.project_ids = [f"project_{number:02}" for number in range(25)]
+        self.project_ids += ["other_a", "other_b"]
+        for project_id in self.project_ids:
+            (self.temp_dir / project_id).mkdir()
+
+        self.use_settings(
+            PROJECTS_DIR=self.temp_dir, RESTRICTED_PROJECTS=["project_05"]
+        )
+
+        page_size = mock.patch.object(views, "HOME_PAGE_SIZE", 10)
+        page_size.start()
+        self.addCleanup(page_size.stop)
+
+        get_user_model().objects.create_user(
+            username="testuser1", password="not-a-password"
+        )
+
+    def get_all_pages(self, **params):
+        """
+        Follow the "next page" links from the first page; return the projects
+        on each page.
+        """
+        pages = []
+        response = self.client.get(reverse("home"), params)
+        while True:
+            pages.append(response.context["project_ids"])
+            next_url = response.context["next_url"]
+            if next_url is None:
+                return pages
+            response = self.client.get(reverse("home") + next_url)
+
+    def test_pages_list_every_project_in_name_order(self):
+        """
+        GIVEN: a logged-in user, and a collection of 27 projects
+        WHEN: the user follows the pages of the home page
+        THEN: every project is listed once, in name order, ten at a time
+        """
+        self.client.login(username="testuser1", password="not-a-password")
+        pages = self.get_all_pages()
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 7])
+        self.assertEqual(sum(pages, []), sorted(self.project_ids))
+
+    def test_restricted_projects_are_left_out_of_every_page(self):
+        """
+        GIVEN: a user who has not logged in
+        WHEN: the user follows the pages of the home page
+        THEN: the restricted project is not listed, and the pages stay full
+        """
+        pages = self.get_all_pages()
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 6])
+        self.assertNotIn("project_05", sum(pages, []))
+
+    def test_projects_can_be_filtered_by_name(self):
+        """
+        WHEN: the user filters the projects by a name prefix, or by part of the
+        name
+        THEN: only the matching projects are listed
+        """
+        self.assertEqual(self.get_all_pages(prefix="other"), [["other_a", "other_b"]])
+        self.assertEqual(
+            self.get_all_pages(q="T_0"),
+            [[f"project_0{number}" for number in range(10) if number != 5]],
+        )
+        self.assertEqual(self.get_all_pages(prefix="nothing"), [[]])
+
+    def test_projects_can_be_sorted_by_last_update(self):
+        """
+        GIVEN: projects in the project index, updated at different times
+        WHEN: the user sorts the home page by last update
+        THEN: the projects are listed from the most recently updated, across
+        pages
+        """
+        collection = index.get_collection_key()
+        start = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+        for number, project_id in enumerate(self.project_ids):
+            ProjectSummary.objects.create(
+                collection=collection,
+                project_id=project_id,
+                file_count=1,
+                # Pairs of projects share an update time
+                last_updated=start + datetime.timedelta(hours=number // 2),
+            )
+
+        self.client.login(username="testuser1", password="not-a-password")
+        pages = self.get_all_pages(sort="updated")
+
+        expected = sorted(
+            self.project_ids,
+            key=lambda p: (-(self.project_ids.index(p) // 2), p),
+        )
+        self.assertEqual([len(page) for page in pages], [10, 10, 7])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_later_pages_cost_the_same_as_the_first(self):
+        """
+        GIVEN: the home page has been listed once
+        WHEN: the user opens the first and the last page
+        THEN: the collection is not listed again, and each page makes the
+        same (single) database query
+        """
+        response = self.client.get(reverse("home"))
+        last_page = reverse("home") + response.context["next_url"]
+
+        for url in [reverse("home"), last_page]:
+            with mock.patch("os.listdir") as listdir, CaptureQueriesContext(
+                connection
+            ) as queries:
+                self.client.get(url)
+            listdir.assert_not_called()
+            self.assertEqual(len(queries), 1)
+
+
 @override_settings(
     PROJECTS_DIR=Path("dummy_projects"),
     RESTRICTED_PROJECTS=["my_other_project"],
@@ -442,10 +719,12 @@ class ResultsPageTest(TestCase):
             return file_text
 
         def get_response_contents(response, binary):
+            # Every results file is streamed
+            contents = b"".join(response.streaming_content)
             if binary:
-                return b"".join(response.streaming_content)
+                return contents
 
-            return response.content.decode("utf8")
+            return contents.decode("utf8")
 
         def assert_file_matches_browser_contents(path, project_id, file_name):
             file_path = path / project_id / file_name
@@ -504,3 +783,3292 @@ class ResultsPageTest(TestCase):
             "Couldn't redirect to login when accessing a restricted project",
         )
         self.assertEqual(response.url, settings.LOGIN_URL)
+
+
+class TableQueryTest(ContentedTestCase):
+    """
+    Tabular results files (.csv / .tsv) can be filtered, sorted and paginated
+    on the server, using a columnar copy of the table.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.projects_dir = self.temp_dir / "projects"
+        (self.projects_dir / "genes_project").mkdir(parents=True)
+        self.table_path = self.projects_dir / "genes_project" / "genes.csv"
+        self.table_path.write_text(
+            "gene,pvalue,score\nBRCA1,0.01,5\nTP53,0.2,3\nMYC,0.04,9\nKRAS,0.5,1\n"
+        )
+
+        self.use_settings(
+            PROJECTS_DIR=self.projects_dir,
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+            RESTRICTED_PROJECTS=[],
+        )
+
+    def get_json(self, **params):
+        url = reverse("table", args=["genes_project", "genes.csv"])
+        response = self.client.get(url, {"format": "json", **params})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_filters_and_sorts_rows(self):
+        """
+        WHEN: the user filters a table on a numeric column and sorts it
+        THEN: only the matching rows are returned, in the requested order
+        """
+        rows = self.get_json(filter="pvalue<0.05", sort="-score")
+        self.assertEqual([row["gene"] for row in rows], ["MYC", "BRCA1"])
+
+    def test_selects_columns_and_paginates(self):
+        """
+        WHEN: the user requests a subset of the columns and a page of rows
+        THEN: only those columns and rows are returned
+        """
+        rows = self.get_json(columns="gene", sort="gene", offset=1, limit=2)
+        self.assertEqual(rows, [{"gene": "KRAS"}, {"gene": "MYC"}])
+
+    def test_returns_csv_by_default(self):
+        """
+        WHEN: the user does not specify an output format
+        THEN: the matching rows are returned as CSV
+        """
+        url = reverse("table", args=["genes_project", "genes.csv"])
+        response = self.client.get(url, {"filter": "gene=TP53", "columns": "gene"})
+        self.assertEqual(response["content-type"], "text/csv")
+        self.assertEqual(
+            b"".join(response.streaming_content).decode("utf8").split(),
+            ['"gene"', '"TP53"'],
+        )
+
+    def test_unknown_columns_are_rejected(self):
+        """
+        WHEN: the user filters on a column that is not in the table
+        THEN: the request is rejected as a bad request
+        """
+        url = reverse("table", args=["genes_project", "genes.csv"])
+        response = self.client.get(url, {"filter": "not_a_column<1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cache_is_rebuilt_when_table_changes(self):
+        """
+        GIVEN: a table has been queried (so a cached copy exists)
+        WHEN: the table is rewritten
+        THEN: subsequent queries use the new contents
+        """
+        self.get_json()
+        self.table_path.write_text("gene,pvalue,score\nNEW1,0.001,1\n")
+        os.utime(self.table_path, ns=(0, 0))
+
+        rows = self.get_json()
+        self.assertEqual([row["gene"] for row in rows], ["NEW1"])
+
+    def test_threads_can_build_the_same_cache_at_once(self):
+        """
+        GIVEN: several threads of one worker
+        WHEN: they all build the cache of the same table at once
+        THEN: each writes its own temporary file, so none of them fails
+        """
+        source_path = self.projects_dir / "genes_project" / "genes.csv"
+        errors = []
+
+        def build():
+            for _ in range(5):
+                try:
+                    tables.build_table_cache(source_path)
+                except OSError as error:
+                    errors.append(error)
+
+        threads = [threading.Thread(target=build) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual([row["gene"] for row in self.get_json()][0], "BRCA1")
+
+    def test_unlogged_users_cannot_query_restricted_tables(self):
+        """
+        GIVEN: a user who has not logged in and a table in a restricted project
+        WHEN: the user tries to query that table
+        THEN: the user is redirected to the login page
+        """
+        with self.settings(RESTRICTED_PROJECTS=["genes_project"]):
+            url = reverse("table", args=["genes_project", "genes.csv"])
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, settings.LOGIN_URL)
+
+
+class JobQueueTest(ContentedTestCase):
+    """
+    Expensive derived artifacts are computed by background jobs, which are
+    deduplicated, prioritised and retried on failure.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.projects_dir = self.temp_dir / "projects"
+        (self.projects_dir / "genes_project").mkdir(parents=True)
+        self.table_path = self.projects_dir / "genes_project" / "genes.tsv"
+        self.table_path.write_text("gene\tpvalue\nBRCA1\t0.01\nTP53\t0.2\n")
+
+        self.use_settings(
+            PROJECTS_DIR=self.projects_dir,
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+            RESTRICTED_PROJECTS=[],
+        )
+
+    def test_jobs_are_deduplicated_by_path_and_mtime(self):
+        """
+        WHEN: the same artifact is requested twice for an unchanged file
+        THEN: only one job is queued; once the file changes, a new job is queued
+        """
+        first = jobs.enqueue("table", self.table_path)
+        second = jobs.enqueue("table", self.table_path)
+        self.assertEqual(first.pk, second.pk)
+
+        os.utime(self.table_path, ns=(0, 0))
+        third = jobs.enqueue("table", self.table_path)
+        self.assertNotEqual(first.pk, third.pk)
+
+    def test_jobs_are_claimed_in_priority_order(self):
+        """
+        GIVEN: several queued jobs
+        WHEN: a worker claims a job
+        THEN: the job with the highest priority is claimed first
+        """
+        other_path = self.projects_dir / "genes_project" / "other.csv"
+        other_path.write_text("a,b\n1,2\n")
+        jobs.enqueue("table", self.table_path)
+        urgent = jobs.enqueue("table", other_path, priority=5)
+
+        self.assertEqual(jobs.claim_next_job().pk, urgent.pk)
+
+    def test_failing_jobs_are_retried_then_marked_failed(self):
+        """
+        WHEN: a job's handler raises an error
+        THEN: the job is re-queued until it has used all of its attempts
+        """
+        failing_handler = mock.Mock(side_effect=RuntimeError("oops"))
+        with mock.patch.dict(jobs.JOB_HANDLERS, {"table": failing_handler}):
+            job = jobs.enqueue("table", self.table_path)
+            jobs.run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(failing_handler.call_count, job.max_attempts)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("oops", job.error)
+
+    def test_failed_jobs_are_retried_once_they_have_waited(self):
+        """
+        GIVEN: a job that has failed
+        WHEN: its artifact is asked for again, before and after
+          `FAILED_JOB_RETRY_AFTER` has passed
+        THEN: the job is only put back on the queue once that time has passed
+        """
+        failing_handler = mock.Mock(side_effect=RuntimeError("oops"))
+        with mock.patch.dict(jobs.JOB_HANDLERS, {"table": failing_handler}):
+            job = jobs.enqueue("table", self.table_path)
+            jobs.run_pending_jobs()
+
+        self.assertEqual(jobs.enqueue("table", self.table_path).status, Job.FAILED)
+
+        Job.objects.filter(pk=job.pk).update(
+            finished=job.created - jobs.FAILED_JOB_RETRY_AFTER
+        )
+        job = jobs.enqueue("table", self.table_path)
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 0))
+
+    def test_only_abandoned_jobs_are_requeued(self):
+        """
+        GIVEN: running jobs, claimed by a live worker, by a worker process that
+        has gone, and by a worker that has not reported for too long
+        WHEN: a worker starts
+        THEN: only the jobs of the gone and the silent workers are re-queued
+        """
+        gone_worker = subprocess.Popen(["true"])
+        gone_worker.wait()
+        host = socket.gethostname()
+        paths = []
+        for name in ["live", "gone", "silent"]:
+            path = self.projects_dir / "genes_project" / f"{name}.csv"
+            path.write_text("a,b\n1,2\n")
+            paths.append(path)
+            jobs.enqueue("table", path)
+            jobs.claim_next_job()
+
+        live, gone, silent = [Job.objects.get(path=str(path)) for path in paths]
+        Job.objects.filter(pk=live.pk).update(worker=f"{host}:{os.getppid()}")
+        Job.objects.filter(pk=gone.pk).update(worker=f"{host}:{gone_worker.pid}")
+        Job.objects.filter(pk=silent.pk).update(
+            worker="elsewhere:1",
+            heartbeat=timezone.now() - jobs.RUNNING_JOB_TIMEOUT,
+        )
+
+        self.assertEqual(jobs.requeue_interrupted_jobs(), 2)
+        self.assertEqual(
+            [Job.objects.get(pk=job.pk).status for job in [live, gone, silent]],
+            [Job.RUNNING, Job.QUEUED, Job.QUEUED],
+        )
+
+    def test_retried_jobs_are_no_longer_marked_finished(self):
+        """
+        GIVEN: a job that has failed
+        WHEN: an admin re-queues it
+        THEN: it is queued afresh, with no finish time or progress
+        """
+        get_user_model().objects.create_superuser("admin", password="pass")
+        self.client.login(username="admin", password="pass")
+        job = jobs.enqueue("table", self.table_path)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.FAILED, progress=0.5, attempts=3, finished=timezone.now()
+        )
+
+        self.client.post(
+            reverse("admin:contented_job_changelist"),
+            {"action": "retry_jobs", "_selected_action": [job.pk]},
+        )
+
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.status, job.progress, job.attempts, job.finished),
+            (Job.QUEUED, 0.0, 0, None),
+        )
+
+    def test_large_tables_are_converted_in_the_background(self):
+        """
+        GIVEN: a table that is too large to convert while the user waits
+        WHEN: the user queries the table
+        THEN: a job is queued and the user is asked to try again; once the
+        job has run, the query succeeds
+        """
+        url = reverse("table", args=["genes_project", "genes.tsv"])
+        with mock.patch.object(tables, "INLINE_BUILD_MAX_BYTES", 1):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 202)
+            self.assertIn("Retry-After", response)
+
+            self.assertEqual(jobs.run_pending_jobs(), 1)
+            job = Job.objects.get(path=str(self.table_path))
+            self.assertEqual((job.status, job.progress), (Job.DONE, 1.0))
+
+            response = self.client.get(url, {"filter": "pvalue<0.05"})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"BRCA1", b"".join(response.streaming_content))
+
+    def test_tables_are_rebuilt_once_the_cache_is_cleared(self):
+        """
+        GIVEN: a large table whose conversion job has run
+        WHEN: the cache is cleared, and the user queries the table again
+        THEN: the finished job is put back on the queue, and the query
+        succeeds once it has run again
+        """
+        url = reverse("table", args=["genes_project", "genes.tsv"])
+        with mock.patch.object(tables, "INLINE_BUILD_MAX_BYTES", 1):
+            self.client.get(url)
+            jobs.run_pending_jobs()
+            shutil.rmtree(self.temp_dir / "cache")
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(jobs.run_pending_jobs(), 1)
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ProjectIndexTest(ContentedTestCase):
+    """
+    The project index records each file in a collection, and each change to
+    those files, so that project pages need not walk the project directories.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.projects_dir = self.temp_dir / "projects"
+        self.project_path = self.projects_dir / "live_project"
+        (self.project_path / "figures").mkdir(parents=True)
+        (self.project_path / "README.md").write_text("A live project")
+        (self.project_path / "figures" / "volcano.svg").write_text("<svg/>")
+
+        self.use_settings(
+            PROJECTS_DIR=self.projects_dir,
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+            CONTENTED_USE_INDEX=True,
+            RESTRICTED_PROJECTS=[],
+        )
+
+    def test_scan_records_created_modified_and_removed_files(self):
+        """
+        GIVEN: an indexed collection
+        WHEN: files are added, modified and removed, and the collection is
+        rescanned
+        THEN: one event is recorded for each change, in a new generation
+        """
+        created = index.scan_collection()
+        self.assertEqual(
+            sorted((e.kind, e.path) for e in created),
+            [("created", "README.md"), ("created", "figures/volcano.svg")],
+        )
+        generation = index.get_generation()
+
+        (self.project_path / "README.md").write_text("Changed")
+        os.utime(self.project_path / "README.md", ns=(0, 0))
+        (self.project_path / "figures" / "volcano.svg").unlink()
+        (self.project_path / "notes.txt").write_text("new")
+
+        changes = index.scan_collection()
+        self.assertEqual(
+            sorted((e.kind, e.path) for e in changes),
+            [
+                ("created", "notes.txt"),
+                ("modified", "README.md"),
+                ("removed", "figures/volcano.svg"),
+            ],
+        )
+        self.assertEqual(
+            [e.path for e in index.get_events_since(generation)],
+            [e.path for e in changes],
+        )
+        self.assertEqual(index.scan_collection(), [])
+
+    def test_project_page_lists_files_from_index(self):
+        """
+        GIVEN: the project index is in use
+        WHEN: the user opens a project page
+        THEN: the files in the index are listed (files that have not yet been
+        indexed are not)
+        """
+        index.scan_collection()
+        (self.project_path / "unindexed.txt").write_text("not yet indexed")
+
+        response = self.client.get(reverse("project", args=["live_project"]))
+        self.assertContains(response, "figures/volcano.svg")
+        self.assertNotContains(response, "unindexed.txt")
+        self.assertContains(response, "EventSource")
+
+    def test_project_events_are_streamed_after_a_generation(self):
+        """
+        GIVEN: a project page was rendered at some generation of the index
+        WHEN: the page subscribes to the events for that project
+        THEN: each change after that generation is sent as a server-sent event
+        """
+        index.scan_collection()
+        generation = index.get_generation("live_project")
+        (self.project_path / "notes.txt").write_text("new")
+        event = index.record_change("live_project", "notes.txt")
+
+        url = reverse("project_events", args=["live_project"])
+        with mock.patch.object(views, "EVENT_STREAM_SECONDS", 0):
+            response = self.client.get(url, {"since": generation})
+            stream = b"".join(response.streaming_content).decode("utf8")
+
+        self.assertEqual(response["content-type"], "text/event-stream")
+        self.assertIn(f"id: {event.id}\nevent: created\n", stream)
+        self.assertIn('"path": "notes.txt"', stream)
+        self.assertNotIn("README.md", stream)
+
+    def test_changed_tables_are_removed_from_the_cache(self):
+        """
+        GIVEN: a table with a cached columnar copy
+        WHEN: the index records a change to the table
+        THEN: the cached copy is removed
+        """
+        table_path = self.project_path / "genes.csv"
+        table_path.write_text("gene,pvalue\nMYC,0.1\n")
+        tables.build_table_cache(table_path)
+
+        table_path.write_text("gene,pvalue\nMYC,0.2\n")
+        index.record_change("live_project", "genes.csv")
+        self.assertFalse(tables.get_table_cache_path(table_path).exists())
+
+    def test_inotify_changes_are_applied_to_the_index(self):
+        """
+        GIVEN: an indexed collection that is being watched with inotify
+        WHEN: a file is written and a new folder of results is added
+        THEN: the watcher records each new file in the index
+        """
+        index.scan_collection()
+        projects_dir = self.projects_dir.resolve()
+
+        with watcher.Inotify(projects_dir) as inotify:
+            (projects_dir / "live_project" / "notes.txt").write_text("new")
+            new_folder = projects_dir / "live_project" / "tables"
+            new_folder.mkdir()
+            (new_folder / "abc.csv").write_text("a,b\n1,2\n")
+
+            changes = inotify.read_changes(timeout=1.0)
+            changes |= inotify.read_changes(timeout=0.1)
+            events = watcher.apply_changes(projects_dir, changes)
+
+        self.assertEqual(
+            sorted((e.kind, e.path) for e in events),
+            [("created", "notes.txt"), ("created", "tables/abc.csv")],
+        )
+        self.assertIn(
+            "tables/abc.csv", index.get_indexed_files("live_project", projects_dir)
+        )
+
+
+class ProjectSummaryTest(ContentedTestCase):
+    """
+    The home page shows statistics for each project, which are maintained in
+    the project index as files change.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.projects_dir = self.temp_dir / "projects"
+        self.project_path = self.projects_dir / "summarised_project"
+        self.project_path.mkdir(parents=True)
+        (self.project_path / "a.csv").write_text("1234")
+        (self.project_path / "b.csv").write_text("12")
+        (self.project_path / "report.pdf").write_text("123456")
+
+        self.use_settings(PROJECTS_DIR=self.projects_dir, RESTRICTED_PROJECTS=[])
+
+    def get_summary(self):
+        return ProjectSummary.objects.get(
+            collection=index.get_collection_key(), project_id="summarised_project"
+        )
+
+    def test_summary_is_updated_incrementally(self):
+        """
+        GIVEN: an indexed project
+        WHEN: files are added, modified and removed
+        THEN: the project's summary reflects the changes
+        """
+        index.scan_collection()
+        summary = self.get_summary()
+        self.assertEqual((summary.file_count, summary.total_size), (3, 12))
+        self.assertEqual(summary.type_breakdown(), [("csv", 2), ("pdf", 1)])
+
+        (self.project_path / "a.csv").write_text("1")
+        (self.project_path / "report.pdf").unlink()
+        (self.project_path / "notes").write_text("12345")
+        index.scan_collection()
+
+        summary = self.get_summary()
+        self.assertEqual((summary.file_count, summary.total_size), (3, 8))
+        self.assertEqual(summary.type_breakdown(), [("csv", 2), ("(none)", 1)])
+
+    def test_home_page_shows_project_summary(self):
+        """
+        GIVEN: an indexed project
+        WHEN: the user opens the home page
+        THEN: the number of files, their size and types are shown
+        """
+        index.scan_collection()
+        response = self.client.get(reverse("home"))
+
+        self.assertContains(response, "<td>3</td>", html=True)
+        self.assertContains(response, "12\xa0bytes")
+        self.assertContains(response, "csv: 2")
+
+    def test_home_page_does_not_walk_projects(self):
+        """
+        WHEN: the user opens the home page
+        THEN: the project directories are not walked
+        """
+        index.scan_collection()
+        with mock.patch("os.walk") as walk:
+            self.client.get(reverse("home"))
+        walk.assert_not_called()
+
+
+class ManifestTest(ContentedTestCase):
+    """
+    Clients that mirror a project can fetch a manifest of its files, with
+    content-hashes, and ask for only the changes since their last visit.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.projects_dir = self.temp_dir / "projects"
+        self.project_path = self.projects_dir / "mirrored_project"
+        (self.project_path / "sub").mkdir(parents=True)
+        (self.project_path / "a.txt").write_text("alpha")
+        (self.project_path / "sub" / "b.txt").write_text("beta")
+
+        self.use_settings(
+            PROJECTS_DIR=self.projects_dir,
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+            RESTRICTED_PROJECTS=[],
+        )
+        index.scan_collection()
+
+    def get_manifest(self, **params):
+        url = reverse("manifest", args=["mirrored_project"])
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_unhashed_files_are_queued_for_hashing(self):
+        """
+        GIVEN: a newly indexed project
+        WHEN: a client requests the manifest
+        THEN: the files are listed without hashes, and a hashing job is queued
+        """
+        manifest = self.get_manifest()
+        self.assertFalse(manifest["complete"])
+        self.assertEqual([f["hash"] for f in manifest["files"]], [None, None])
+        self.assertTrue(Job.objects.filter(kind="hash").exists())
+
+    def test_manifest_lists_sizes_and_hashes(self):
+        """
+        GIVEN: a project whose files have been hashed
+        WHEN: a client requests the manifest
+        THEN: each file is listed with its size and content-hash
+        """
+        jobs.enqueue_project_hashing("mirrored_project")
+        jobs.run_pending_jobs()
+
+        manifest = self.get_manifest()
+        self.assertTrue(manifest["complete"])
+        self.assertEqual(
+            [(f["path"], f["size"]) for f in manifest["files"]],
+            [("a.txt", 5), ("sub/b.txt", 4)],
+        )
+        if hashing.get_hash_algorithm() == "sha256":
+            self.assertEqual(
+                manifest["files"][0]["hash"], hashlib.sha256(b"alpha").hexdigest()
+            )
+
+    def test_delta_manifest_lists_only_changes(self):
+        """
+        GIVEN: a client that mirrored the project at some generation
+        WHEN: files are then changed, and the client asks for the changes
+        since that generation
+        THEN: only the changed and removed files are listed
+        """
+        generation = self.get_manifest()["generation"]
+
+        (self.project_path / "a.txt").write_text("alpha, again")
+        (self.project_path / "sub" / "b.txt").unlink()
+        (self.project_path / "c.txt").write_text("gamma")
+        index.scan_collection()
+
+        manifest = self.get_manifest(since=generation)
+        self.assertGreater(manifest["generation"], generation)
+        self.assertEqual(
+            [(f["path"], f.get("removed", False)) for f in manifest["files"]],
+            [("a.txt", False), ("c.txt", False), ("sub/b.txt", True)],
+        )
+        self.assertEqual(self.get_manifest(since=manifest["generation"])["files"], [])
+
+    def test_hashes_are_cleared_when_files_change(self):
+        """
+        GIVEN: a hashed file
+        WHEN: the file is modified
+        THEN: its hash is dropped until it is recomputed
+        """
+        jobs.enqueue_project_hashing("mirrored_project")
+        jobs.run_pending_jobs()
+        (self.project_path / "a.txt").write_text("changed")
+        index.scan_collection()
+
+        files = {f["path"]: f for f in self.get_manifest()["files"]}
+        self.assertIsNone(files["a.txt"]["hash"])
+        self.assertIsNotNone(files["sub/b.txt"]["hash"])
+
+    def test_hashes_are_sent_to_clients_that_synced_before_hashing(self):
+        """
+        GIVEN: a client that mirrored the project before its files were hashed
+        WHEN: the files are hashed, and the client asks for the changes since
+        its last visit
+        THEN: the files are listed again, with their hashes, and the hashing
+        is not shown as a change to the files
+        """
+        get_user_model().objects.create_user(
+            username="testuser1", password="not-a-password"
+        )
+        self.client.login(username="testuser1", password="not-a-password")
+        self.client.get(reverse("whats_new"))
+        generation = self.get_manifest()["generation"]
+
+        jobs.enqueue_project_hashing("mirrored_project")
+        jobs.run_pending_jobs()
+
+        manifest = self.get_manifest(since=generation)
+        self.assertTrue(manifest["complete"])
+        self.assertEqual(
+            [(f["path"], f["hash"] is not None) for f in manifest["files"]],
+            [("a.txt", True), ("sub/b.txt", True)],
+        )
+        self.assertEqual(self.client.get(reverse("whats_new")).context["changes"], [])
+
+    def test_unlogged_users_cannot_fetch_restricted_manifests(self):
+        """
+        GIVEN: a user who has not logged in and a restricted project
+        WHEN: the user requests the manifest for that project
+        THEN: the user is redirected to the login page
+        """
+        with self.settings(RESTRICTED_PROJECTS=["mirrored_project"]):
+            response = self.client.get(reverse("manifest", args=["mirrored_project"]))
+        self.assertEqual(response.status_code, 302)
+
+
+class WhatsNewTest(ContentedTestCase):
+    """
+    Logged-in users can see which files have been added, modified or removed
+    since they last looked.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.projects_dir = self.temp_dir / "projects"
+        self.project_path = self.projects_dir / "watched_project"
+        self.project_path.mkdir(parents=True)
+        (self.project_path / "kept.txt").write_text("kept")
+        (self.project_path / "changed.txt").write_text("before")
+        (self.project_path / "removed.txt").write_text("removed")
+
+        self.use_settings(
+            PROJECTS_DIR=self.projects_dir,
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+            RESTRICTED_PROJECTS=[],
+        )
+        index.scan_collection()
+
+        get_user_model().objects.create_user(
+            username="testuser1", password="not-a-password"
+        )
+        self.client.login(username="testuser1", password="not-a-password")
+
+    def get_changes(self):
+        response = self.client.get(reverse("whats_new"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "whats_new.html")
+        changes = response.context["changes"]
+        if changes is None:
+            return None
+        return {(change.path, change.kind) for change in changes}
+
+    def test_unlogged_users_are_redirected(self):
+        """
+        GIVEN: a user who has not logged in
+        WHEN: the user requests the "what's new" page
+        THEN: the user is redirected to the login page
+        """
+        self.client.logout()
+        response = self.client.get(reverse("whats_new"))
+        self.assertRedirects(
+            response, settings.LOGIN_URL, fetch_redirect_response=False
+        )
+
+    def test_first_visit_shows_no_changes(self):
+        """
+        GIVEN: a user who has not viewed the "what's new" page before
+        WHEN: the user views it
+        THEN: no changes are listed, and the current generation is recorded
+        """
+        self.assertIsNone(self.get_changes())
+        visit = UserVisit.objects.get(user__username="testuser1")
+        self.assertEqual(visit.seen_generation, index.get_generation())
+
+    def test_changes_since_the_last_visit_are_listed_once(self):
+        """
+        GIVEN: a user who has viewed the "what's new" page
+        WHEN: files are then added, modified and removed, and the user views
+          the page twice
+        THEN: the net change to each file is listed on the first of those
+          views, and nothing is listed on the second
+        """
+        self.get_changes()
+
+        (self.project_path / "changed.txt").write_text("after the change")
+        (self.project_path / "removed.txt").unlink()
+        (self.project_path / "added.txt").write_text("added")
+        (self.project_path / "temporary.txt").write_text("temporary")
+        index.scan_project("watched_project")
+        (self.project_path / "added.txt").write_text("added and then modified")
+        (self.project_path / "temporary.txt").unlink()
+        index.scan_project("watched_project")
+
+        self.assertEqual(
+            self.get_changes(),
+            {
+                ("changed.txt", "modified"),
+                ("removed.txt", "removed"),
+                ("added.txt", "created"),
+            },
+        )
+        self.assertEqual(self.get_changes(), set())
+
+    def test_feed_cost_does_not_depend_on_collection_size(self):
+        """
+        GIVEN: a user who has viewed the "what's new" page, and a single change
+          in a collection of many files
+        WHEN: the user views the page again
+        THEN: the page is built with a fixed number of queries, and without
+          walking any project directory
+        """
+        for number in range(200):
+            (self.project_path / f"file_{number}.txt").write_text("x")
+        index.scan_project("watched_project")
+        self.get_changes()
+
+        (self.project_path / "kept.txt").write_text("now modified")
+        index.record_change("watched_project", "kept.txt")
+
+        with mock.patch("os.walk") as walk, CaptureQueriesContext(
+            connection
+        ) as queries:
+            self.assertEqual(self.get_changes(), {("kept.txt", "modified")})
+        walk.assert_not_called()
+        self.assertLessEqual(len(queries), 10)
+
+    def test_restricted_files_are_not_listed(self):
+        """
+        GIVEN: a rule that restricts the `raw_data` folder of every project,
+          and a user who is not in the site's group
+        WHEN: files are added inside and outside that folder
+        THEN: only the file that the user could download is listed, and no
+          more changes are said to be waiting
+        """
+        self.use_settings(
+            RESTRICTED_PROJECTS=["*/raw_data/"], CONTENTED_SITE_GROUP="staff"
+        )
+        self.get_changes()
+
+        (self.project_path / "raw_data").mkdir()
+        (self.project_path / "raw_data" / "secret_patient_ids.csv").write_text("x")
+        (self.project_path / "summary.txt").write_text("summary")
+        index.scan_project("watched_project")
+
+        self.assertEqual(self.get_changes(), {("summary.txt", "created")})
+
+        (self.project_path / "raw_data" / "more_ids.csv").write_text("x")
+        index.scan_project("watched_project")
+        with mock.patch.object(views, "MAX_FEED_EVENTS", 0):
+            response = self.client.get(reverse("whats_new"))
+        self.assertEqual(response.context["changes"], [])
+        self.assertFalse(response.context["more"])
+
+
+@override_settings(
+    PROJECTS_DIR=Path("dummy_projects"),
+    RESTRICTED_PROJECTS=["my_test_project"],
+    SIGNED_URL_NGINX=False,
+)
+class SignedUrlTest(ContentedTestCase):
+    """
+    Logged-in users can obtain signed, expiring URLs for files and folders in
+    restricted projects; those URLs work without logging in, and are checked
+    without any database access.
+    """
+
+    def setUp(self):
+        super().setUp()
+        get_user_model().objects.create_user(
+            username="testuser1", password="not-a-password"
+        )
+        # Start with an empty access log, so that no batch is due
+        access_log.flush()
+
+    def get_signed_url(self, *args, **params):
+        self.client.login(username="testuser1", password="not-a-password")
+        response = self.client.get(reverse("sign", args=args), params)
+        self.client.logout()
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode("utf8").strip()
+
+    def test_unlogged_users_cannot_obtain_signed_urls(self):
+        """
+        GIVEN: a user who has not logged in and a restricted project
+        WHEN: the user asks for a signed URL for a file in that project
+        THEN: the user is redirected to the login page
+        """
+        response = self.client.get(reverse("sign", args=["my_test_project", "abc.csv"]))
+        self.assertEqual(response.status_code, 302)
+
+    def test_signed_file_url_works_without_database_access(self):
+        """
+        GIVEN: a signed URL for a file in a restricted project
+        WHEN: a user who has not logged in opens that URL
+        THEN: the file is served, without any database queries
+        """
+        url = self.get_signed_url("my_test_project", "abc.csv")
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+            contents = b"".join(response.streaming_content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            contents, Path("dummy_projects/my_test_project/abc.csv").read_bytes()
+        )
+
+    def test_signed_folder_url_gives_access_to_files_in_folder_only(self):
+        """
+        GIVEN: a signed URL for a folder
+        WHEN: the URL is used to list, and then to download, files
+        THEN: the files in the folder are available, but files outside it are
+        not
+        """
+        folder_url = self.get_signed_url("my_test_project", "my_subfolder")
+        listing = self.client.get(folder_url).content.decode("utf8").split()
+        self.assertEqual(len(listing), 1)
+        self.assertTrue(listing[0].endswith("/-/def.tsv"))
+
+        self.assertEqual(self.client.get(listing[0]).status_code, 200)
+        self.assertEqual(self.client.get(folder_url + "../abc.csv").status_code, 403)
+
+    def test_signed_folder_listing_quotes_file_names(self):
+        """
+        GIVEN: a signed URL for a folder whose name, and whose files' names,
+        hold spaces, `#`, `?` and `%`
+        WHEN: the folder is listed
+        THEN: each listed URL downloads its file
+        """
+        folder = self.temp_dir / "odd_project" / "my results"
+        folder.mkdir(parents=True)
+        names = ["a b.txt", "c#1.txt", "d?.txt", "e%20.txt"]
+        for name in names:
+            (folder / name).write_text(name)
+
+        with self.settings(PROJECTS_DIR=self.temp_dir):
+            folder_url = self.get_signed_url("odd_project", "my results")
+            listing = self.client.get(folder_url).content.decode("utf8").split("\n")
+            contents = [
+                b"".join(self.client.get(url).streaming_content).decode("utf8")
+                for url in listing
+                if url
+            ]
+        self.assertEqual(contents, names)
+
+    def test_tampered_and_expired_urls_are_rejected(self):
+        """
+        WHEN: a signed URL is altered, or used after it expires
+        THEN: access is refused
+        """
+        url = self.get_signed_url("my_test_project", "abc.csv")
+        tampered = url.replace("abc.csv", "report.pdf")
+        self.assertEqual(self.client.get(tampered).status_code, 403)
+
+        expired_url = self.get_signed_url("my_test_project", "abc.csv", max_age=1)
+        with mock.patch("time.time", return_value=time.time() + 10):
+            self.assertEqual(self.client.get(expired_url).status_code, 410)
+
+    @override_settings(SIGNED_URL_NGINX=True, SIGNED_URL_SECRET="secret")
+    def test_nginx_tokens_match_secure_link_md5(self):
+        """
+        GIVEN: signed URLs are to be checked by nginx
+        THEN: tokens are computed as nginx's secure_link_md5 would compute them
+        """
+        expected = (
+            base64.urlsafe_b64encode(
+                hashlib.md5(b"1700000000my_test_project/abc.csv secret").digest()
+            )
+            .rstrip(b"=")
+            .decode("ascii")
+        )
+        self.assertEqual(
+            signing.make_token("my_test_project/abc.csv", 1700000000), expected
+        )
+
+
+class SharedIndexTest(ContentedTestCase):
+    """
+    The project listing can be built once, into a memory-mapped file that is
+    shared by every worker process, and swapped when the collection changes.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.index_path = self.temp_dir / "shared.idx"
+
+        self.use_settings(
+            PROJECTS_DIR=Path("dummy_projects"),
+            CONTENTED_SHARED_INDEX=str(self.index_path),
+            RESTRICTED_PROJECTS=[],
+        )
+        self.collection_details = get_collection_details("dummy_projects")
+
+    def test_shared_index_matches_collection(self):
+        """
+        WHEN: the shared index is built for a collection
+        THEN: it lists each project, and the files in each project
+        """
+        shared_index.build_shared_index()
+        shared = shared_index.SharedIndex(self.index_path)
+
+        self.assertEqual(
+            shared.projects(), sorted(self.collection_details["project_ids"])
+        )
+        for project_id, files in self.collection_details["file_paths"].items():
+            self.assertEqual(shared.files(project_id), sorted(files))
+        self.assertNotIn("not-a-project", shared)
+
+    def test_views_use_shared_index_without_crawling(self):
+        """
+        GIVEN: a shared index has been built
+        WHEN: the user opens the home page and a project page
+        THEN: the collection is neither listed nor walked
+        """
+        shared_index.build_shared_index()
+        with mock.patch("os.listdir") as listdir, mock.patch("os.walk") as walk:
+            home = self.client.get(reverse("home"))
+            project = self.client.get(reverse("project", args=["my_test_project"]))
+
+        listdir.assert_not_called()
+        walk.assert_not_called()
+        self.assertContains(home, "my_other_project")
+        self.assertContains(project, "my_subfolder/def.tsv")
+
+    def test_replaced_index_is_remapped(self):
+        """
+        GIVEN: a worker has mapped the shared index
+        WHEN: the index is rebuilt with different contents
+        THEN: the worker picks up the new index
+        """
+        shared_index.write_shared_index(self.index_path, [("old_project", ["a"])])
+        with mock.patch.object(shared_index, "RELOAD_CHECK_INTERVAL", 0):
+            self.assertEqual(
+                shared_index.get_shared_index().projects(), ["old_project"]
+            )
+
+            shared_index.write_shared_index(
+                self.index_path, [("new_project", ["b", "c/d"])]
+            )
+            shared = shared_index.get_shared_index()
+
+        self.assertEqual(shared.projects(), ["new_project"])
+        self.assertEqual(shared.files("new_project"), ["b", "c/d"])
+
+
+class StreamedProjectPageTest(ContentedTestCase):
+    """
+    Project pages can be streamed, so that the page starts to render before a
+    large project has been fully traversed.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.project_path = self.temp_dir / "big_project"
+        for i in range(300):
+            folder = self.project_path / f"folder_{i % 7}"
+            folder.mkdir(parents=True, exist_ok=True)
+            (folder / f"result_{i:03d}.tsv").write_text("a\tb\n")
+
+        self.use_settings(
+            PROJECTS_DIR=self.temp_dir,
+            CONTENTED_STREAM_PROJECT_PAGES=True,
+            RESTRICTED_PROJECTS=[],
+        )
+
+    def test_streamed_page_lists_every_file(self):
+        """
+        WHEN: the user opens a streamed project page
+        THEN: the page is a complete project page, listing every file
+        """
+        response = self.client.get(reverse("project", args=["big_project"]))
+        self.assertTemplateUsed(response, "project.html")
+        self.assertTrue(response.streaming)
+
+        page = b"".join(response.streaming_content).decode("utf8")
+        self.assertEqual(page.count("<tr data-path="), 300)
+        self.assertIn("folder_3/result_010.tsv", page)
+        self.assertTrue(page.rstrip().endswith("</html>"))
+
+    def test_page_head_is_sent_before_the_project_is_walked(self):
+        """
+        WHEN: the user opens a streamed project page
+        THEN: the start of the page is sent before the project directory is
+        walked, and the rows follow in chunks of increasing size
+        """
+        response = self.client.get(reverse("project", args=["big_project"]))
+        chunks = iter(response.streaming_content)
+
+        with mock.patch("os.walk") as walk:
+            head = next(chunks).decode("utf8")
+        walk.assert_not_called()
+        self.assertIn("big_project", head)
+        self.assertNotIn("<tr data-path=", head)
+
+        row_counts = [chunk.decode("utf8").count("<tr data-path=") for chunk in chunks]
+        self.assertEqual(row_counts, [50, 100, 150, 0])
+
+
+class AccessLogTest(ContentedTestCase):
+    """
+    Downloads are recorded in an append-only access log; the events are queued
+    in each worker and written in batches, outside of the request.
+    """
+
+    def setUp(self):
+        super().setUp()
+        get_user_model().objects.create_superuser(
+            username="testuser1", password="not-a-password"
+        )
+        self.use_settings(
+            PROJECTS_DIR=Path("dummy_projects"),
+            RESTRICTED_PROJECTS=["my_test_project"],
+            ACCESS_LOG_BATCH_SIZE=3,
+            ACCESS_LOG_FLUSH_INTERVAL=60,
+        )
+        access_log.flush()
+        AccessEvent.objects.all().delete()
+
+    def download(self, project_id, file_name):
+        response = self.client.get(reverse("results", args=[project_id, file_name]))
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            b"".join(response.streaming_content)
+
+    def test_downloads_are_written_in_batches(self):
+        """
+        GIVEN: a logged-in user
+        WHEN: the user downloads files from a restricted project
+        THEN: nothing is written until a full batch of events is queued; then
+        the whole batch is written, recording who downloaded which file
+        """
+        self.client.login(username="testuser1", password="not-a-password")
+        self.download("my_test_project", "abc.csv")
+        self.download("my_test_project", "my_subfolder/def.tsv")
+        self.assertEqual(AccessEvent.objects.count(), 0)
+
+        self.download("my_other_project", "README.md")
+        self.assertEqual(
+            sorted(AccessEvent.objects.values_list("project_id", "path", "restricted")),
+            [
+                ("my_other_project", "README.md", False),
+                ("my_test_project", "abc.csv", True),
+                ("my_test_project", "my_subfolder/def.tsv", True),
+            ],
+        )
+        event = AccessEvent.objects.get(path="abc.csv")
+        self.assertEqual(event.username, "testuser1")
+        self.assertEqual(
+            event.size, Path("dummy_projects/my_test_project/abc.csv").stat().st_size
+        )
+
+    def test_events_are_kept_if_a_batch_cannot_be_written(self):
+        """
+        GIVEN: queued access events
+        WHEN: the batch cannot be written (eg, the database is locked)
+        THEN: the error does not reach the user, and the events are written
+        with the next batch
+        """
+        with mock.patch.object(
+            AccessEvent.objects, "bulk_create", side_effect=DatabaseError("locked")
+        ), self.assertLogs("contented.access_log", "ERROR"):
+            for _ in range(3):
+                self.download("my_other_project", "README.md")
+
+        self.assertEqual(AccessEvent.objects.count(), 0)
+        self.assertEqual(access_log.flush(), 3)
+        self.assertEqual(AccessEvent.objects.count(), 3)
+
+    def test_an_idle_worker_writes_its_events_from_a_timer(self):
+        """
+        GIVEN: a worker that flushes its access log on a timer
+        WHEN: events are queued, and no further request finishes
+        THEN: the events are written once they are due; if that write fails,
+        the timer tries again
+        """
+        self.use_settings(ACCESS_LOG_FLUSH_INTERVAL=0.05)
+        queue = access_log.AccessLog()
+        queue.flush_on_timer = True
+        written = []
+        done = threading.Event()
+
+        def bulk_create(events):
+            if not written:
+                written.append(None)
+                raise DatabaseError("locked")
+            written.extend(event.path for event in events)
+            done.set()
+
+        with mock.patch.object(
+            AccessEvent.objects, "bulk_create", side_effect=bulk_create
+        ), self.assertLogs("contented.access_log", "ERROR"):
+            queue.record(AccessEvent(project_id="my_other_project", path="a.md"))
+            queue.record(AccessEvent(project_id="my_other_project", path="b.md"))
+            self.assertTrue(done.wait(timeout=5))
+
+        self.assertEqual(written, [None, "a.md", "b.md"])
+        self.assertEqual(len(queue), 0)
+
+    def test_admin_shows_downloads_by_project_and_user(self):
+        """
+        GIVEN: some recorded downloads
+        WHEN: an administrator opens the access log in the admin site
+        THEN: the downloads are totalled for each project and each user
+        """
+        self.download("my_other_project", "README.md")
+        self.client.login(username="testuser1", password="not-a-password")
+        self.download("my_test_project", "abc.csv")
+        self.download("my_test_project", "my_subfolder/def.tsv")
+
+        response = self.client.get(reverse("admin:contented_accessevent_changelist"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                (t["project_id"], t["downloads"])
+                for t in response.context["project_totals"]
+            ],
+            [("my_test_project", 2), ("my_other_project", 1)],
+        )
+        self.assertEqual(
+            [(t["username"], t["downloads"]) for t in response.context["user_totals"]],
+            [("testuser1", 2), ("", 1)],
+        )
+        self.assertContains(response, "(anonymous)")
+
+
+class ThrottleTest(ContentedTestCase):
+    """
+    Downloads are throttled for each user (or IP address), both in the number
+    of requests and in the number of bytes per second.
+    """
+
+    def setUp(self):
+        super().setUp()
+        get_user_model().objects.create_user(
+            username="testuser1", password="not-a-password"
+        )
+        self.use_settings(
+            PROJECTS_DIR=Path("dummy_projects"),
+            RESTRICTED_PROJECTS=[],
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                "throttle": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": str(self.temp_dir / "throttle"),
+                },
+            },
+        )
+        self.now = 1000000.0
+        clock = mock.patch.object(throttle.time, "time", lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def download(self, file_name="abc.csv"):
+        return self.client.get(reverse("results", args=["my_test_project", file_name]))
+
+    @override_settings(THROTTLE_REQUEST_RATE=0.5, THROTTLE_REQUEST_BURST=2)
+    def test_request_rate_is_limited(self):
+        """
+        GIVEN: a limit of 2 requests, then one every 2 seconds
+        WHEN: a client makes requests faster than that
+        THEN: the requests over the limit are refused, with the time to wait
+        """
+        self.assertEqual(self.download().status_code, 200)
+        self.assertEqual(self.download().status_code, 200)
+
+        response = self.download()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "2")
+
+        self.now += 2
+        self.assertEqual(self.download().status_code, 200)
+        self.assertEqual(self.download().status_code, 429)
+
+    @override_settings(THROTTLE_BANDWIDTH=10, THROTTLE_BANDWIDTH_BURST=10)
+    def test_bandwidth_is_limited(self):
+        """
+        GIVEN: a limit of 10 bytes per second
+        WHEN: a client downloads a larger file
+        THEN: the file is sent, but the client must then wait until the
+        bytes have been repaid before downloading again
+        """
+        size = Path("dummy_projects/my_test_project/png.png").stat().st_size
+        response = self.download("png.png")
+        self.assertEqual(response.status_code, 200)
+        b"".join(response.streaming_content)
+
+        response = self.download()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(int(response["Retry-After"]), math.ceil((size - 10) / 10))
+
+        self.now += math.ceil((size - 10) / 10)
+        self.assertEqual(self.download().status_code, 200)
+
+    @override_settings(THROTTLE_BANDWIDTH=10, THROTTLE_BANDWIDTH_BURST=10)
+    def test_streams_of_unknown_size_are_charged_as_they_are_sent(self):
+        """
+        GIVEN: a limit of 10 bytes per second
+        WHEN: a client downloads a streamed CSV export of a table, whose size
+        is not known in advance
+        THEN: the bytes are charged once they have been sent, so the client
+        must then wait before downloading again
+        """
+        self.use_settings(CONTENTED_CACHE_DIR=self.temp_dir / "cache")
+        response = self.client.get(
+            reverse("table", args=["my_test_project", "abc.csv"])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Content-Length"))
+        size = len(b"".join(response.streaming_content))
+        self.assertGreater(size, 10)
+
+        response = self.download()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(int(response["Retry-After"]), math.ceil((size - 10) / 10))
+
+    @override_settings(THROTTLE_REQUEST_RATE=0.1, THROTTLE_REQUEST_BURST=1)
+    def test_users_and_addresses_are_throttled_separately(self):
+        """
+        GIVEN: a client that has reached its limit
+        WHEN: a logged-in user, or another IP address, makes a request
+        THEN: the request is allowed
+        """
+        self.assertEqual(self.download().status_code, 200)
+        self.assertEqual(self.download().status_code, 429)
+
+        response = self.client.get(
+            reverse("results", args=["my_test_project", "abc.csv"]),
+            REMOTE_ADDR="",
+            HTTP_X_REAL_IP="192.0.2.1",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.client.login(username="testuser1", password="not-a-password")
+        self.assertEqual(self.download().status_code, 200)
+        self.assertEqual(self.download().status_code, 429)
+
+
+class PerformanceBudgetTest(ContentedTestCase):
+    """
+    The pages have a budget of database queries, filesystem calls and bytes
+    read; the cost of a page may grow (at most) linearly with the number of
+    projects or files that it lists.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.use_settings(PROJECTS_DIR=Path("dummy_projects"), RESTRICTED_PROJECTS=[])
+
+    def make_collection(self, n_projects, n_files, file_size=1024):
+        """
+        A collection of `n_projects` projects, each with `n_files` files of
+        `file_size` bytes (spread over several folders).
+        """
+        collection = self.temp_dir / f"collection_{n_projects}_{n_files}"
+        contents = b"x" * file_size
+        for project in range(n_projects):
+            for i in range(n_files):
+                folder = collection / f"project_{project}" / f"folder_{i % 10}"
+                folder.mkdir(parents=True, exist_ok=True)
+                (folder / f"file_{i}.txt").write_bytes(contents)
+        return collection
+
+    def measure(self, url_name, *args):
+        # The first request loads and caches the templates
+        self.client.get(reverse(url_name, args=args))
+        return RequestCost(self.client, reverse(url_name, args=args))
+
+    def assertWithinBudget(self, cost, budget):
+        """
+        Check each count in `cost` against the maximum in `budget`.
+        """
+        for measure, maximum in budget.items():
+            if measure == "queries":
+                value = cost.queries
+            elif measure == "bytes_read":
+                if cost.bytes_read is None:
+                    continue
+                value = cost.bytes_read
+            else:
+                value = cost.calls[measure]
+            self.assertLessEqual(value, maximum, f"{measure} over budget: {cost}")
+
+    def assertGrowsAtMostLinearly(self, small, large, factor):
+        """
+        Check that no count in `large` (the cost for `factor` times as many
+        projects / files) is more than `factor` times the same count in `small`.
+        """
+        pairs = {"queries": (small.queries, large.queries)}
+        for call in RequestCost.FILESYSTEM_CALLS:
+            pairs[call] = (small.calls[call], large.calls[call])
+        for measure, (small_value, large_value) in pairs.items():
+            self.assertLessEqual(
+                large_value,
+                factor * max(small_value, 1),
+                f"{measure} grows faster than linearly: {small} vs {large}",
+            )
+
+    def test_dummy_collection_is_within_budget(self):
+        """
+        WHEN: the home page, a project page and a results file are requested
+        THEN: each request is within its budget; in particular, no project
+        directory is walked for the home page, and a results file is read
+        once
+        """
+        self.assertWithinBudget(
+            self.measure("home"),
+            {"queries": 1, "listdir": 1, "scandir": 0, "stat": 5, "open": 0},
+        )
+        self.assertWithinBudget(
+            self.measure("project", "my_test_project"),
+            {"queries": 0, "listdir": 1, "scandir": 2, "stat": 2, "open": 0},
+        )
+
+        size = Path("dummy_projects/my_test_project/report.pdf").stat().st_size
+        self.assertWithinBudget(
+            self.measure("results", "my_test_project", "report.pdf"),
+            {
+                "queries": 0,
+                "listdir": 1,
+                "scandir": 0,
+                "stat": 2,
+                "open": 1,
+                "bytes_read": size + 4096,
+            },
+        )
+
+    def test_home_page_cost_does_not_grow_with_projects(self):
+        """
+        GIVEN: collections of 10 and 40 projects
+        WHEN: the home page is requested
+        THEN: the cost is the same for both collections
+        """
+        costs = []
+        for n_projects in (10, 40):
+            with self.settings(PROJECTS_DIR=self.make_collection(n_projects, 5)):
+                costs.append(self.measure("home"))
+
+        self.assertGrowsAtMostLinearly(costs[0], costs[1], factor=1)
+
+    def test_project_page_cost_grows_linearly_with_files(self):
+        """
+        GIVEN: projects of 100 and 400 files (of 64kB each)
+        WHEN: the project page is requested, by walking the project directory
+        or from the project index
+        THEN: the cost grows at most linearly with the number of files, no
+        files are opened, and the number of queries does not grow at all
+        """
+        for use_index in (False, True):
+            costs = []
+            for n_files in (100, 400):
+                collection = self.make_collection(1, n_files, file_size=65536)
+                with self.settings(
+                    PROJECTS_DIR=collection, CONTENTED_USE_INDEX=use_index
+                ):
+                    if use_index:
+                        index.scan_collection()
+                    costs.append(self.measure("project", "project_0"))
+
+            self.assertGrowsAtMostLinearly(costs[0], costs[1], factor=4)
+            for cost in costs:
+                self.assertWithinBudget(
+                    cost, {"queries": 2, "open": 0, "bytes_read": 65536}
+                )
+            self.assertEqual(costs[0].queries, costs[1].queries)
+
+    def test_results_files_are_streamed_and_read_once(self):
+        """
+        GIVEN: a 4MB text results file, and a 4MB binary (.pdf) results file
+        WHEN: each file is downloaded
+        THEN: the response is streamed, and the file is opened once, and read
+        once
+        """
+        size = 4 * 1024 * 1024
+        collection = self.make_collection(1, 1, file_size=size)
+        folder = collection / "project_0" / "folder_0"
+        shutil.copy(folder / "file_0.txt", folder / "file_0.pdf")
+
+        for file_name in ["file_0.txt", "file_0.pdf"]:
+            with self.subTest(file_name), self.settings(PROJECTS_DIR=collection):
+                cost = self.measure("results", "project_0", f"folder_0/{file_name}")
+
+                self.assertTrue(cost.response.streaming)
+                self.assertEqual(len(cost.content), size)
+                self.assertWithinBudget(
+                    cost,
+                    {
+                        "queries": 0,
+                        "listdir": 1,
+                        "scandir": 0,
+                        "open": 1,
+                        "bytes_read": size + 4096,
+                    },
+                )
+
+
+class RequestProfilingTest(ContentedTestCase):
+    """
+    Staff users can profile a single request by adding `?profile=1` to its URL;
+    the profile is stored, and can be viewed and downloaded in the admin.
+    """
+
+    def setUp(self):
+        super().setUp()
+        user_model = get_user_model()
+        user_model.objects.create_user(
+            username="staffuser", password="not-a-password", is_staff=True
+        )
+        user_model.objects.create_superuser(
+            username="adminuser", password="not-a-password"
+        )
+        user_model.objects.create_user(username="testuser1", password="not-a-password")
+        self.use_settings(PROJECTS_DIR=Path("dummy_projects"), RESTRICTED_PROJECTS=[])
+        self.url = reverse("project", args=["my_test_project"])
+
+    def test_staff_users_can_profile_a_request(self):
+        """
+        GIVEN: a staff user
+        WHEN: the user adds `?profile=1` to a URL, or sends an `X-Profile`
+        header
+        THEN: the page is returned as usual, and a profile of the request is
+        stored, with its URL and timing
+        """
+        self.client.login(username="staffuser", password="not-a-password")
+        response = self.client.get(self.url, {"profile": "1"})
+        self.assertContains(response, "abc.csv")
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(
+            response["X-Profile"],
+            reverse("admin:contented_requestprofile_change", args=[profile.pk]),
+        )
+        self.assertEqual(
+            (profile.method, profile.url, profile.status_code, profile.username),
+            ("GET", f"{self.url}?profile=1", 200, "staffuser"),
+        )
+        self.assertGreater(profile.duration, 0)
+        stats = marshal.loads(bytes(profile.stats))
+        self.assertTrue(any(name == "project_page" for _, _, name in stats))
+
+        self.client.get(self.url, HTTP_X_PROFILE="1")
+        self.assertEqual(RequestProfile.objects.count(), 2)
+
+    def test_streamed_pages_are_profiled_as_they_are_sent(self):
+        """
+        GIVEN: a staff user, and project pages that are streamed
+        WHEN: the user profiles a project page
+        THEN: the page is still streamed (not read into memory first), and the
+        generation of the page is added to the profile as it is sent
+        """
+        self.use_settings(CONTENTED_STREAM_PROJECT_PAGES=True)
+        self.client.login(username="staffuser", password="not-a-password")
+        response = self.client.get(self.url, {"profile": "1"})
+        self.assertTrue(response.streaming)
+
+        def profiled_functions():
+            stats = marshal.loads(bytes(RequestProfile.objects.get().stats))
+            return {name for _, _, name in stats}
+
+        self.assertNotIn("stream_project_page", profiled_functions())
+        content = b"".join(response.streaming_content)
+        self.assertIn(b"abc.csv", content)
+        self.assertIn("stream_project_page", profiled_functions())
+
+    def test_other_requests_are_not_profiled(self):
+        """
+        WHEN: a user who is not staff asks for a profile, or a staff user does
+        not ask for one
+        THEN: no profiler is run
+        """
+        with mock.patch.object(cProfile, "Profile") as profiler:
+            self.client.login(username="testuser1", password="not-a-password")
+            self.client.get(self.url, {"profile": "1"})
+            self.client.login(username="staffuser", password="not-a-password")
+            self.client.get(self.url)
+
+        profiler.assert_not_called()
+        self.assertEqual(RequestProfile.objects.count(), 0)
+
+    def test_profiles_can_be_viewed_and_downloaded_in_the_admin(self):
+        """
+        GIVEN: a stored profile
+        WHEN: an administrator opens the profile in the admin
+        THEN: the slowest functions are listed, and the profile can be
+        downloaded as a .prof file
+        """
+        self.client.login(username="adminuser", password="not-a-password")
+        self.client.get(self.url, {"profile": "1"})
+        profile = RequestProfile.objects.get()
+
+        response = self.client.get(
+            reverse("admin:contented_requestprofile_change", args=[profile.pk])
+        )
+        self.assertContains(response, "cumulative")
+        self.assertContains(response, "project_page")
+
+        response = self.client.get(
+            reverse("admin:contented_requestprofile_download", args=[profile.pk])
+        )
+        self.assertEqual(
+            response["Content-Disposition"],
+            f'attachment; filename="profile-{profile.pk}.prof"',
+        )
+        self.assertEqual(response.content, bytes(profile.stats))
+
+
+class StorageTest(ContentedTestCase):
+    """
+    Filesystem calls on the project collection are made in a bounded thread
+    pool for each mount, so that a stalled mount gives fast, degraded
+    responses rather than hanging every worker.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.use_settings(
+            PROJECTS_DIR=Path("dummy_projects"),
+            RESTRICTED_PROJECTS=[],
+            STORAGE_TIMEOUT=0.05,
+            STORAGE_FAILURE_THRESHOLD=2,
+            STORAGE_RETRY_AFTER=30,
+        )
+
+        # A stalled call waits until the end of the test
+        self.unstall = threading.Event()
+        self.addCleanup(self.unstall.set)
+
+        executors = mock.patch.dict(storage._executors, pid=None)
+        executors.start()
+        self.addCleanup(executors.stop)
+        listings = mock.patch.dict(views._project_listings, clear=True)
+        listings.start()
+        self.addCleanup(listings.stop)
+
+    def stall(self, *args):
+        self.unstall.wait()
+
+    def test_calls_are_made_in_the_mount_executor(self):
+        """
+        WHEN: a filesystem call is made through the storage module
+        THEN: its result (or error) is passed back as usual
+        """
+        self.assertIn("my_test_project", storage.listdir(Path("dummy_projects")))
+        with self.assertRaises(FileNotFoundError):
+            storage.listdir(Path("dummy_projects/not-a-project"))
+        with storage.open_file(Path("dummy_projects/my_test_project/abc.csv")) as f:
+            self.assertEqual(
+                f.read(), Path("dummy_projects/my_test_project/abc.csv").read_bytes()
+            )
+
+    def test_text_files_are_read_in_blocks(self):
+        """
+        WHEN: a text file is downloaded
+        THEN: it is read in blocks, so that each call in the mount executor
+        stays small however large the file is
+        """
+        read = storage.GuardedFile.read
+        sizes = []
+
+        def recorded_read(guarded_file, size=-1):
+            sizes.append(size)
+            return read(guarded_file, size)
+
+        with mock.patch.object(views, "FILE_BLOCK_SIZE", 16), mock.patch.object(
+            storage.GuardedFile, "read", recorded_read
+        ):
+            response = self.client.get("/projects/my_test_project/abc.csv")
+            content = b"".join(response.streaming_content)
+
+        self.assertEqual(
+            content, Path("dummy_projects/my_test_project/abc.csv").read_bytes()
+        )
+        self.assertGreater(len(sizes), 1)
+        self.assertEqual(set(sizes), {16})
+
+    def test_breaker_opens_after_repeated_timeouts(self):
+        """
+        GIVEN: a mount that has stopped responding
+        WHEN: calls on the mount time out repeatedly
+        THEN: later calls fail straight away, until the mount has had time to
+        recover, when a single call is tried
+        """
+        executor = storage.MountExecutor("/stalled", threads=4, queue=0)
+        stalled = mock.Mock(side_effect=self.stall)
+        for _ in range(2):
+            with self.assertRaises(storage.StorageUnavailable):
+                executor.run(stalled)
+        self.assertEqual(stalled.call_count, 2)
+
+        with self.assertRaises(storage.StorageUnavailable) as raised:
+            executor.run(stalled)
+        self.assertEqual(stalled.call_count, 2)
+        self.assertGreater(raised.exception.retry_after, 25)
+
+        executor.open_until = 0
+        self.assertEqual(executor.run(lambda: "recovered"), "recovered")
+        self.assertEqual(executor.failures, 0)
+
+    def test_trial_rejected_because_slots_are_full_then_mount_recovers(self):
+        """
+        GIVEN: a mount whose breaker is ready to try a call, but whose threads
+        are all still held by a stalled call
+        WHEN: the trial call is turned away, and the stalled call then returns
+        THEN: the next call is tried, and closes the breaker
+        """
+        executor = storage.MountExecutor("/stalled", threads=1, queue=0)
+        with self.settings(STORAGE_FAILURE_THRESHOLD=1):
+            with self.assertRaises(storage.StorageUnavailable):
+                executor.run(self.stall)
+
+            executor.open_until = 0
+            with self.assertRaises(storage.StorageUnavailable) as raised:
+                executor.run(lambda: "trial")
+            self.assertIn("Too many calls", str(raised.exception))
+
+            self.unstall.set()
+            executor._pool.submit(lambda: None).result()
+            self.assertEqual(executor.run(lambda: "recovered"), "recovered")
+        self.assertEqual(executor.failures, 0)
+
+    def test_only_the_trial_call_ends_the_trial(self):
+        """
+        GIVEN: a call that started before the breaker opened, and a trial call
+        that is still running
+        WHEN: the earlier call ends during the trial
+        THEN: the breaker still lets no other call through until the trial
+        call ends
+        """
+        executor = storage.MountExecutor("/stalled", threads=4, queue=0)
+        started = {"earlier": threading.Event(), "trial": threading.Event()}
+
+        def stall(name):
+            started[name].set()
+            self.unstall.wait()
+
+        def run_in_thread(name, timeout):
+            def run():
+                try:
+                    executor.run(stall, name, timeout=timeout)
+                except storage.StorageUnavailable:
+                    pass
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            started[name].wait(timeout=5)
+            return thread
+
+        with self.settings(STORAGE_FAILURE_THRESHOLD=1):
+            earlier = run_in_thread("earlier", timeout=0.2)
+            executor.failures, executor.open_until = 1, 0
+            trial = run_in_thread("trial", timeout=5)
+
+            earlier.join()
+            executor.open_until = 0
+            with self.assertRaises(storage.StorageUnavailable) as raised:
+                executor.run(lambda: "second trial")
+            self.assertIn("not responding", str(raised.exception))
+
+            self.unstall.set()
+            trial.join()
+        self.assertEqual(executor.failures, 0)
+
+    def test_waiting_calls_are_bounded(self):
+        """
+        GIVEN: a mount whose threads are all stalled
+        WHEN: another call is made
+        THEN: it fails straight away, rather than waiting for a thread
+        """
+        executor = storage.MountExecutor("/stalled", threads=1, queue=0)
+        with self.settings(STORAGE_FAILURE_THRESHOLD=10):
+            with self.assertRaises(storage.StorageUnavailable):
+                executor.run(self.stall)
+
+            start = time.monotonic()
+            with self.assertRaises(storage.StorageUnavailable) as raised:
+                executor.run(self.stall, timeout=5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertIn("Too many calls", str(raised.exception))
+
+    def test_stalled_collection_gives_fast_degraded_responses(self):
+        """
+        GIVEN: the project collection has been listed once
+        WHEN: its storage stops responding
+        THEN: the home page is shown from the last listing, and pages that
+        need the files are answered with 503 and Retry-After
+        """
+        self.assertContains(self.client.get(reverse("home")), "my_test_project")
+
+        listdir, scandir = os.listdir, os.scandir
+
+        def stall_collection(path, *args):
+            if "dummy_projects" in str(path):
+                self.stall()
+            return listdir(path, *args)
+
+        def stall_project(path, *args):
+            if "dummy_projects" in str(path):
+                self.stall()
+            return scandir(path, *args)
+
+        with mock.patch("os.listdir", stall_collection), mock.patch(
+            "os.scandir", stall_project
+        ):
+            self.assertContains(self.client.get(reverse("home")), "my_test_project")
+            response = self.client.get(reverse("project", args=["my_test_project"]))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "30")
+
+
+class LocalCacheTest(ContentedTestCase):
+    """
+    Downloaded files are copied to local disk in the background, and served
+    from there while the original is unchanged.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.project_path = self.temp_dir / "projects" / "my_project"
+        self.project_path.mkdir(parents=True)
+        for name in ("a.pdf", "b.pdf", "c.pdf"):
+            (self.project_path / name).write_bytes(name.encode() * 25)
+
+        self.use_settings(
+            PROJECTS_DIR=self.temp_dir / "projects",
+            RESTRICTED_PROJECTS=[],
+            LOCAL_CACHE_DIR=str(self.temp_dir / "local"),
+            LOCAL_CACHE_MAX_BYTES=250,
+        )
+
+    def download(self, file_name):
+        response = self.client.get(reverse("results", args=["my_project", file_name]))
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_hot_files_are_served_from_local_disk(self):
+        """
+        WHEN: a file is downloaded for the first time
+        THEN: it is served from the collection, and a copy to local disk is
+        queued; once copied, the file is served without opening the original
+        """
+        self.assertEqual(self.download("a.pdf"), b"a.pdf" * 25)
+        self.assertEqual(Job.objects.get().kind, "local_cache")
+        jobs.run_pending_jobs()
+
+        with mock.patch.object(views.storage, "open_file") as open_file:
+            self.assertEqual(self.download("a.pdf"), b"a.pdf" * 25)
+        open_file.assert_not_called()
+
+    def test_changed_files_are_not_served_from_local_disk(self):
+        """
+        GIVEN: a file that has been copied to local disk
+        WHEN: the original file changes
+        THEN: the new contents are served, and a new copy is queued
+        """
+        self.download("a.pdf")
+        jobs.run_pending_jobs()
+
+        (self.project_path / "a.pdf").write_bytes(b"changed")
+        os.utime(self.project_path / "a.pdf", ns=(0, 0))
+        self.assertEqual(self.download("a.pdf"), b"changed")
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+
+    def test_least_recently_used_copies_are_evicted(self):
+        """
+        GIVEN: a cache with room for two of the files
+        WHEN: a third file is copied to local disk
+        THEN: the copy that was used least recently is removed
+        """
+        for name in ("a.pdf", "b.pdf"):
+            local_cache.copy_to_local_cache(self.project_path / name)
+        self.download("a.pdf")
+        local_cache.copy_to_local_cache(self.project_path / "c.pdf")
+
+        cached = {
+            name
+            for name in ("a.pdf", "b.pdf", "c.pdf")
+            if local_cache.get_local_path(self.project_path / name).exists()
+        }
+        self.assertEqual(cached, {"a.pdf", "c.pdf"})
+
+    def test_evicted_files_are_copied_again(self):
+        """
+        GIVEN: a file whose copy on local disk has been evicted
+        WHEN: the file is downloaded again
+        THEN: its finished copy job is put back on the queue, and once it has
+        run, the file is served from local disk again
+        """
+        self.download("a.pdf")
+        jobs.run_pending_jobs()
+        local_cache.evict_local_copies(max_bytes=0)
+
+        self.download("a.pdf")
+        self.assertEqual(Job.objects.get().status, Job.QUEUED)
+        jobs.run_pending_jobs()
+
+        with mock.patch.object(views.storage, "open_file") as open_file:
+            self.assertEqual(self.download("a.pdf"), b"a.pdf" * 25)
+        open_file.assert_not_called()
+
+
+class ArchiveProjectTest(ContentedTestCase):
+    """
+    Projects that are stored as a .zip or .tar archive are listed, and their
+    files served, without extracting the archive.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.projects_dir = self.temp_dir / "projects"
+        (self.projects_dir / "open_project").mkdir(parents=True)
+        (self.projects_dir / "open_project" / "notes.txt").write_text("notes")
+
+        self.report = bytes(range(256)) * 40
+        self.table = "gene,score\n" + "".join(f"G{i},{i}\n" for i in range(2000))
+        self.zip_path = self.projects_dir / "zipped_project.zip"
+        with zipfile.ZipFile(self.zip_path, "w") as zip_file:
+            zip_file.writestr("report.pdf", self.report, zipfile.ZIP_STORED)
+            zip_file.writestr("tables/scores.csv", self.table, zipfile.ZIP_DEFLATED)
+        with tarfile.open(self.projects_dir / "tarred_project.tar", "w") as tar:
+            tar.add(self.projects_dir / "open_project" / "notes.txt", "a/notes.txt")
+
+        self.use_settings(
+            PROJECTS_DIR=self.projects_dir,
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+            RESTRICTED_PROJECTS=[],
+        )
+
+    def get_member(self, project_id, file_name, **headers):
+        response = self.client.get(
+            reverse("results", args=[project_id, file_name]), **headers
+        )
+        return response, b"".join(response.streaming_content)
+
+    def test_archives_are_listed_as_projects(self):
+        """
+        WHEN: the user opens the home page, and the page for an archived
+        project
+        THEN: the archives are listed as projects, and their files as the
+        project's files
+        """
+        response = self.client.get(reverse("home"))
+        for project_id in ("open_project", "zipped_project", "tarred_project"):
+            self.assertContains(response, f"/projects/{project_id}")
+        self.assertNotContains(response, "zipped_project.zip")
+
+        response = self.client.get(reverse("project", args=["zipped_project"]))
+        self.assertEqual(
+            response.context["results_files"], ["report.pdf", "tables/scores.csv"]
+        )
+        response = self.client.get(reverse("project", args=["tarred_project"]))
+        self.assertEqual(response.context["results_files"], ["a/notes.txt"])
+
+    def test_project_in_a_directory_and_an_archive_is_listed_once(self):
+        """
+        GIVEN: a project that is stored both as a directory and as an archive
+        WHEN: the user opens the home page, and the project's page
+        THEN: the project is listed once, and its files are those of the
+        directory
+        """
+        with zipfile.ZipFile(self.projects_dir / "open_project.zip", "w") as zip_file:
+            zip_file.writestr("archived.txt", "archived")
+
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["project_ids"].count("open_project"), 1)
+        response = self.client.get(reverse("project", args=["open_project"]))
+        self.assertEqual(response.context["results_files"], ["notes.txt"])
+
+        collected = list(shared_index.collect_from_filesystem(self.projects_dir))
+        self.assertIn(("open_project", ["notes.txt"]), collected)
+        self.assertEqual([p for p, _ in collected].count("open_project"), 1)
+
+    def test_tar_members_are_listed_without_a_leading_dot(self):
+        """
+        GIVEN: a tar file whose members are named `./<path>`
+        WHEN: the user opens the project, and one of its files
+        THEN: the files are listed, and served, by their normalised paths
+        """
+        with tarfile.open(self.projects_dir / "dotted_project.tar", "w") as tar:
+            tar.add(self.projects_dir / "open_project" / "notes.txt", "./b/notes.txt")
+
+        response = self.client.get(reverse("project", args=["dotted_project"]))
+        self.assertEqual(response.context["results_files"], ["b/notes.txt"])
+        _, content = self.get_member("dotted_project", "b/notes.txt")
+        self.assertEqual(content, b"notes")
+
+    def test_compressed_members_are_inflated_in_bounded_chunks(self):
+        """
+        GIVEN: a deflated member that compresses extremely well
+        WHEN: the member is streamed
+        THEN: no chunk of it is larger than the read size, however much a
+        chunk of the compressed data inflates to
+        """
+        contents = b"0" * (4 * archives.READ_CHUNK_SIZE)
+        zip_path = self.projects_dir / "bomb_project.zip"
+        with zipfile.ZipFile(zip_path, "w") as zip_file:
+            zip_file.writestr("zeros.txt", contents, zipfile.ZIP_DEFLATED)
+        member = archives.get_members(zip_path)["zeros.txt"]
+        self.assertLess(member.compressed_size, archives.READ_CHUNK_SIZE)
+
+        chunks = list(archives.iter_member(zip_path, member))
+        self.assertEqual(b"".join(chunks), contents)
+        self.assertLessEqual(max(map(len, chunks)), archives.READ_CHUNK_SIZE)
+
+    def test_members_are_streamed_from_the_archive(self):
+        """
+        WHEN: the user opens files from archived projects
+        THEN: each file is streamed from the archive, and the member index is
+        only read from the archive once
+        """
+        response, content = self.get_member("zipped_project", "report.pdf")
+        self.assertEqual((response.status_code, content), (200, self.report))
+        self.assertEqual(response["Content-Type"], "application/pdf")
+
+        with mock.patch.object(archives, "read_zip_members") as read_zip_members:
+            _, content = self.get_member("zipped_project", "tables/scores.csv")
+        read_zip_members.assert_not_called()
+        self.assertEqual(content.decode("utf8"), self.table)
+
+        _, content = self.get_member("tarred_project", "a/notes.txt")
+        self.assertEqual(content, b"notes")
+
+        response = self.client.get(
+            reverse("results", args=["zipped_project", "missing.txt"])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_byte_ranges_of_members_can_be_requested(self):
+        """
+        WHEN: the user asks for a byte-range of a stored, or a compressed,
+        member
+        THEN: only that range is sent, as partial content
+        """
+        response, content = self.get_member(
+            "zipped_project", "report.pdf", HTTP_RANGE="bytes=1000-1099"
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.report[1000:1100])
+        self.assertEqual(
+            response["Content-Range"], f"bytes 1000-1099/{len(self.report)}"
+        )
+
+        response, content = self.get_member(
+            "zipped_project", "tables/scores.csv", HTTP_RANGE="bytes=-20"
+        )
+        self.assertEqual(content.decode("utf8"), self.table[-20:])
+
+        response = self.client.get(
+            reverse("results", args=["zipped_project", "report.pdf"]),
+            HTTP_RANGE=f"bytes={len(self.report)}-",
+        )
+        self.assertEqual(response.status_code, 416)
+
+    def test_member_index_is_rebuilt_when_archive_changes(self):
+        """
+        GIVEN: an archive whose member index has been cached
+        WHEN: the archive is replaced
+        THEN: the new members are listed
+        """
+        self.assertIn("report.pdf", archives.get_members(self.zip_path))
+        with zipfile.ZipFile(self.zip_path, "w") as zip_file:
+            zip_file.writestr("new.txt", "new")
+        os.utime(self.zip_path, ns=(0, 0))
+
+        self.assertEqual(list(archives.get_members(self.zip_path)), ["new.txt"])
+
+    @override_settings(CONTENTED_USE_INDEX=True)
+    def test_archives_are_listed_with_the_project_index(self):
+        """
+        GIVEN: the project index is in use (and does not hold archives)
+        WHEN: the user opens the page for an archived project
+        THEN: the members of the archive are listed
+        """
+        index.scan_collection()
+        response = self.client.get(reverse("project", args=["zipped_project"]))
+        self.assertEqual(
+            response.context["results_files"], ["report.pdf", "tables/scores.csv"]
+        )
+        response = self.client.get(reverse("project", args=["open_project"]))
+        self.assertEqual(response.context["results_files"], ["notes.txt"])
+
+    def test_archives_are_in_a_shared_index_built_from_the_project_index(self):
+        """
+        GIVEN: a shared index that is built from the project index
+        WHEN: the user opens the page for an archived project
+        THEN: the members of the archive are listed
+        """
+        index.scan_collection()
+        index_path = self.temp_dir / "shared.idx"
+        shared_index.build_shared_index(index_path, from_project_index=True)
+
+        with self.settings(CONTENTED_SHARED_INDEX=str(index_path)):
+            response = self.client.get(reverse("project", args=["tarred_project"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["results_files"], ["a/notes.txt"])
+
+
+class SitesTest(ContentedTestCase):
+    """
+    One deployment can serve several sites: each host name is served from its
+    own project collection, with its own restrictions and caches.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.default_dir = self.temp_dir / "default"
+        (self.default_dir / "default_project").mkdir(parents=True)
+        (self.default_dir / "default_project" / "results.txt").write_text("default")
+
+        self.client_dir = self.temp_dir / "client_a"
+        for project_id in ["client_project", "hidden_project"]:
+            (self.client_dir / project_id).mkdir(parents=True)
+            (self.client_dir / project_id / "results.txt").write_text(project_id)
+
+        self.use_settings(
+            PROJECTS_DIR=self.default_dir,
+            RESTRICTED_PROJECTS=[],
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+            CONTENTED_SITES={
+                "client-a.test": {
+                    "projects_dir": str(self.client_dir),
+                    "restricted_projects": ["hidden_project"],
+                }
+            },
+            ALLOWED_HOSTS=["testserver", "client-a.test"],
+        )
+
+        user = get_user_model().objects.create_user(
+            username="testuser1", password="not-a-password"
+        )
+        user.groups.add(Group.objects.create(name="client-a.test"))
+
+    def test_each_host_lists_its_own_projects(self):
+        """
+        GIVEN: a configured site, and the default site
+        WHEN: a user opens the home page of each site
+        THEN: each page lists the projects in that site's collection, less
+          the site's restricted projects
+        """
+        response = self.client.get("/")
+        self.assertEqual(response.context["project_ids"], ["default_project"])
+
+        response = self.client.get("/", HTTP_HOST="client-a.test")
+        self.assertEqual(response.context["project_ids"], ["client_project"])
+
+        self.client.login(username="testuser1", password="not-a-password")
+        response = self.client.get("/", HTTP_HOST="client-a.test:8000")
+        self.assertEqual(
+            sorted(response.context["project_ids"]),
+            ["client_project", "hidden_project"],
+        )
+
+    def test_files_are_served_from_the_site_collection(self):
+        """
+        GIVEN: a configured site
+        WHEN: a user requests a file from a project of that site, on that
+          site and on the default site
+        THEN: the file is served by the site, and the default site redirects
+          to the login page
+        """
+        url = "/projects/client_project/results.txt"
+        response = self.client.get(url, HTTP_HOST="client-a.test")
+        self.assertContains(response, "client_project")
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_users_of_another_site_cannot_see_restricted_projects(self):
+        """
+        GIVEN: a user who is a member of another site, and can upload files
+        WHEN: they log in on a configured site
+        THEN: the site's restricted project is not listed, its pages, files,
+          download links and uploads are refused, and it is not searchable
+        """
+        user = get_user_model().objects.create_user(
+            username="client_b_user", password="not-a-password"
+        )
+        user.groups.add(Group.objects.create(name="client-b.test"))
+        user.user_permissions.add(Permission.objects.get(codename="add_upload"))
+        self.client.login(username="client_b_user", password="not-a-password")
+
+        response = self.client.get("/", HTTP_HOST="client-a.test")
+        self.assertEqual(response.context["project_ids"], ["client_project"])
+
+        for url in [
+            "/projects/hidden_project",
+            "/projects/hidden_project/results.txt",
+            "/sign/hidden_project",
+            "/manifest/hidden_project",
+        ]:
+            response = self.client.get(url, HTTP_HOST="client-a.test")
+            self.assertEqual(response.status_code, 302, url)
+
+        response = self.client.post(
+            "/uploads/client_project/new.txt",
+            {"size": 1, "sha256": "0" * 64},
+            HTTP_HOST="client-a.test",
+        )
+        self.assertEqual(response.status_code, 403)
+
+        call_command("build_search_index", stdout=io.StringIO())
+        response = self.client.get("/search/?q=results", HTTP_HOST="client-a.test")
+        self.assertEqual(
+            response.context["results"], [("client_project", "results.txt")]
+        )
+
+    def test_members_of_the_site_can_see_restricted_projects(self):
+        """
+        GIVEN: a member of a configured site
+        WHEN: they open the site's restricted project
+        THEN: its files are listed
+        """
+        self.client.login(username="testuser1", password="not-a-password")
+        response = self.client.get(
+            "/projects/hidden_project", HTTP_HOST="client-a.test"
+        )
+        self.assertEqual(response.context["results_files"], ["results.txt"])
+
+    def test_membership_is_looked_up_once_per_request(self):
+        """
+        GIVEN: a member of a configured site
+        WHEN: they download a file from the site's restricted project
+        THEN: their groups are queried once, however many times the
+          restrictions are checked
+        """
+        self.client.login(username="testuser1", password="not-a-password")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/projects/hidden_project/results.txt", HTTP_HOST="client-a.test"
+            )
+        self.assertEqual(response.status_code, 200)
+        group_queries = [q for q in queries if "auth_group" in q["sql"]]
+        self.assertEqual(len(group_queries), 1)
+
+    def test_file_responses_are_left_to_the_server(self):
+        """
+        WHEN: a file is downloaded from a configured site
+        THEN: the file response is not wrapped, so the server can still send
+          the file itself (with `wsgi.file_wrapper`)
+        """
+        file_path = self.client_dir / "client_project" / "results.txt"
+        middleware = sites.SiteMiddleware(
+            lambda request: FileResponse(open(file_path, "rb"))
+        )
+        request = RequestFactory().get("/", HTTP_HOST="client-a.test")
+        response = middleware(request)
+
+        self.assertEqual(request.site.name, "client-a.test")
+        self.assertIsNotNone(response.file_to_stream)
+        self.assertEqual(b"".join(response.streaming_content), b"client_project")
+        response.close()
+
+    @override_settings(CONTENTED_STREAM_PROJECT_PAGES=True)
+    def test_streamed_pages_are_made_in_the_site(self):
+        """
+        GIVEN: streamed project pages
+        WHEN: a user opens a project page on a configured site
+        THEN: the files are listed from the site's collection while the page
+          is streamed (after the view has returned)
+        """
+        response = self.client.get(
+            "/projects/client_project", HTTP_HOST="client-a.test"
+        )
+        self.assertTrue(response.streaming)
+        page = b"".join(response.streaming_content).decode("utf8")
+        self.assertIn("results.txt", page)
+
+    def test_signed_urls_only_work_on_their_site(self):
+        """
+        GIVEN: a signed URL, issued by a configured site, for a file that has
+          the same path in the default site
+        WHEN: the URL is requested from each site
+        THEN: it only works on the site that issued it
+        """
+        (self.default_dir / "client_project").mkdir()
+        (self.default_dir / "client_project" / "results.txt").write_text("default")
+
+        self.client.login(username="testuser1", password="not-a-password")
+        response = self.client.get(
+            "/sign/client_project/results.txt", HTTP_HOST="client-a.test"
+        )
+        signed_url = response.content.decode("utf8").strip()
+        self.client.logout()
+
+        response = self.client.get(signed_url, HTTP_HOST="client-a.test")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(signed_url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_caches_and_index_are_kept_per_site(self):
+        """
+        GIVEN: a configured site
+        WHEN: its collection is indexed with `contented_index --site`, and the
+          cache path of one of its tables is found
+        THEN: the index entries are recorded for the site's collection, and
+          the table is cached in the site's cache directory
+        """
+        call_command("contented_index", site="client-a.test", stdout=io.StringIO())
+
+        self.assertEqual(
+            set(ProjectFile.objects.values_list("collection", flat=True).distinct()),
+            {index.get_collection_key(self.client_dir)},
+        )
+        cache_path = tables.get_table_cache_path(
+            self.client_dir / "client_project" / "table.csv"
+        )
+        self.assertTrue(
+            str(cache_path).startswith(str(self.temp_dir / "cache" / "client-a.test"))
+        )
+
+    def test_downloads_are_logged_with_their_site(self):
+        """
+        GIVEN: a configured site
+        WHEN: a file is downloaded from that site
+        THEN: the access event records the site
+        """
+        access_log.flush()
+        self.client.get(
+            "/projects/client_project/results.txt", HTTP_HOST="client-a.test"
+        )
+        access_log.flush()
+        event = AccessEvent.objects.get()
+        self.assertEqual(
+            (event.site, event.project_id), ("client-a.test", "client_project")
+        )
+
+
+class RestrictionRulesTest(ContentedTestCase):
+    """
+    Projects, folders and files can be restricted using glob or regex rules,
+    with exceptions; restricted paths can only be seen by logged-in users.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        for project_id in ["client-a", "client-demo", "public"]:
+            (self.temp_dir / project_id / "raw_data").mkdir(parents=True)
+            (self.temp_dir / project_id / "report.txt").write_text("report")
+            (self.temp_dir / project_id / "raw_data" / "reads.txt").write_text("reads")
+
+        self.use_settings(
+            PROJECTS_DIR=self.temp_dir,
+            RESTRICTED_PROJECTS=["client-*", "!client-demo", "*/raw_data/"],
+        )
+
+        get_user_model().objects.create_user(
+            username="testuser1", password="not-a-password"
+        )
+
+    def test_rules_match_projects_folders_and_files(self):
+        """
+        GIVEN: a list of glob and regex rules, with an exception
+        WHEN: paths are checked against the compiled rules
+        THEN: a path is restricted if the last rule that matches it (or a
+        folder that contains it) restricts it
+        """
+        rules = restrictions.RestrictionRules(
+            ["client-*", "!client-demo", "*/raw_data/", r"re:lab_\d+", "**/*.bam"]
+        )
+        restricted = [
+            "client-a",
+            "client-a/report.txt",
+            "public/raw_data",
+            "public/raw_data/sub/reads.txt",
+            "client-demo/raw_data/reads.txt",
+            "lab_12/report.txt",
+            "public/deep/folder/aligned.bam",
+        ]
+        allowed = [
+            "client-demo",
+            "client-demo/report.txt",
+            "public/report.txt",
+            "public/raw_data_summary.txt",
+            "lab_x",
+            "client",
+        ]
+        for path in restricted:
+            self.assertTrue(rules.is_restricted(path), path)
+        for path in allowed:
+            self.assertFalse(rules.is_restricted(path), path)
+
+        self.assertFalse(restrictions.RestrictionRules([]).is_restricted("any"))
+
+    def test_restricted_projects_are_hidden_from_unlogged_users(self):
+        """
+        GIVEN: a user who is not logged in
+        WHEN: the user opens the home page
+        THEN: only the projects that no rule restricts are listed
+        """
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["project_ids"], ["client-demo", "public"])
+
+    def test_restricted_files_are_hidden_from_unlogged_users(self):
+        """
+        GIVEN: a public project with a restricted folder
+        WHEN: a user who is not logged in opens the project page, and a file
+        in the restricted folder
+        THEN: the folder's files are not listed, and the file redirects to the
+        login page
+        """
+        response = self.client.get(reverse("project", args=["public"]))
+        self.assertEqual(response.context["results_files"], ["report.txt"])
+
+        response = self.client.get(
+            reverse("results", args=["public", "raw_data/reads.txt"])
+        )
+        self.assertRedirects(
+            response, settings.LOGIN_URL, fetch_redirect_response=False
+        )
+
+    def test_logged_in_users_can_see_restricted_files(self):
+        """
+        GIVEN: a logged-in user
+        WHEN: the user opens a project page, and a file in a restricted folder
+        THEN: every file is listed, and the file is served
+        """
+        self.client.login(username="testuser1", password="not-a-password")
+        response = self.client.get(reverse("project", args=["public"]))
+        self.assertEqual(
+            sorted(response.context["results_files"]),
+            ["raw_data/reads.txt", "report.txt"],
+        )
+
+        response = self.client.get(
+            reverse("results", args=["public", "raw_data/reads.txt"])
+        )
+        self.assertContains(response, "reads")
+
+    def test_unlogged_users_cannot_sign_folders_with_restricted_files(self):
+        """
+        GIVEN: a user who is not logged in
+        WHEN: the user asks for signed URLs for a public file, and for a public
+        project that contains a restricted folder
+        THEN: the file can be signed, and the project cannot
+        """
+        response = self.client.get(reverse("sign", args=["public", "report.txt"]))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse("sign", args=["public"]))
+        self.assertRedirects(
+            response, settings.LOGIN_URL, fetch_redirect_response=False
+        )
+
+
+class TailTest(ContentedTestCase):
+    """
+    The end of a large or growing text file can be shown, and followed as
+    lines are added to it, without reading the whole file.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.log_path = self.temp_dir / "my_project" / "pipeline.log"
+        self.log_path.parent.mkdir()
+        self.log_path.write_text("".join(f"line {i}\n" for i in range(1000)))
+        (self.temp_dir / "secret").mkdir()
+        (self.temp_dir / "secret" / "pipeline.log").write_text("hidden\n")
+
+        self.use_settings(PROJECTS_DIR=self.temp_dir, RESTRICTED_PROJECTS=["secret"])
+
+    def test_read_tail_reads_backwards_from_the_end(self):
+        """
+        GIVEN: a file of 1000 lines, the last of which is incomplete
+        WHEN: its last 3 lines are read, in small blocks
+        THEN: the lines (including the incomplete one) are returned with the
+        size of the file, and only the end of the file is read
+        """
+        with self.log_path.open("a") as log_file:
+            log_file.write("partial")
+
+        reads = []
+        original_read = storage.GuardedFile.read
+
+        def counting_read(guarded_file, size=-1):
+            data = original_read(guarded_file, size)
+            reads.append(len(data))
+            return data
+
+        with mock.patch.object(storage.GuardedFile, "read", counting_read):
+            text, offset = tail.read_tail(self.log_path, 3, block_size=32)
+
+        self.assertEqual(text, b"line 998\nline 999\npartial")
+        self.assertEqual(offset, self.log_path.stat().st_size)
+        self.assertLess(sum(reads), 100)
+
+        text, _ = tail.read_tail(self.log_path, 5000, block_size=32)
+        self.assertEqual(text, self.log_path.read_bytes())
+
+    def test_read_tail_reads_at_most_max_bytes(self):
+        """
+        GIVEN: a file whose last lines are very long
+        WHEN: its last 2 lines are read, with a budget of fewer bytes than the
+        lines hold
+        THEN: only the last bytes of the file are read, so the first line is
+        cut short
+        """
+        self.log_path.write_bytes(b"a" * 5000 + b"\n" + b"b" * 100 + b"\n")
+
+        text, _ = tail.read_tail(self.log_path, 2, block_size=64, max_bytes=1000)
+        self.assertEqual(text, b"a" * 898 + b"\n" + b"b" * 100 + b"\n")
+
+    def test_text_files_have_a_tail_link(self):
+        """
+        GIVEN: a project with a log file, a text file and a table
+        WHEN: the user opens the project page
+        THEN: the log and text files have a tail link, and the table does not
+        """
+        (self.log_path.parent / "notes.txt").write_text("notes\n")
+        (self.log_path.parent / "table.csv").write_text("a,b\n")
+
+        response = self.client.get(reverse("project", args=["my_project"]))
+        self.assertContains(response, 'href="/tail/my_project/pipeline.log"')
+        self.assertContains(response, 'href="/tail/my_project/notes.txt"')
+        self.assertNotContains(response, 'href="/tail/my_project/table.csv"')
+
+    def test_tail_page_shows_the_last_lines(self):
+        """
+        GIVEN: a log file in a project
+        WHEN: a user opens its tail page, asking for 2 lines
+        THEN: the last 2 lines are shown, with the offset to follow the file
+        from
+        """
+        response = self.client.get(
+            reverse("tail", args=["my_project", "pipeline.log"]), {"lines": 2}
+        )
+        self.assertEqual(response.context["text"], "line 998\nline 999\n")
+        self.assertEqual(response.context["offset"], self.log_path.stat().st_size)
+
+        response = self.client.get(
+            reverse("tail", args=["my_project", "pipeline.log"]), {"lines": "x"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_follow_streams_appended_lines(self):
+        """
+        GIVEN: the offset of the end of a log file
+        WHEN: lines are appended to the file, and the file is followed from
+        that offset
+        THEN: the complete new lines are sent as events, with the offset
+        after them as the event id
+        """
+        offset = self.log_path.stat().st_size
+        with self.log_path.open("a") as log_file:
+            log_file.write("line 1000\nline 10")
+
+        with mock.patch.object(views, "EVENT_STREAM_SECONDS", 0):
+            response = self.client.get(
+                reverse("follow", args=["my_project", "pipeline.log"]),
+                HTTP_LAST_EVENT_ID=str(offset),
+            )
+            content = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        data = json.dumps("line 1000\n")
+        self.assertIn(f"id: {offset + 10}\nevent: append\ndata: {data}\n", content)
+        self.assertNotIn('line 10"', content)
+
+    def test_follow_restarts_after_truncation(self):
+        """
+        GIVEN: a log file that is followed from its end
+        WHEN: the file is truncated and written again
+        THEN: a reset is yielded, and the file is followed from its start
+        """
+        offset = self.log_path.stat().st_size
+        self.log_path.write_text("new line\n")
+
+        pieces = list(tail.iter_appended(self.log_path, offset, 0, 0))
+        self.assertEqual(pieces, [(0, None), (9, b"new line\n")])
+
+    def test_restricted_files_cannot_be_tailed(self):
+        """
+        GIVEN: a user who is not logged in
+        WHEN: the user asks to tail or follow a file in a restricted project
+        THEN: they are redirected to the login page
+        """
+        for name in ["tail", "follow"]:
+            response = self.client.get(reverse(name, args=["secret", "pipeline.log"]))
+            self.assertRedirects(
+                response, settings.LOGIN_URL, fetch_redirect_response=False
+            )
+
+    def test_paths_out_of_the_project_are_not_found(self):
+        """
+        GIVEN: a table in a restricted project
+        WHEN: it is asked for, by a relative or an absolute path, through an
+        open project, from any of the views that read single files
+        THEN: it is not found
+        """
+        table_path = self.temp_dir / "secret" / "data.csv"
+        table_path.write_text("a,b\n1,2\n")
+
+        for name in ["tail", "follow", "table", "signature"]:
+            for file_name in ["../secret/data.csv", str(table_path), ".."]:
+                with self.subTest(name=name, file_name=file_name):
+                    response = self.client.get(
+                        reverse(name, args=["my_project", file_name])
+                    )
+                    self.assertEqual(response.status_code, 404)
+
+
+class UploadTest(ContentedTestCase):
+    """
+    Users with the "add upload" permission can upload files into a project,
+    in resumable chunks that are written straight to disk, and that are only
+    moved into the project once the whole file has arrived and its checksum
+    is correct.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.temp_dir / "projects" / "my_project").mkdir(parents=True)
+
+        self.use_settings(
+            PROJECTS_DIR=self.temp_dir / "projects",
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+        )
+
+        self.contents = b"".join(b"row %d\n" % i for i in range(10000))
+        self.sha256 = hashlib.sha256(self.contents).hexdigest()
+
+        user = get_user_model().objects.create_user(
+            username="uploader", password="not-a-password"
+        )
+        user.user_permissions.add(Permission.objects.get(codename="add_upload"))
+        get_user_model().objects.create_user(
+            username="testuser1", password="not-a-password"
+        )
+        self.client.login(username="uploader", password="not-a-password")
+
+    def start_upload(
+        self, file_name="results/table.tsv", sha256=None, project_id="my_project"
+    ):
+        return self.client.post(
+            reverse("upload_start", args=[project_id, file_name]),
+            {"size": len(self.contents), "sha256": sha256 or self.sha256},
+        )
+
+    def send_chunk(self, url, offset, data):
+        return self.client.post(
+            url,
+            {"chunk": SimpleUploadedFile("chunk", data)},
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_upload_is_resumed_and_committed(self):
+        """
+        GIVEN: an upload that has been started
+        WHEN: the file is sent in two chunks, with a chunk sent from the wrong
+        offset in between
+        THEN: the wrong chunk is rejected with the offset to resume from, and
+        the file only appears in the project once it is complete
+        """
+        response = self.start_upload()
+        self.assertEqual(response.status_code, 201)
+        url = response.json()["url"]
+        destination = self.temp_dir / "projects" / "my_project" / "results/table.tsv"
+
+        response = self.send_chunk(url, 0, self.contents[:30000])
+        self.assertEqual(response.json()["offset"], 30000)
+        self.assertFalse(destination.exists())
+
+        response = self.send_chunk(url, 0, self.contents[:30000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(url).json()["offset"], 30000)
+
+        response = self.send_chunk(url, 30000, self.contents[30000:])
+        self.assertTrue(response.json()["complete"])
+        self.assertEqual(destination.read_bytes(), self.contents)
+        self.assertEqual(list((self.temp_dir / "cache" / "uploads").iterdir()), [])
+
+    def test_chunks_are_written_to_the_staging_file(self):
+        """
+        GIVEN: an upload that has been started
+        WHEN: a chunk is sent
+        THEN: it is written to the staging file by the upload handler, and is
+        not kept in memory or in a temporary file
+        """
+        url = self.start_upload().json()["url"]
+
+        with mock.patch(
+            "django.core.files.uploadhandler.MemoryFileUploadHandler.receive_data_chunk"
+        ) as memory_handler, mock.patch(
+            "django.core.files.uploadhandler.TemporaryFileUploadHandler.receive_data_chunk"
+        ) as temporary_handler:
+            self.send_chunk(url, 0, self.contents[:1000])
+
+        memory_handler.assert_not_called()
+        temporary_handler.assert_not_called()
+        (staging_path,) = (self.temp_dir / "cache" / "uploads").iterdir()
+        self.assertEqual(staging_path.read_bytes(), self.contents[:1000])
+
+    def test_upload_with_wrong_checksum_is_discarded(self):
+        """
+        GIVEN: an upload whose checksum does not match its contents
+        WHEN: the whole file is sent
+        THEN: the upload is rejected, and nothing is added to the project
+        """
+        url = self.start_upload(sha256="0" * 64).json()["url"]
+
+        response = self.send_chunk(url, 0, self.contents)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(os.listdir(self.temp_dir / "projects" / "my_project"), [])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_invalid_uploads_are_rejected(self):
+        """
+        GIVEN: a user with the permission to upload, and one without it
+        WHEN: they upload a file outside the project, a chunk that runs past
+        the size of the upload, and a file without the permission
+        THEN: each is rejected
+        """
+        self.assertEqual(self.start_upload("../other/table.tsv").status_code, 400)
+
+        url = self.start_upload().json()["url"]
+        response = self.send_chunk(url, 0, self.contents + b"extra")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).json()["offset"], 0)
+
+        self.client.login(username="testuser1", password="not-a-password")
+        self.assertEqual(self.start_upload().status_code, 403)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_uploads_into_hidden_or_linked_projects_are_rejected(self):
+        """
+        GIVEN: a hidden directory, and a project that is a symlink to a
+        directory outside the collection
+        WHEN: a file is uploaded into each
+        THEN: both uploads are rejected
+        """
+        projects_dir = self.temp_dir / "projects"
+        (projects_dir / ".snapshots" / "my_project").mkdir(parents=True)
+        (self.temp_dir / "elsewhere").mkdir()
+        (projects_dir / "linked_project").symlink_to(self.temp_dir / "elsewhere")
+
+        for project_id in [".snapshots", "linked_project"]:
+            response = self.start_upload(project_id=project_id)
+            self.assertEqual(response.status_code, 400, project_id)
+        self.assertEqual(os.listdir(self.temp_dir / "elsewhere"), [])
+
+    def test_uploads_through_linked_folders_or_over_folders_are_rejected(self):
+        """
+        GIVEN: a folder in a project that is a symlink to a directory outside
+        the collection, and another folder in the project
+        WHEN: a file is uploaded into the linked folder, over the other folder,
+        or into a folder that becomes a link during the upload
+        THEN: each upload is rejected, and nothing is written outside the
+        project
+        """
+        project_path = self.temp_dir / "projects" / "my_project"
+        (self.temp_dir / "elsewhere").mkdir()
+        (project_path / "linked").symlink_to(self.temp_dir / "elsewhere")
+        (project_path / "results").mkdir()
+
+        for file_name in ["linked/table.tsv", "linked/sub/table.tsv", "results"]:
+            response = self.start_upload(file_name)
+            self.assertEqual(response.status_code, 400, file_name)
+
+        url = self.start_upload("later/table.tsv").json()["url"]
+        (project_path / "later").symlink_to(self.temp_dir / "elsewhere")
+        response = self.send_chunk(url, 0, self.contents)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(os.listdir(self.temp_dir / "elsewhere"), [])
+
+    def test_upload_is_not_read_again_when_it_is_committed(self):
+        """
+        GIVEN: an upload whose chunks are received by one process
+        WHEN: the last chunk is received
+        THEN: the checksum is computed as the chunks arrive, so the staged file
+        is not read again; if another process received the earlier chunks, the
+        staged file is read instead
+        """
+        with mock.patch.object(uploads, "hash_staged_file") as hash_staged_file:
+            url = self.start_upload().json()["url"]
+            self.send_chunk(url, 0, self.contents[:30000])
+            response = self.send_chunk(url, 30000, self.contents[30000:])
+        self.assertTrue(response.json()["complete"])
+        hash_staged_file.assert_not_called()
+
+        url = self.start_upload("other.tsv").json()["url"]
+        self.send_chunk(url, 0, self.contents[:30000])
+        uploads._running_hashes.clear()
+        with mock.patch.object(
+            uploads, "hash_staged_file", wraps=uploads.hash_staged_file
+        ) as hash_staged_file:
+            response = self.send_chunk(url, 30000, self.contents[30000:])
+        self.assertTrue(response.json()["complete"])
+        hash_staged_file.assert_called_once()
+
+    def test_uploads_into_snapshots_publish_a_new_snapshot(self):
+        """
+        GIVEN: a project that is published as snapshots
+        WHEN: a file that is already in the project is uploaded
+        THEN: a new snapshot holds the uploaded file (and the other files),
+        and the earlier snapshot is unchanged
+        """
+        staged_dir = self.temp_dir / "staged"
+        (staged_dir / "results").mkdir(parents=True)
+        (staged_dir / "results" / "table.tsv").write_text("first")
+        (staged_dir / "other.txt").write_text("other")
+        snapshots.publish_snapshot(
+            "snapshot_project", staged_dir, version="20240501T120000"
+        )
+
+        url = self.start_upload(project_id="snapshot_project").json()["url"]
+        self.assertTrue(self.send_chunk(url, 0, self.contents).json()["complete"])
+
+        version = snapshots.get_latest_version("snapshot_project")
+        self.assertEqual(
+            snapshots.list_versions("snapshot_project"), ["20240501T120000", version]
+        )
+        latest_path = snapshots.get_snapshot_path("snapshot_project", version)
+        self.assertEqual(
+            (latest_path / "results" / "table.tsv").read_bytes(), self.contents
+        )
+        self.assertEqual((latest_path / "other.txt").read_text(), "other")
+        first_path = snapshots.get_snapshot_path("snapshot_project", "20240501T120000")
+        self.assertEqual((first_path / "results" / "table.tsv").read_text(), "first")
+
+
+class SnapshotTest(ContentedTestCase):
+    """
+    Projects can be published as immutable snapshots; files in a snapshot are
+    served from versioned URLs that can be cached indefinitely.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.temp_dir / "projects").mkdir()
+
+        self.use_settings(
+            PROJECTS_DIR=self.temp_dir / "projects", RESTRICTED_PROJECTS=[]
+        )
+
+    def publish(self, version, text):
+        source_dir = self.temp_dir / f"staged-{version}"
+        source_dir.mkdir()
+        (source_dir / "report.txt").write_text(text)
+        call_command(
+            "contented_snapshot",
+            "my_project",
+            str(source_dir),
+            name=version,
+            stdout=io.StringIO(),
+        )
+
+    def test_publishing_replaces_the_latest_snapshot(self):
+        """
+        GIVEN: a project with one published snapshot
+        WHEN: a second snapshot is published
+        THEN: the project points to the second snapshot, the first is kept,
+        and the snapshots directory is not listed as a project
+        """
+        self.publish("v1", "first")
+        self.publish("v2", "second")
+
+        self.assertEqual(snapshots.get_latest_version("my_project"), "v2")
+        self.assertEqual(snapshots.list_versions("my_project"), ["v1", "v2"])
+        self.assertEqual(
+            (self.temp_dir / "projects" / "my_project" / "report.txt").read_text(),
+            "second",
+        )
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["project_ids"], ["my_project"])
+
+    def test_unversioned_url_redirects_to_the_latest_snapshot(self):
+        """
+        GIVEN: a project that is published as snapshots
+        WHEN: a file is requested from its unversioned URL
+        THEN: the user is redirected to the file in the latest snapshot
+        """
+        self.publish("v1", "first")
+        self.publish("v2", "second")
+
+        response = self.client.get(
+            reverse("results", args=["my_project", "report.txt"])
+        )
+        self.assertRedirects(
+            response,
+            reverse("snapshot", args=["my_project", "v2", "report.txt"]),
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+    def test_snapshot_files_are_immutable(self):
+        """
+        GIVEN: a file in an older snapshot of a project
+        WHEN: it is requested, and requested again with its ETag
+        THEN: it is served with an immutable Cache-Control header and an ETag,
+        and the second request gets `304 Not Modified`
+        """
+        self.publish("v1", "first")
+        self.publish("v2", "second")
+        url = reverse("snapshot", args=["my_project", "v1", "report.txt"])
+
+        response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), b"first")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("public", response["Cache-Control"])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            reverse("snapshot", args=["my_project", "v3", "report.txt"])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_snapshots_are_indexed_under_their_project(self):
+        """
+        GIVEN: a project that is published as snapshots, and an index that
+        has listed the snapshots directory as a project
+        WHEN: the collection is indexed
+        THEN: the files are indexed under the project, and the snapshots
+        directory is removed from the index
+        """
+        self.publish("v1", "first")
+        collection = index.get_collection_key()
+        ProjectFile.objects.create(
+            collection=collection,
+            project_id=".snapshots",
+            path="my_project/v1/report.txt",
+            size=5,
+            mtime_ns=0,
+            generation=0,
+        )
+        ProjectSummary.objects.create(
+            collection=collection,
+            project_id=".snapshots",
+            file_count=1,
+            type_counts={"txt": 1},
+        )
+
+        index.scan_collection()
+        self.assertEqual(index.get_indexed_files("my_project"), ["report.txt"])
+        self.assertEqual(index.get_indexed_files(".snapshots"), [])
+        self.assertEqual(index.get_summaries()[".snapshots"].file_count, 0)
+        response = self.client.get(reverse("home"), {"sort": "updated"})
+        self.assertEqual(response.context["project_ids"], ["my_project"])
+
+    def test_paths_out_of_the_snapshot_are_not_found(self):
+        """
+        GIVEN: a project that is published as snapshots, and a file outside it
+        WHEN: the file is asked for from a snapshot, by a relative or an
+        absolute path
+        THEN: it is not found
+        """
+        self.publish("v1", "first")
+        secret_path = self.temp_dir / "secret.txt"
+        secret_path.write_text("hidden")
+
+        for file_name in ["../../../../secret.txt", str(secret_path), ".."]:
+            with self.subTest(file_name):
+                response = self.client.get(
+                    reverse("snapshot", args=["my_project", "v1", file_name])
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_watcher_maps_the_latest_snapshot_to_its_project(self):
+        """
+        GIVEN: a project that is published as snapshots
+        WHEN: the watcher sees changes to files in the latest snapshot, and
+        in an older one
+        THEN: the change to the latest snapshot is recorded in the project,
+        and the other change is ignored
+        """
+        self.publish("v1", "first")
+        self.publish("v2", "second")
+        projects_dir = (self.temp_dir / "projects").resolve()
+        snapshots_dir = projects_dir / ".snapshots" / "my_project"
+
+        events = watcher.apply_changes(
+            projects_dir,
+            {snapshots_dir / "v1" / "report.txt", snapshots_dir / "v2" / "report.txt"},
+        )
+        self.assertEqual(
+            [(event.project_id, event.path) for event in events],
+            [("my_project", "report.txt")],
+        )
+        self.assertEqual(
+            watcher.split_collection_path(projects_dir, projects_dir / ".snapshots"),
+            (None, None),
+        )
+
+
+class SearchTest(ContentedTestCase):
+    """
+    Files can be found by (part of) their name or path, across every project
+    that the user can access, using a trigram index.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.projects_dir = self.temp_dir / "projects"
+
+        for project_id, path in [
+            ("my_project", "plots/volcano_plot_march.png"),
+            ("my_project", "tables/degs.csv"),
+            ("other_project", "Volcano_Plot.pdf"),
+            ("client-x", "plots/volcano_plot.png"),
+        ]:
+            file_path = self.projects_dir / project_id / path
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_text("data")
+
+        self.use_settings(
+            PROJECTS_DIR=self.projects_dir,
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+            RESTRICTED_PROJECTS=["client-*"],
+        )
+
+        get_user_model().objects.create_user(
+            username="testuser1", password="not-a-password"
+        )
+        call_command("build_search_index", stdout=io.StringIO())
+
+    def test_search_finds_substrings_across_projects(self):
+        """
+        GIVEN: files with "volcano" in their names, in several projects
+        WHEN: a user who is not logged in, and one who is, search for
+        "volcano plot"
+        THEN: the files are found in every project that each user can access
+        """
+        response = self.client.get(reverse("search"), {"q": "volcano plot"})
+        self.assertEqual(
+            sorted(response.context["results"]),
+            [
+                ("my_project", "plots/volcano_plot_march.png"),
+                ("other_project", "Volcano_Plot.pdf"),
+            ],
+        )
+        self.assertFalse(response.context["fuzzy"])
+
+        self.client.login(username="testuser1", password="not-a-password")
+        response = self.client.get(reverse("search"), {"q": "volcano plot"})
+        self.assertIn(
+            ("client-x", "plots/volcano_plot.png"), response.context["results"]
+        )
+
+    def test_search_falls_back_to_similar_paths(self):
+        """
+        GIVEN: a search with a typo, which no path contains
+        WHEN: the user searches
+        THEN: files with similar paths are listed, marked as a fuzzy match
+        """
+        response = self.client.get(reverse("search"), {"q": "volcnao_plot"})
+        self.assertTrue(response.context["fuzzy"])
+        self.assertIn(
+            ("my_project", "plots/volcano_plot_march.png"),
+            response.context["results"],
+        )
+
+        response = self.client.get(reverse("search"), {"q": "pl"})
+        self.assertTrue(response.context["error"])
+
+    def test_search_index_is_updated_incrementally(self):
+        """
+        GIVEN: a search index that has been built, and an up-to-date project
+        index
+        WHEN: a file is added, and another removed, and the changes are
+        recorded in the project index
+        THEN: the search index reflects the changes, without being rebuilt
+        """
+        index.scan_project("my_project")
+        (self.projects_dir / "my_project" / "new_heatmap.png").write_text("data")
+        (self.projects_dir / "my_project" / "tables" / "degs.csv").unlink()
+        index.scan_project("my_project")
+
+        results, _ = search.search("heatmap", restrictions.RestrictionRules([]))
+        self.assertEqual(results, [("my_project", "new_heatmap.png")])
+        results, _ = search.search(
+            "degs", restrictions.RestrictionRules([]), fuzzy=False
+        )
+        self.assertEqual(results, [])
+
+    def test_search_works_without_the_trigram_tokenizer(self):
+        """
+        GIVEN: a version of SQLite that has no trigram tokenizer (before 3.34)
+        WHEN: the search index is built, updated and searched
+        THEN: the paths are scanned instead, with the same results
+        """
+        no_trigrams = mock.patch.object(search, "HAS_TRIGRAM_INDEX", False)
+        no_trigrams.start()
+        self.addCleanup(no_trigrams.stop)
+        call_command("build_search_index", stdout=io.StringIO())
+        rules = restrictions.RestrictionRules([])
+
+        results, fuzzy = search.search("volcano_plot", rules)
+        self.assertEqual(
+            sorted(results),
+            [
+                ("client-x", "plots/volcano_plot.png"),
+                ("my_project", "plots/volcano_plot_march.png"),
+                ("other_project", "Volcano_Plot.pdf"),
+            ],
+        )
+        self.assertFalse(fuzzy)
+        self.assertEqual(search.search("volcano%plot", rules, fuzzy=False), ([], False))
+
+        results, fuzzy = search.search("volcnao_plot", rules)
+        self.assertTrue(fuzzy)
+        self.assertIn(("my_project", "plots/volcano_plot_march.png"), results)
+
+        index.scan_project("my_project")
+        (self.projects_dir / "my_project" / "new_heatmap.png").write_text("data")
+        index.scan_project("my_project")
+        self.assertEqual(
+            search.search("heatmap", rules),
+            ([("my_project", "new_heatmap.png")], False),
+        )
+
+
+class BlockSignatureTest(ContentedTestCase):
+    """
+    Clients with an old copy of a large file can fetch its block signature,
+    and then only the blocks that have changed.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.old_contents = b"".join(
+            b"gene_%06d\t%d\n" % (i, i % 7) for i in range(50000)
+        )
+        self.file_path = self.temp_dir / "projects" / "my_project" / "counts.tsv"
+        self.file_path.parent.mkdir(parents=True)
+        self.file_path.write_bytes(self.old_contents)
+
+        self.use_settings(
+            PROJECTS_DIR=self.temp_dir / "projects",
+            CONTENTED_CACHE_DIR=self.temp_dir / "cache",
+            RESTRICTED_PROJECTS=[],
+        )
+
+    def get_signature(self):
+        response = self.client.get(
+            reverse("signature", args=["my_project", "counts.tsv"])
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_signature_lists_block_checksums_and_is_cached(self):
+        """
+        GIVEN: a results file
+        WHEN: its signature is requested twice, and again after the file has
+        changed
+        THEN: the signature has the weak and strong checksums of each block,
+        the second request is served from the cache, and the third reflects
+        the change
+        """
+        signature = self.get_signature()
+        block_size = signature["block_size"]
+        blocks = [
+            self.old_contents[start : start + block_size]
+            for start in range(0, len(self.old_contents), block_size)
+        ]
+        self.assertEqual(
+            signature["blocks"],
+            [
+                [zlib.adler32(b), hashlib.blake2b(b, digest_size=16).hexdigest()]
+                for b in blocks
+            ],
+        )
+
+        with mock.patch.object(signatures, "compute_signature") as compute:
+            self.get_signature()
+        compute.assert_not_called()
+
+        self.file_path.write_bytes(b"new contents")
+        os.utime(self.file_path, ns=(0, 10**9))
+        self.assertEqual(len(self.get_signature()["blocks"]), 1)
+
+    def test_only_changed_blocks_are_fetched(self):
+        """
+        GIVEN: a client with an old copy of a file, which has since been
+        regenerated with a small change
+        WHEN: the client compares the new signature with its copy, and
+        fetches the blocks that differ
+        THEN: the copy is brought up to date by fetching only those blocks
+        """
+        new_contents = bytearray(self.old_contents)
+        new_contents[300000:300010] = b"CHANGED!!\n"
+        self.file_path.write_bytes(bytes(new_contents))
+        signature = self.get_signature()
+        block_size = signature["block_size"]
+
+        changed = [
+            number
+            for number, (weak, _) in enumerate(signature["blocks"])
+            if zlib.adler32(
+                self.old_contents[number * block_size : (number + 1) * block_size]
+            )
+            != weak
+        ]
+        self.assertEqual(len(changed), 1)
+
+        response = self.client.get(
+            reverse("results", args=["my_project", "counts.tsv"]),
+            {"blocks": ",".join(map(str, changed)), "block_size": block_size},
+            HTTP_IF_MATCH=signature["etag"],
+        )
+        fetched = b"".join(response.streaming_content)
+        self.assertEqual(len(fetched), block_size)
+
+        updated = bytearray(self.old_contents)
+        start = changed[0] * block_size
+        updated[start : start + block_size] = fetched
+        self.assertEqual(bytes(updated), bytes(new_contents))
+
+    def test_blocks_of_a_changed_file_are_refused(self):
+        """
+        GIVEN: the signature of a file
+        WHEN: blocks are requested with the signature's ETag after the file
+        has changed, or blocks that don't exist are requested
+        THEN: the requests are refused
+        """
+        signature = self.get_signature()
+        url = reverse("results", args=["my_project", "counts.tsv"])
+        params = {"blocks": "0", "block_size": signature["block_size"]}
+
+        self.file_path.write_bytes(b"new contents")
+        os.utime(self.file_path, ns=(0, 10**9))
+        response = self.client.get(url, params, HTTP_IF_MATCH=signature["etag"])
+        self.assertEqual(response.status_code, 412)
+
+        response = self.client.get(url, {**params, "blocks": "1-3"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_large_signatures_are_built_by_a_job(self):
+        """
+        GIVEN: a file that is too large for its signature to be built inline
+        WHEN: its signature is requested
+        THEN: a job is queued to build it, and the client is asked to retry
+        """
+        with mock.patch.object(signatures, "INLINE_BUILD_MAX_BYTES", 0):
+            response = self.client.get(
+                reverse("signature", args=["my_project", "counts.tsv"])
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(Job.objects.filter(kind="signature").exists())
+
+
+class StaticExportTest(ContentedTestCase):
+    """
+    The public projects can be exported as static pages and hard-linked
+    deliverables, which are only re-exported when they change.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.projects_dir = self.temp_dir / "projects"
+        self.export_dir = self.temp_dir / "export"
+
+        for project_id in ["public_a", "public_b", "secret"]:
+            (self.projects_dir / project_id / "raw_data").mkdir(parents=True)
+            (self.projects_dir / project_id / "report.txt").write_text("report")
+            (self.projects_dir / project_id / "raw_data" / "reads.txt").write_text(
+                "reads"
+            )
+
+        self.use_settings(
+            PROJECTS_DIR=self.projects_dir,
+            RESTRICTED_PROJECTS=["secret", "*/raw_data/"],
+        )
+
+    def export(self):
+        return static_export.export_static(self.export_dir)
+
+    def test_only_public_projects_and_files_are_exported(self):
+        """
+        GIVEN: a collection with a restricted project and restricted folders
+        WHEN: it is exported
+        THEN: the home page and project pages list only the public projects
+        and files, and the public deliverables are hard-linked
+        """
+        self.assertEqual(self.export(), {"exported": 2, "unchanged": 0, "removed": 0})
+
+        home_page = (self.export_dir / "index.html").read_text()
+        self.assertIn("/projects/public_a", home_page)
+        self.assertNotIn("secret", home_page)
+        self.assertEqual(
+            sorted(os.listdir(self.export_dir / "pages")),
+            ["public_a.html", "public_b.html"],
+        )
+        self.assertNotIn(
+            "reads.txt", (self.export_dir / "pages" / "public_a.html").read_text()
+        )
+
+        exported = self.export_dir / "projects" / "public_a" / "report.txt"
+        source = self.projects_dir / "public_a" / "report.txt"
+        self.assertTrue(os.path.samefile(exported, source))
+        self.assertFalse(
+            (self.export_dir / "projects" / "public_a" / "raw_data").exists()
+        )
+
+    def test_only_changed_projects_are_exported_again(self):
+        """
+        GIVEN: a collection that has been exported
+        WHEN: a file is added to one project, another project is restricted,
+        and the collection is exported again
+        THEN: only the changed project is exported, and the restricted one is
+        removed from the export (until it is public again)
+        """
+        self.export()
+        page_b = self.export_dir / "pages" / "public_b.html"
+
+        (self.projects_dir / "public_a" / "figure.png").write_bytes(b"png")
+        with self.settings(RESTRICTED_PROJECTS=["secret", "*/raw_data/", "public_b"]):
+            counts = self.export()
+
+        self.assertEqual(counts, {"exported": 1, "unchanged": 0, "removed": 1})
+        self.assertTrue(
+            (self.export_dir / "projects" / "public_a" / "figure.png").exists()
+        )
+        self.assertFalse(page_b.exists())
+        self.assertFalse((self.export_dir / "projects" / "public_b").exists())
+
+        counts = self.export()
+        self.assertEqual(counts["exported"], 1)
+        self.assertEqual(counts["unchanged"], 1)
+        self.assertTrue(page_b.exists())
+
+    def test_projects_unchanged_in_the_index_are_not_walked(self):
+        """
+        GIVEN: an indexed collection that has been exported
+        WHEN: a file is added to one project, and recorded in the index, and
+        the collection is exported again
+        THEN: only that project is walked (and exported); once the restriction
+        rules change, every project is walked again
+        """
+        self.use_settings(CONTENTED_USE_INDEX=True)
+        index.scan_collection()
+        self.export()
+
+        (self.projects_dir / "public_a" / "figure.png").write_bytes(b"png")
+        index.record_change("public_a", "figure.png")
+        with mock.patch.object(
+            static_export,
+            "list_public_files",
+            wraps=static_export.list_public_files,
+        ) as list_public_files:
+            counts = self.export()
+            self.assertEqual(
+                [call.args[0] for call in list_public_files.call_args_list],
+                ["public_a"],
+            )
+            self.assertEqual(counts, {"exported": 1, "unchanged": 1, "removed": 0})
+
+            list_public_files.reset_mock()
+            with self.settings(RESTRICTED_PROJECTS=["secret"]):
+                counts = self.export()
+            self.assertEqual(list_public_files.call_count, 2)
+            self.assertEqual(counts, {"exported": 2, "unchanged": 0, "removed": 0})
+
+    def test_exports_from_before_generations_were_kept_are_updated(self):
+        """
+        GIVEN: an export whose state holds only a fingerprint for each project
+        WHEN: the collection is exported again
+        THEN: the unchanged projects are not exported again
+        """
+        self.export()
+        state_path = self.export_dir / static_export.STATE_FILE_NAME
+        state = json.loads(state_path.read_text())
+        state_path.write_text(
+            json.dumps(
+                {
+                    project_id: project["fingerprint"]
+                    for project_id, project in state["projects"].items()
+                }
+            )
+        )
+
+        self.assertEqual(self.export(), {"exported": 0, "unchanged": 2, "removed": 0})
@@ -0,0 +1,199 @@
+"""
+Token-bucket throttling of downloads, for each user (or, for users who have
+not logged in, for each IP address).
+
+Each client has two buckets: one of requests, refilled at
+`THROTTLE_REQUEST_RATE` per second and holding at most `THROTTLE_REQUEST_BURST`,
+and one of bytes, refilled at `THROTTLE_BANDWIDTH` bytes per second and holding
+at most `THROTTLE_BANDWIDTH_BURST`. A download is refused, with
+`429 Too Many Requests` and a `Retry-After` header, if the request bucket is
+empty or the byte bucket is in debt; no worker is kept waiting. The size of a
+response is taken from the byte bucket once it is known, so a large file can
+put the bucket into debt, which must be repaid before the next download. A
+streamed response whose size is not known in advance (eg, a CSV export of a
+table) is charged for the bytes that were sent, once it has been sent.
+
+The buckets are kept in the "throttle" cache (see `CACHES` in the settings),
+which is shared by all workers on the host. Buckets are read and written
+without a lock, so requests from one client that arrive at the same instant in
+different workers may all be admitted: the limits are approximate, to within
+a request or two.
+"""
+
+import functools
+import math
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+THROTTLE_CACHE = "throttle"
+
+
+def get_client_ip(request):
+    """
+    The IP address of the client. When gunicorn listens on a unix socket,
+    `REMOTE_ADDR` is empty, and the address is read from the `X-Real-IP`
+    header set by nginx (see `deploy_tools/nginx.template.conf`).
+    """
+    return request.META.get("REMOTE_ADDR") or request.META.get("HTTP_X_REAL_IP", "")
+
+
+def get_client_key(request, use_session=True):
+    """
+    The key that a client's buckets are stored under: the user, if they are
+    logged in, otherwise the IP address. With `use_session=False`, the user is
+    not looked up (so no database access is needed).
+    """
+    if use_session and request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    return f"ip:{get_client_ip(request)}"
+
+
+def get_limits():
+    """
+    The `(rate, burst)` of each bucket that is in use.
+    """
+    limits = {
+        "requests": (settings.THROTTLE_REQUEST_RATE, settings.THROTTLE_REQUEST_BURST),
+        "bytes": (settings.THROTTLE_BANDWIDTH, settings.THROTTLE_BANDWIDTH_BURST),
+    }
+    return {bucket: limit for bucket, limit in limits.items() if limit[0] > 0}
+
+
+def _load_levels(key, now):
+    """
+    The current level of each of a client's buckets. A client that is not in
+    the cache has full buckets.
+    """
+    state = caches[THROTTLE_CACHE].get(key) or {}
+    levels = {}
+    for bucket, (rate, burst) in get_limits().items():
+        level, updated = state.get(bucket, (burst, now))
+        levels[bucket] = min(burst, level + max(now - updated, 0) * rate)
+    return levels
+
+
+def _save_levels(key, levels, now):
+    """
+    Store a client's buckets until they would have refilled completely (at
+    which point they are the same as a new client's).
+    """
+    limits = get_limits()
+    refill_time = max(
+        (limits[bucket][1] - level) / limits[bucket][0]
+        for bucket, level in levels.items()
+    )
+    caches[THROTTLE_CACHE].set(
+        key,
+        {bucket: (level, now) for bucket, level in levels.items()},
+        timeout=math.ceil(refill_time) + 1,
+    )
+
+
+def acquire(key, now=None):
+    """
+    Take one request from a client's buckets. Returns 0 if the request is
+    allowed, otherwise the number of seconds that the client should wait.
+    """
+    now = time.time() if now is None else now
+    limits = get_limits()
+    levels = _load_levels(key, now)
+
+    wait = 0.0
+    if "requests" in levels and levels["requests"] < 1:
+        wait = (1 - levels["requests"]) / limits["requests"][0]
+    if "bytes" in levels and levels["bytes"] <= 0:
+        wait = max(wait, -levels["bytes"] / limits["bytes"][0])
+    if wait:
+        return max(math.ceil(wait), 1)
+
+    if "requests" in levels:
+        levels["requests"] -= 1
+    _save_levels(key, levels, now)
+    return 0
+
+
+def charge(key, size, now=None):
+    """
+    Take `size` bytes from a client's byte bucket.
+    """
+    now = time.time() if now is None else now
+    levels = _load_levels(key, now)
+    if "bytes" in levels:
+        levels["bytes"] -= size
+        _save_levels(key, levels, now)
+
+
+def get_response_size(response):
+    """
+    The number of bytes in the body of a response, if it is known.
+    """
+    if not response.streaming:
+        return len(response.content)
+
+    length = response.get("Content-Length")
+    if length:
+        return int(length)
+    # FileResponse only sets Content-Length for files opened by absolute path
+    file_to_stream = getattr(response, "file_to_stream", None)
+    if file_to_stream is not None and hasattr(file_to_stream, "fileno"):
+        return os.fstat(file_to_stream.fileno()).st_size
+    return None
+
+
+def charge_as_sent(content, key):
+    """
+    Yield the chunks of a streamed response, and take the bytes that were
+    sent from the client's byte bucket once the response has been sent (or
+    closed early).
+    """
+    sent = 0
+    try:
+        for chunk in content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        if sent:
+            charge(key, sent)
+
+
+def throttle_downloads(use_session=True):
+    """
+    Decorate a view, so that its requests (and the bytes that it sends) count
+    towards the client's limits; a client that is over a limit is sent a
+    `429` response instead.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def throttled_view(request, *args, **kwargs):
+            if not get_limits():
+                return view(request, *args, **kwargs)
+
+            key = get_client_key(request, use_session)
+            wait = acquire(key)
+            if wait:
+                response = HttpResponse(
+                    "Too many downloads; please try again later\n",
+                    content_type="text/plain",
+                    status=429,
+                )
+                response["Retry-After"] = str(wait)
+                return response
+
+            response = view(request, *args, **kwargs)
+            size = get_response_size(response)
+            if size is None:
+                response.streaming_content = charge_as_sent(
+                    response.streaming_content, key
+                )
+            elif size:
+                charge(key, size)
+            return response
+
+        return throttled_view
+
+    return decorator
@@ -0,0 +1,306 @@
+"""
+Uploads of deliverables into a project collection.
+
+An upload is started for a file (`start_upload`), then its contents are sent
+in one or more chunks, each of which is written straight to a staging file as
+it arrives (`ChunkUploadHandler`), so that a file of any size is received in
+constant memory. If a connection drops, the upload is resumed from the number
+of bytes that were received, which is recorded after each chunk.
+
+Once every byte has arrived, the SHA-256 checksum of the staged file is
+checked against the one given when the upload was started, and the file is
+moved into place in `<projects_dir>/<project_id>/` in a single rename
+(`commit_upload`); a partly-uploaded file is never visible in the collection.
+The checksum is computed as the chunks arrive, so the last request does not
+read the whole file again; only if the chunks of an upload were received by
+different worker processes is the staged file hashed when it is committed.
+
+Snapshots are never changed (see `contented.snapshots`), so a file uploaded
+into a project that is published as snapshots is added to a copy of the latest
+snapshot, which is then published as a new snapshot. Files cannot be uploaded
+into hidden entries of the collection, into a project that is a symlink to
+anywhere else, through a symlinked folder that leads out of the project, or
+over a folder.
+
+Staging files are kept in `<cache_dir>/uploads` of the current site.
+"""
+
+import datetime
+import errno
+import hashlib
+import os
+import posixpath
+import shutil
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from . import index, snapshots
+from .models import Upload
+from .sites import get_current_site
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# The checksums of the uploads that this process is receiving, so far: for
+# each upload id, `(bytes hashed, hasher)`. Only the most recent are kept
+_running_hashes = {}
+MAX_RUNNING_HASHES = 1000
+
+
+class UploadError(Exception):
+    """
+    An upload (or a chunk of one) that cannot be accepted.
+    """
+
+
+class ChecksumMismatch(UploadError):
+    pass
+
+
+def clean_upload_path(project_id, file_name):
+    """
+    The normalised path of an uploaded file within its project. Raises
+    UploadError for a project id or path that would point outside the project,
+    or for a hidden project id (eg, `.snapshots`).
+
+    The views that read single files use this to check their paths too (see
+    `views.clean_file_name`).
+    """
+    if not project_id or project_id.startswith(".") or "/" in project_id:
+        raise UploadError(f"Invalid project id: {project_id}")
+
+    path = posixpath.normpath(file_name)
+    if path.startswith(("/", "../")) or path in {".", ".."}:
+        raise UploadError(f"Invalid file name: {file_name}")
+    return path
+
+
+def check_destination(project_id, path):
+    """
+    Raise UploadError if a file cannot be uploaded to `path` in a project: if
+    the project is a symlink (unless it points to the latest snapshot of the
+    project), or a folder on the path is a symlink that leads out of the
+    project, since the file would be written wherever the link points; or if
+    there is a folder at `path`.
+    """
+    project_path = get_current_site().projects_dir / project_id
+    if project_path.is_symlink() and snapshots.get_latest_version(project_id) is None:
+        raise UploadError(f"Files cannot be uploaded into {project_id}: it is a link")
+
+    project_root = project_path.resolve()
+    destination = project_root / path
+    parent = destination.parent.resolve()
+    if parent != project_root and project_root not in parent.parents:
+        raise UploadError(f"Files cannot be uploaded to {path}: it leads elsewhere")
+    if destination.is_dir():
+        raise UploadError(f"Files cannot be uploaded to {path}: it is a folder")
+
+
+def get_staging_path(upload):
+    return get_current_site().cache_dir / "uploads" / f"{upload.id}.part"
+
+
+def start_upload(user, project_id, file_name, size, sha256):
+    """
+    Create an `Upload` of `size` bytes, to be stored as `file_name` in a
+    project, and its (empty) staging file.
+    """
+    if size < 0:
+        raise UploadError("The size should be non-negative")
+    if len(sha256) != 64 or not all(c in "0123456789abcdef" for c in sha256):
+        raise UploadError("The checksum should be a hex-encoded SHA-256 digest")
+    path = clean_upload_path(project_id, file_name)
+    check_destination(project_id, path)
+
+    upload = Upload.objects.create(
+        id=uuid.uuid4(),
+        user=user,
+        site=get_current_site().name,
+        project_id=project_id,
+        path=path,
+        size=size,
+        sha256=sha256,
+    )
+    staging_path = get_staging_path(upload)
+    staging_path.parent.mkdir(parents=True, exist_ok=True)
+    staging_path.touch()
+    return upload
+
+
+class ChunkUploadHandler(FileUploadHandler):
+    """
+    An upload handler that writes the file in a multipart request straight
+    into the staging file of `upload`, from byte `offset`, rather than
+    keeping it in memory (or in a temporary file) for the view.
+
+    The number of bytes written is available as `received` once the request
+    has been parsed; a chunk that would run past the declared size of the
+    upload sets `too_large` and is not written past that size. The chunk is
+    added to the running checksum of the upload (`hasher`), if this process
+    has it.
+    """
+
+    def __init__(self, upload, offset, request=None):
+        super().__init__(request)
+        self.upload = upload
+        self.offset = offset
+        self.received = 0
+        self.too_large = False
+        self.staging_file = None
+        self.hasher = get_running_hash(upload, offset)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.staging_file is None:
+            self.staging_file = open(get_staging_path(self.upload), "r+b")
+            self.staging_file.seek(self.offset)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        room = self.upload.size - self.offset - self.received
+        if len(raw_data) > room:
+            self.too_large = True
+            raw_data = raw_data[:room]
+        self.staging_file.write(raw_data)
+        if self.hasher is not None:
+            self.hasher.update(raw_data)
+        self.received += len(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        return None
+
+    def upload_complete(self):
+        if self.staging_file is not None:
+            # Anything after the chunk is left over from an earlier attempt
+            self.staging_file.truncate()
+            self.staging_file.close()
+
+
+def get_running_hash(upload, offset):
+    """
+    A copy of the running checksum of `upload`, if this process has hashed
+    exactly its first `offset` bytes (a new one, at the start of the upload);
+    otherwise None.
+    """
+    if offset == 0:
+        return hashlib.sha256()
+    hashed, hasher = _running_hashes.get(upload.id, (None, None))
+    return hasher.copy() if hashed == offset else None
+
+
+def record_chunk(upload, offset, received, hasher=None):
+    """
+    Record that `received` bytes were written to the staging file of `upload`
+    from `offset`, and keep `hasher` as its running checksum. Returns False if
+    another chunk was recorded from that offset in the meantime.
+    """
+    updated = Upload.objects.filter(id=upload.id, received=offset).update(
+        received=offset + received
+    )
+    upload.received = offset + received
+    if updated and hasher is not None:
+        _running_hashes.pop(upload.id, None)
+        _running_hashes[upload.id] = (upload.received, hasher)
+        while len(_running_hashes) > MAX_RUNNING_HASHES:
+            _running_hashes.pop(next(iter(_running_hashes)), None)
+    return bool(updated)
+
+
+def get_staged_digest(upload):
+    """
+    The SHA-256 digest of the staged file of a fully-received upload, from its
+    running checksum if this process has it, or else read from the file.
+    """
+    hashed, hasher = _running_hashes.pop(upload.id, (None, None))
+    if hashed == upload.size:
+        return hasher.hexdigest()
+    return hash_staged_file(upload)
+
+
+def hash_staged_file(upload):
+    hasher = hashlib.sha256()
+    with open(get_staging_path(upload), "rb") as file_object:
+        for chunk in iter(lambda: file_object.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def move_into_place(upload, destination):
+    """
+    Move the staged file of an upload to `destination`, in a single rename.
+    """
+    staging_path = get_staging_path(upload)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(staging_path, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        # The cache is on another filesystem: copy the file alongside its
+        # destination first, so that it still appears in a single rename
+        partial_path = destination.with_name(f".{destination.name}.{upload.id}.part")
+        shutil.copyfile(staging_path, partial_path)
+        os.replace(partial_path, destination)
+        os.remove(staging_path)
+
+
+def publish_with_upload(upload, version):
+    """
+    Publish a new snapshot of the upload's project, made of the latest
+    snapshot (whose files are hard-linked, rather than copied) and the
+    uploaded file.
+    """
+    latest_path = snapshots.get_snapshot_path(
+        upload.project_id, snapshots.get_latest_version(upload.project_id)
+    )
+    new_path = snapshots.get_snapshots_dir(upload.project_id) / f".{upload.id}.new"
+    shutil.copytree(latest_path, new_path, copy_function=os.link)
+    # The rename replaces the link to the file in the latest snapshot, rather
+    # than writing to the file itself
+    move_into_place(upload, new_path / upload.path)
+    snapshots.publish_snapshot(upload.project_id, new_path, version=version)
+
+
+def commit_upload(upload):
+    """
+    Check the checksum of a fully-received upload, and move the staged file
+    into place in its project, replacing any file of the same name (in a new
+    snapshot, if the project is published as snapshots). Raises
+    ChecksumMismatch (and discards the upload) if the checksum is wrong, and
+    UploadError if the file can no longer be put there (see
+    `check_destination`).
+    """
+    if get_staged_digest(upload) != upload.sha256:
+        discard_upload(upload)
+        raise ChecksumMismatch("The uploaded file does not match its checksum")
+    check_destination(upload.project_id, upload.path)
+
+    projects_dir = get_current_site().projects_dir
+    destination = projects_dir / upload.project_id / upload.path
+    if snapshots.get_latest_version(upload.project_id) is not None:
+        # Versions are precise enough that two uploads never share one
+        version = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S.%f")
+        publish_with_upload(upload, version)
+    else:
+        move_into_place(upload, destination)
+
+    Upload.objects.filter(id=upload.id).update(completed=True)
+    upload.completed = True
+
+    if settings.CONTENTED_USE_INDEX:
+        index.record_change(upload.project_id, upload.path, projects_dir)
+    return destination
+
+
+def discard_upload(upload):
+    """
+    Delete an upload and its staging file.
+    """
+    _running_hashes.pop(upload.id, None)
+    try:
+        os.remove(get_staging_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
@@ -3,24 +3,161 @@ View functions for the home-page, project-pages and results-pages of a given
 collection of projects
 """
 
+import bisect
+import datetime
+import json
+import math
+import mimetypes
 import os
+import posixpath
+import time
 from pathlib import Path
+from urllib.parse import quote, urlencode
 from django.conf import settings
+from django.db.models import Q
 from django.shortcuts import render
-from django.http import FileResponse, HttpResponse, HttpResponseRedirect
+from django.template import loader
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
+
+from . import (
+    access_log,
+    archives,
+    index,
+    jobs,
+    local_cache,
+    search,
+    shared_index,
+    signatures,
+    signing,
+    snapshots,
+    storage,
+    tables,
+    tail,
+    uploads,
+)
+from .throttle import throttle_downloads
+from .models import AccessEvent, ProjectSummary, Upload, UserVisit
+from .restrictions import compile_rules
+from .sites import get_current_site
 
 
 BINARY_EXTENSIONS = {".pdf", ".jpeg", ".png", ".svg"}
 
+# When project pages are streamed, the rows of the results-table are sent in
+# chunks; the first chunk is small, so that it is sent quickly, and later
+# chunks double in size up to ROWS_CHUNK_MAX
+ROWS_MARKER = "<!-- results-rows -->"
+ROWS_CHUNK_MIN = 50
+ROWS_CHUNK_MAX = 2000
+
+# A stream of project events is closed (and reopened by the browser) after this
+# many seconds; the index is checked for new events every EVENT_POLL_INTERVAL
+EVENT_STREAM_SECONDS = 30
+EVENT_POLL_INTERVAL = 1.0
+
+# Files are read (in the storage executor, see `contented.storage`) in blocks
+# of this many bytes
+FILE_BLOCK_SIZE = 512 * 1024
+
+# The "what's new" feed shows the changes from at most this many events at a
+# time; any later changes are shown on the next visit
+MAX_FEED_EVENTS = 1000
+
+# The most recent listing of each project collection, for use while its
+# storage is not responding
+_project_listings = {}
+
+# The sorted project names of each project collection, with the version of the
+# collection they were read from (see `get_sorted_projects`)
+_sorted_projects = {}
+
+# Files in project snapshots never change, so they can be cached for as long
+# as browsers and proxies allow
+SNAPSHOT_MAX_AGE = 365 * 24 * 60 * 60
+
+# A search lists at most this many files
+SEARCH_RESULTS_LIMIT = 200
+
+# The tail of a file shows this many lines, unless another number (up to
+# TAIL_LINES_MAX) is asked for
+TAIL_LINES_DEFAULT = 100
+TAIL_LINES_MAX = 10000
+
+# The home page lists this many projects at a time
+HOME_PAGE_SIZE = 50
+HOME_PAGE_SORTS = ("name", "updated")
+
 
 def home_page(request):
     """
     Home page displays a list of projects
     If the user is not logged in, only the non-restricted projects are shown
     Otherwise, all available projects are shown.
+
+    Each project is shown with the statistics (number of files, total size,
+    last update and file types) that are stored in the project index; these
+    are maintained as files change, so no project directory is walked here.
+
+    The projects are shown `HOME_PAGE_SIZE` at a time, sorted by name (the
+    default) or by last update (`sort=updated`), and can be filtered by a name
+    prefix (`prefix`) or by a part of the name (`q`, ignoring case). Each page
+    links to the next using a cursor (`after`: the sort key of the last
+    project shown), so a page costs the same however many projects precede
+    it.
     """
-    projects = get_accessible_projects(request.user)
-    return render(request, "home.html", {"project_ids": projects})
+    sort = request.GET.get("sort", "name")
+    if sort not in HOME_PAGE_SORTS:
+        sort = "name"
+    filters = {
+        "prefix": request.GET.get("prefix", ""),
+        "contains": request.GET.get("q", "").lower(),
+        "after": request.GET.get("after", ""),
+    }
+    restrictions = get_restrictions(request.user)
+
+    if sort == "updated":
+        summaries, next_cursor = page_projects_by_update(restrictions, **filters)
+        projects = [summary.project_id for summary in summaries]
+        summaries = {summary.project_id: summary for summary in summaries}
+    else:
+        projects, next_cursor = page_projects_by_name(restrictions, **filters)
+        summaries = index.get_summaries(project_ids=projects)
+
+    project_rows = [
+        {"project_id": project_id, "summary": summaries.get(project_id)}
+        for project_id in projects
+    ]
+    query = {"sort": sort, "prefix": filters["prefix"], "q": request.GET.get("q", "")}
+    query = {key: value for key, value in query.items() if value}
+    next_url = None
+    if next_cursor is not None:
+        next_url = "?" + urlencode({**query, "after": next_cursor})
+
+    return render(
+        request,
+        "home.html",
+        {
+            "project_ids": projects,
+            "project_rows": project_rows,
+            "sort": sort,
+            "prefix": filters["prefix"],
+            "q": request.GET.get("q", ""),
+            "first_url": "?" + urlencode(query) if filters["after"] else None,
+            "next_url": next_url,
+        },
+    )
 
 
 def project_page(request, project_id):
@@ -28,46 +165,740 @@ def project_page(request, project_id):
     Project page displays a list of the files that are available for a given
     project.
     If the user is not logged in and the project is restricted, the user is
-    redirected to the log-in page when trying to open a given project page.
+    redirected to the log-in page when trying to open a given project page;
+    files that are restricted (see `contented.restrictions`) are not listed.
+
+    The files are read from the shared index, if one is configured, or from
+    the project index, if `settings.CONTENTED_USE_INDEX` is set; otherwise the
+    project directory is walked. With the project index, the page subscribes
+    to `project_events` so that the list of files is updated as the project
+    changes.
+
+    If `settings.CONTENTED_STREAM_PROJECT_PAGES` is set, the page is streamed:
+    everything up to the results-table is sent straight away, and the rows of
+    the table follow, in chunks, as the files are found.
     """
     if not project_id in get_accessible_projects(request.user):
         return HttpResponseRedirect(settings.LOGIN_URL)
 
-    project_collection = settings.PROJECTS_DIR
-    project_path = project_collection / project_id
-    project_files = get_relative_results_files(project_path)
+    generation = None
+    if settings.CONTENTED_USE_INDEX:
+        generation = index.get_generation(project_id)
 
-    return render(
-        request,
-        "project.html",
-        {"project_id": project_id, "results_files": [str(f) for f in project_files]},
+    context = {
+        "project_id": project_id,
+        "generation": generation,
+        "snapshot": snapshots.get_latest_version(project_id),
+    }
+    project_files = filter_restricted_files(
+        request.user, project_id, iter_project_files(project_id)
     )
 
+    if settings.CONTENTED_STREAM_PROJECT_PAGES:
+        page = loader.render_to_string(
+            "project_stream.html", {**context, "rows_marker": ROWS_MARKER}, request
+        )
+        head, tail = page.split(ROWS_MARKER, 1)
+        response = StreamingHttpResponse(
+            stream_project_page(request, project_id, head, project_files, tail)
+        )
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    context["results_files"] = [str(f) for f in project_files]
+    return render(request, "project.html", context)
 
+
+def project_events(request, project_id):
+    """
+    A stream of server-sent events, one per change to the files in a project.
+
+    Each event has the generation of the project index as its id, the kind of
+    change ("created", "modified" or "removed") as its type and the path of the
+    file as its data. Events after the generation given by the `Last-Event-ID`
+    header (or, for a new connection, the `since` parameter) are sent.
+    """
+    if not project_id in get_accessible_projects(request.user):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    try:
+        generation = int(
+            request.headers.get("Last-Event-ID") or request.GET.get("since", 0)
+        )
+    except ValueError:
+        return HttpResponseBadRequest("The event id should be an integer")
+
+    projects_dir = get_current_site().projects_dir
+    response = StreamingHttpResponse(
+        stream_project_events(
+            project_id, generation, projects_dir, get_restrictions(request.user)
+        ),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@throttle_downloads()
 def results_page(request, project_id, file_name):
     """
     Selects an appropriate report / results file to display in the browser
     based on users-selection.
 
-    If the user is not logged in, and the file is within a restricted project,
-    then the user is redirected to the login page.
+    If the user is not logged in, and the file is restricted (or is within a
+    restricted project or folder), then the user is redirected to the login
+    page.
+
+    Each file that is served is recorded in the access log. Downloads are
+    throttled for each user (see `contented.throttle`), and files are served
+    from local disk if they are in the local cache (see `open_deliverable`).
+
+    If the project is stored as an archive, the file is streamed from the
+    archive (see `archive_member_page`). If it is published as snapshots (see
+    `contented.snapshots`), the user is redirected to the file in the latest
+    snapshot, which can be cached indefinitely.
+
+    With the `blocks` parameter, only the given blocks of the file are sent
+    (see `block_download`).
     """
-    if not project_id in get_accessible_projects(request.user):
+    if not can_access_file(request.user, project_id, file_name):
         return HttpResponseRedirect(settings.LOGIN_URL)
 
-    project_collection = settings.PROJECTS_DIR
+    if "blocks" in request.GET:
+        return block_download(request, project_id, file_name)
+
+    version = snapshots.get_latest_version(project_id)
+    if version is not None:
+        response = HttpResponseRedirect(
+            reverse("snapshot", args=[project_id, version, file_name])
+        )
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    project_collection = get_current_site().projects_dir
     file_path = project_collection / project_id / file_name
 
     _, file_extension = os.path.splitext(file_name)
+    try:
+        file_object, size = open_deliverable(file_path, "rb")
+    except FileNotFoundError:
+        archive_path = archives.find_archive(project_id)
+        if archive_path is None:
+            raise
+        return archive_member_page(request, project_id, archive_path, file_name)
+
+    access_log.record_download(request, project_id, file_name, size)
     if file_extension in BINARY_EXTENSIONS:
-        return FileResponse(open(file_path, "rb"))
+        return get_file_response(file_object)
 
+    # Text files are streamed too, so that no single read of a large file
+    # runs into the storage timeout
     content_type = "text/html" if file_extension == ".html" else "text/plain"
-    file_contents = ""
-    with open(file_path, "r") as file_object:
-        file_contents = file_object.read()
+    return get_file_response(file_object, content_type=content_type)
+
+
+def signature_page(request, project_id, file_name):
+    """
+    The block signature of a results file (see `contented.signatures`), as
+    JSON, for clients that want to fetch only the blocks that have changed
+    since they last downloaded the file.
+
+    Signatures are cached; the signature of a large file that has no cached
+    signature is built by a background job, and the client is asked to try
+    again later.
+
+    Access to the signature is restricted in the same way as for
+    `results_page`.
+    """
+    file_name = clean_file_name(project_id, file_name)
+    if not can_access_file(request.user, project_id, file_name):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    file_path = get_current_site().projects_dir / project_id / file_name
+    if not storage.is_file(file_path):
+        raise Http404(f"No file named {file_name} in {project_id}")
+
+    signature = signatures.get_cached_signature(file_path)
+    if signature is None:
+        size = storage.run(file_path, os.stat, file_path).st_size
+        if size > signatures.INLINE_BUILD_MAX_BYTES:
+            jobs.enqueue("signature", file_path, priority=1)
+            response = HttpResponse(
+                "This signature is being prepared, please try again shortly",
+                content_type="text/plain",
+                status=202,
+            )
+            response["Retry-After"] = "5"
+            return response
+        signature = signatures.build_signature_cache(file_path)
+
+    response = JsonResponse(signature)
+    response["ETag"] = signature["etag"]
+    return response
+
+
+def block_download(request, project_id, file_name):
+    """
+    Send some of the blocks of a results file, one after another, for a
+    client that has its signature (see `signature_page`).
+
+    The `blocks` parameter lists the block numbers (eg, `0,4-7,12`) and
+    `block_size` gives the block size from the signature. The `If-Match`
+    header should hold the `etag` of the signature: if the file has changed
+    since, `412 Precondition Failed` is returned.
+    """
+    try:
+        block_size = int(request.GET.get("block_size", ""))
+    except ValueError:
+        return HttpResponseBadRequest("`block_size` should be an integer")
+    if not 0 < block_size <= signatures.MAX_BLOCK_SIZE:
+        return HttpResponseBadRequest("`block_size` is out of range")
+
+    file_path = get_current_site().projects_dir / project_id / file_name
+    try:
+        file_object, size = open_deliverable(file_path, "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        raise Http404(f"No file named {file_name} in {project_id}") from None
+
+    etag = signatures.get_etag(file_object.fstat())
+    if request.headers.get("If-Match", etag) not in {etag, "*"}:
+        file_object.close()
+        return HttpResponse(status=412)
+
+    try:
+        runs = signatures.parse_blocks(
+            request.GET["blocks"], math.ceil(size / block_size)
+        )
+    except ValueError as error:
+        file_object.close()
+        return HttpResponseBadRequest(str(error))
+
+    length = sum(
+        min((last + 1) * block_size, size) - first * block_size for first, last in runs
+    )
+    response = StreamingHttpResponse(
+        signatures.iter_blocks(file_object, runs, block_size, FILE_BLOCK_SIZE),
+        content_type="application/octet-stream",
+    )
+    response["Content-Length"] = str(length)
+    response["ETag"] = etag
+    access_log.record_download(request, project_id, file_name, length)
+    return response
+
+
+@throttle_downloads()
+def snapshot_page(request, project_id, version, file_name):
+    """
+    Serve a file from one snapshot of a project (see `contented.snapshots`).
+
+    As the file can never change, it is sent with an ETag and a Cache-Control
+    header that lets it be cached indefinitely (by the browser only, if the
+    file is restricted); a request that already has the file (whose
+    `If-None-Match` header holds the ETag) gets `304 Not Modified`.
+
+    Access to the file is restricted in the same way as for `results_page`.
+    """
+    file_name = clean_file_name(project_id, file_name)
+    if not can_access_file(request.user, project_id, file_name):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    snapshot_path = snapshots.get_snapshot_path(project_id, version)
+    if snapshot_path is None:
+        raise Http404(f"No snapshot {version} of {project_id}")
+
+    try:
+        file_object, _ = open_deliverable(snapshot_path / file_name, "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        raise Http404(f"No file named {file_name} in {project_id}") from None
+
+    stat = file_object.fstat()
+    etag = f'"{version}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    visibility = "public"
+    if get_current_site().restrictions.is_restricted_file(project_id, file_name):
+        visibility = "private"
+    cache_control = f"{visibility}, max-age={SNAPSHOT_MAX_AGE}, immutable"
+
+    if etag in request.headers.get("If-None-Match", ""):
+        file_object.close()
+        response = HttpResponse(status=304)
+    else:
+        _, file_extension = os.path.splitext(file_name)
+        if file_extension in BINARY_EXTENSIONS:
+            content_type = mimetypes.guess_type(file_name)[0]
+        else:
+            content_type = "text/html" if file_extension == ".html" else "text/plain"
+        response = get_file_response(file_object)
+        response["Content-Type"] = content_type or "application/octet-stream"
+        access_log.record_download(request, project_id, file_name, stat.st_size)
+
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control
+    return response
+
+
+def archive_member_page(request, project_id, archive_path, file_name):
+    """
+    Stream a file from a project that is stored as an archive (see
+    `contented.archives`), without extracting it.
+
+    A single byte-range can be requested with a `Range` header; the response
+    is then `206 Partial Content`.
+    """
+    member = archives.get_members(archive_path).get(file_name)
+    if member is None:
+        raise Http404(f"No file named {file_name} in {project_id}")
+
+    try:
+        byte_range = archives.parse_range(request.headers.get("Range"), member.size)
+    except archives.RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{member.size}"
+        return response
+    start, end = byte_range or (0, member.size)
+
+    _, file_extension = os.path.splitext(file_name)
+    if file_extension in BINARY_EXTENSIONS:
+        content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    else:
+        content_type = "text/html" if file_extension == ".html" else "text/plain"
+
+    response = StreamingHttpResponse(
+        archives.iter_member(archive_path, member, start, end),
+        content_type=content_type,
+        status=206 if byte_range else 200,
+    )
+    response["Content-Length"] = str(end - start)
+    response["Accept-Ranges"] = "bytes"
+    if byte_range:
+        response["Content-Range"] = f"bytes {start}-{end - 1}/{member.size}"
+
+    access_log.record_download(request, project_id, file_name, end - start)
+    return response
+
+
+def sign_page(request, project_id, file_name=""):
+    """
+    Issue a signed, expiring URL for a file or folder in a project (or for the
+    whole project, if `file_name` is empty). The URL is returned as plain text.
+
+    The lifetime of the URL can be set, in seconds, using the `max_age`
+    parameter; it is capped at `settings.SIGNED_URL_MAX_AGE`.
+
+    Only users who can access the project can obtain a signed URL for it.
+    A signed URL does not check the restriction rules, so a user who is not a
+    member of the site can only sign a folder if none of the files in it are
+    restricted.
+    """
+    if not can_access_file(request.user, project_id, file_name):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    target = get_current_site().projects_dir / project_id / file_name
+    if ".." in Path(file_name).parts or not storage.exists(target):
+        raise Http404(f"No file or folder named {file_name} in {project_id}")
+
+    restrictions = get_restrictions(request.user)
+    if restrictions and storage.is_dir(target):
+        folder = posixpath.join(project_id, file_name)
+        if any(
+            restrictions.is_restricted(posixpath.join(folder, relative_path))
+            for relative_path in iter_relative_results_files(target)
+        ):
+            return HttpResponseRedirect(settings.LOGIN_URL)
+
+    try:
+        max_age = int(request.GET.get("max_age", settings.SIGNED_URL_MAX_AGE))
+    except ValueError:
+        return HttpResponseBadRequest("`max_age` should be an integer")
+    if max_age <= 0:
+        return HttpResponseBadRequest("`max_age` should be positive")
+
+    signed_url = signing.make_signed_url(project_id, file_name, max_age=max_age)
+    return HttpResponse(
+        request.build_absolute_uri(signed_url) + "\n", content_type="text/plain"
+    )
+
+
+@throttle_downloads(use_session=False)
+def signed_download(request, expires, token, signed_path):
+    """
+    Serve a file (or list the files in a folder) using a signed URL from
+    `sign_page`.
+
+    The signature is checked without looking up the session, the user or the
+    projects in the collection, so no database access is needed. A folder is
+    listed as plain text, with one signed URL per file (suitable for
+    `wget -i`). Each file that is served is recorded in the access log.
+    Downloads are throttled for each IP address, rather than for each user, so
+    that the session is not looked up.
+    """
+    try:
+        relative_path = signing.verify_signed_path(expires, token, signed_path)
+    except signing.SignatureExpired:
+        return HttpResponse(
+            "This link has expired", content_type="text/plain", status=410
+        )
+    except signing.SignatureError:
+        return HttpResponseForbidden("Invalid link")
+
+    path = get_current_site().projects_dir / relative_path
+    if storage.is_dir(path):
+        base_url = request.build_absolute_uri(quote(request.path.rstrip("/") + "/"))
+        listing = "".join(
+            f"{base_url}{quote(f.as_posix())}\n"
+            for f in sorted(get_relative_results_files(path))
+        )
+        return HttpResponse(listing, content_type="text/plain")
+
+    if not storage.is_file(path):
+        raise Http404(f"No file named {relative_path}")
+
+    file_object, size = open_deliverable(path, "rb")
+    project_id, _, file_name = relative_path.partition("/")
+    access_log.record_download(
+        request, project_id, file_name, size, via=AccessEvent.SIGNED
+    )
+    return get_file_response(file_object)
+
+
+def manifest_page(request, project_id):
+    """
+    A JSON listing of the files in a project, for clients that mirror the
+    project: the path, size, modification-time and content-hash of each file.
+
+    The listing is read from the project index. The `generation` in the
+    response can be passed back as `since=<generation>` by the next request;
+    that response then only lists files that were added, modified or removed
+    (with `"removed": true`) in the meantime.
+
+    Files that have not yet been hashed are listed with a `null` hash (and
+    `"complete": false`); a job to hash them is queued.
+
+    Access to the manifest is restricted in the same way as for
+    `results_page`.
+    """
+    if not project_id in get_accessible_projects(request.user):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    try:
+        since = int(request.GET.get("since", 0))
+    except ValueError:
+        return HttpResponseBadRequest("`since` should be an integer")
+
+    generation = index.get_generation(project_id)
+    entries = index.get_manifest_entries(project_id, since=since, until=generation)
+    complete = not entries.filter(removed=False, content_hash="").exists()
+    if not complete:
+        jobs.enqueue_project_hashing(project_id)
+
+    return StreamingHttpResponse(
+        stream_manifest(
+            project_id,
+            since,
+            generation,
+            complete,
+            entries,
+            get_restrictions(request.user),
+        ),
+        content_type="application/json",
+    )
+
+
+def whats_new_page(request):
+    """
+    The files that have been added, modified or removed, of those that the
+    user can access (leaving out files that a restriction rule hides from
+    them), since they last viewed this page.
+
+    The changes are read from the events in the project index that follow the
+    generation stored in the user's `UserVisit`, so the page costs the same
+    however many files the collection holds. On the first visit, the current
+    generation is recorded and no changes are shown.
+    """
+    if not request.user.is_authenticated:
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    collection = index.get_collection_key()
+    visit = UserVisit.objects.filter(user=request.user, collection=collection).first()
+    if visit is None:
+        visit = UserVisit(
+            user=request.user,
+            collection=collection,
+            seen_generation=index.get_generation(),
+        )
+        changes, more = None, False
+    else:
+        projects = get_accessible_projects(request.user)
+        restrictions = get_restrictions(request.user)
+        changes, visit.seen_generation = index.get_changes_since(
+            visit.seen_generation, project_ids=projects, limit=MAX_FEED_EVENTS
+        )
+        changes = [
+            change
+            for change in changes
+            if not restrictions.is_restricted_file(change.project_id, change.path)
+        ]
+        later_events = (
+            index.get_events_since(visit.seen_generation)
+            .filter(project_id__in=projects)
+            .values_list("project_id", "path")
+        )
+        more = any(
+            not restrictions.is_restricted_file(project_id, path)
+            for project_id, path in later_events.iterator()
+        )
+
+    visit.save()
+    return render(request, "whats_new.html", {"changes": changes, "more": more})
+
+
+def search_page(request):
+    """
+    Search for files, by name or path, in every project that the user can
+    access (see `contented.search`).
+
+    The `q` parameter holds the words to search for; files whose paths
+    contain all of them are listed. If there are none, files with similar
+    paths are listed instead.
+    """
+    query = request.GET.get("q", "").strip()
+    context = {"query": query, "results": None, "fuzzy": False, "error": ""}
+
+    if query:
+        try:
+            found = search.search(
+                query, get_restrictions(request.user), limit=SEARCH_RESULTS_LIMIT
+            )
+        except ValueError as error:
+            context["error"] = str(error)
+        else:
+            if found is None:
+                context["error"] = "Search is not available yet"
+            else:
+                context["results"], context["fuzzy"] = found
+
+    return render(request, "search.html", context)
+
+
+@throttle_downloads()
+def table_page(request, project_id, file_name):
+    """
+    Query a tabular results file (.csv / .tsv) without downloading the whole
+    file.
+
+    The following GET parameters are understood:
+    - `columns`: comma-separated names of the columns to return
+    - `filter`: `<column><operator><value>`, eg, `pvalue<0.05`; may be repeated
+    - `sort`: comma-separated column names, prefixed by "-" for descending order
+    - `offset` and `limit`: the range of matching rows to return
+    - `format`: "csv" (the default) or "json"
+
+    Access to the table is restricted in the same way as for `results_page`.
+
+    Large tables are converted into their columnar form by a background job;
+    until that job has finished, the user is asked to try again later.
+    """
+    file_name = clean_file_name(project_id, file_name)
+    if not can_access_file(request.user, project_id, file_name):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    project_collection = get_current_site().projects_dir
+    file_path = project_collection / project_id / file_name
+
+    if not tables.is_table(file_name) or not storage.is_file(file_path):
+        raise Http404(f"No table named {file_name} in {project_id}")
+
+    params = request.GET
+    columns = [c for c in params.get("columns", "").split(",") if c]
+    sort = [s for s in params.get("sort", "").split(",") if s]
+    output_format = params.get("format", "csv")
+
+    try:
+        offset = int(params.get("offset", 0))
+        limit = int(params["limit"]) if "limit" in params else None
+    except ValueError:
+        return HttpResponseBadRequest("`offset` and `limit` should be integers")
 
-    return HttpResponse(file_contents, content_type=content_type)
+    if offset < 0 or (limit is not None and limit < 0):
+        return HttpResponseBadRequest("`offset` and `limit` should be non-negative")
+
+    if output_format not in {"csv", "json"}:
+        return HttpResponseBadRequest("`format` should be 'csv' or 'json'")
+
+    if not tables.is_table_cache_fresh(file_path):
+        if storage.run(file_path, os.stat, file_path).st_size > (
+            tables.INLINE_BUILD_MAX_BYTES
+        ):
+            jobs.enqueue("table", file_path, priority=1)
+            response = HttpResponse(
+                "This table is being prepared, please try again shortly",
+                content_type="text/plain",
+                status=202,
+            )
+            response["Retry-After"] = "5"
+            return response
+
+    try:
+        table = tables.query_table(
+            tables.open_table(file_path),
+            columns=columns,
+            filters=params.getlist("filter"),
+            sort=sort,
+            offset=offset,
+            limit=limit,
+        )
+    except tables.TableQueryError as error:
+        return HttpResponseBadRequest(str(error))
+
+    if output_format == "json":
+        return StreamingHttpResponse(
+            tables.iter_table_json(table), content_type="application/json"
+        )
+
+    return StreamingHttpResponse(tables.iter_table_csv(table), content_type="text/csv")
+
+
+@throttle_downloads()
+def tail_page(request, project_id, file_name):
+    """
+    The last lines of a (text) results file, such as a log, which are kept up
+    to date as lines are added to the file (see `follow_events`).
+
+    The number of lines is given by the `lines` parameter. Only the end of the
+    file is read, however large it is.
+    """
+    file_name = clean_file_name(project_id, file_name)
+    if not can_access_file(request.user, project_id, file_name):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    try:
+        lines = int(request.GET.get("lines", TAIL_LINES_DEFAULT))
+    except ValueError:
+        return HttpResponseBadRequest("`lines` should be an integer")
+    if not 0 <= lines <= TAIL_LINES_MAX:
+        return HttpResponseBadRequest(
+            f"`lines` should be between 0 and {TAIL_LINES_MAX}"
+        )
+
+    file_path = get_current_site().projects_dir / project_id / file_name
+    if not storage.is_file(file_path):
+        raise Http404(f"No file named {file_name} in {project_id}")
+
+    text, offset = tail.read_tail(file_path, lines)
+    access_log.record_download(request, project_id, file_name, len(text))
+
+    context = {
+        "project_id": project_id,
+        "file_name": file_name,
+        "lines": lines,
+        "text": text.decode("utf-8", errors="replace"),
+        "offset": offset,
+    }
+    return render(request, "tail.html", context)
+
+
+def follow_events(request, project_id, file_name):
+    """
+    A stream of server-sent events, one per piece of text appended to a file.
+
+    Each event has the byte offset of the end of its text as its id, and the
+    text as its data; the file is followed from the offset given by the
+    `Last-Event-ID` header (or, for a new connection, the `offset` parameter).
+    A "reset" event is sent if the file is truncated or replaced, after which
+    it is followed from its start.
+    """
+    file_name = clean_file_name(project_id, file_name)
+    if not can_access_file(request.user, project_id, file_name):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    try:
+        offset = int(
+            request.headers.get("Last-Event-ID") or request.GET.get("offset", 0)
+        )
+    except ValueError:
+        return HttpResponseBadRequest("The event id should be an integer")
+    if offset < 0:
+        return HttpResponseBadRequest("The event id should be non-negative")
+
+    file_path = get_current_site().projects_dir / project_id / file_name
+    if not storage.is_file(file_path):
+        raise Http404(f"No file named {file_name} in {project_id}")
+
+    response = StreamingHttpResponse(
+        stream_appended_text(file_path, offset), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@require_POST
+def upload_start(request, project_id, file_name):
+    """
+    Start an upload of a file into a project (see `contented.uploads`).
+
+    The POST parameters `size` (in bytes) and `sha256` (the hex-digest of the
+    file) are required. The response describes the new upload, including the
+    `url` that its contents are to be sent to (see `upload_page`).
+
+    Only members of the site with the "add upload" permission can upload
+    files.
+    """
+    if not can_upload(request.user):
+        return HttpResponseForbidden("You cannot upload files")
+
+    try:
+        size = int(request.POST.get("size", ""))
+    except ValueError:
+        return HttpResponseBadRequest("`size` should be an integer")
+
+    try:
+        upload = uploads.start_upload(
+            request.user, project_id, file_name, size, request.POST.get("sha256", "")
+        )
+    except uploads.UploadError as error:
+        return HttpResponseBadRequest(str(error))
+
+    return JsonResponse(get_upload_status(upload), status=201)
+
+
+@csrf_exempt
+def upload_page(request, upload_id):
+    """
+    The state of an upload (GET), or the next chunk of its contents (POST).
+
+    A chunk is sent as the file in a `multipart/form-data` request, with the
+    number of bytes that have already been received (the `offset` in the
+    state of the upload) in its `Upload-Offset` header. The chunk is written
+    straight to disk as it arrives. When the last byte has been received, the
+    checksum of the file is checked and the file is moved into its project.
+
+    An interrupted upload is resumed by asking for its state and sending the
+    rest of the file from its `offset`.
+    """
+    if not can_upload(request.user):
+        return HttpResponseForbidden("You cannot upload files")
+
+    upload = Upload.objects.filter(
+        id=upload_id, user=request.user, site=get_current_site().name
+    ).first()
+    if upload is None:
+        raise Http404("No such upload")
+
+    if request.method != "POST":
+        return JsonResponse(get_upload_status(upload))
+
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return HttpResponseBadRequest("The `Upload-Offset` should be an integer")
+    if upload.completed or offset != upload.received:
+        return JsonResponse(get_upload_status(upload), status=409)
+
+    # The handlers must be in place before the CSRF check reads the request
+    handler = uploads.ChunkUploadHandler(upload, offset, request)
+    request.upload_handlers = [handler]
+    return receive_upload_chunk(request, upload, handler)
 
 
 # Helpers
@@ -75,17 +906,410 @@ def results_page(request, project_id, file_name):
 
 def get_accessible_projects(user):
     """
-    A logged-in user can view all projects, both restricted and non-restricted.
-    A user who is not logged in can only view non-restricted projects.
+    A member of the site can view all projects, both restricted and
+    non-restricted. Anyone else can only view non-restricted projects.
+
+    The projects are listed in name order (see `get_sorted_projects`).
     """
-    project_collection = settings.PROJECTS_DIR
-    projects = os.listdir(project_collection)
-    if settings.RESTRICTED_PROJECTS and not user.is_authenticated:
-        projects = [p for p in projects if p not in settings.RESTRICTED_PROJECTS]
+    projects = get_sorted_projects()
+    restrictions = get_restrictions(user)
+    if restrictions:
+        projects = [p for p in projects if not restrictions.is_restricted(p)]
 
     return projects
 
 
+def get_restrictions(user):
+    """
+    The restriction rules that apply to `user`: none for a member of the
+    current site (see `Site.is_member`), and those of the site for anyone else
+    (including users who are logged in to another site).
+    """
+    site = get_current_site()
+    if site.is_member(user):
+        return compile_rules(())
+    return site.restrictions
+
+
+def can_upload(user):
+    """
+    Can `user` upload files into the current site? They must have the "add
+    upload" permission, and be a member of the site.
+    """
+    if not user.has_perm("contented.add_upload"):
+        return False
+    return get_current_site().is_member(user)
+
+
+def can_access_file(user, project_id, file_name):
+    """
+    Can `user` see the file (or folder) `file_name` in a project? The project
+    must be accessible (see `get_accessible_projects`), and no restriction
+    rule may match the file.
+    """
+    if not project_id in get_accessible_projects(user):
+        return False
+    return not get_restrictions(user).is_restricted_file(project_id, file_name)
+
+
+def clean_file_name(project_id, file_name):
+    """
+    The normalised path of a file within its project (see
+    `uploads.clean_upload_path`). Raises Http404 for a path that would lead
+    outside the project.
+    """
+    try:
+        return uploads.clean_upload_path(project_id, file_name)
+    except uploads.UploadError:
+        raise Http404(f"No file named {file_name} in {project_id}") from None
+
+
+def filter_restricted_files(user, project_id, project_files):
+    """
+    Yield the paths in `project_files` (in a project) that `user` can see.
+    """
+    restrictions = get_restrictions(user)
+    for project_file in project_files:
+        if not restrictions.is_restricted_file(project_id, project_file):
+            yield project_file
+
+
+def get_sorted_projects():
+    """
+    The names of all projects in the current site's collection, sorted.
+
+    The projects are read from the shared index, if one is configured.
+    Otherwise the project collection is listed (see `list_projects`); projects
+    that are stored as archives are listed without their extension (see
+    `archives.get_project_ids`).
+
+    The sorted names are kept by each process, and are only read again when
+    the collection directory is modified (or the shared index is rebuilt), so
+    most requests cost a single `stat` of the collection.
+    """
+    project_collection = get_current_site().projects_dir
+    cached = _sorted_projects.get(str(project_collection))
+
+    shared = shared_index.get_shared_index()
+    if shared is not None:
+        # The shared index is mapped afresh when it is rebuilt
+        version = shared
+    else:
+        try:
+            collection_stat = storage.run(
+                project_collection, os.stat, project_collection
+            )
+        except storage.StorageUnavailable:
+            if cached is None:
+                raise
+            return cached[1]
+        version = ("listing", collection_stat.st_mtime_ns)
+
+    if cached is None or cached[0] != version:
+        if shared is not None:
+            projects = shared.projects()
+        else:
+            projects = archives.get_project_ids(list_projects(project_collection))
+        cached = (version, projects)
+        _sorted_projects[str(project_collection)] = cached
+
+    return cached[1]
+
+
+def page_projects_by_name(restrictions, prefix="", contains="", after=""):
+    """
+    One page of project names, in name order: those that start with `prefix`,
+    contain `contains` and come after the name `after`, leaving out the
+    projects that are restricted by `restrictions`.
+
+    Returns the names, and the cursor for the next page (None on the last
+    page). The start of the page is found by bisecting the sorted names; a
+    filter on part of the name is checked from there until the page is full.
+    """
+    projects = get_sorted_projects()
+    start = bisect.bisect_left(projects, prefix)
+    if after:
+        start = max(start, bisect.bisect_right(projects, after))
+
+    page = []
+    for position in range(start, len(projects)):
+        project_id = projects[position]
+        if not project_id.startswith(prefix):
+            break
+        if contains not in project_id.lower() or restrictions.is_restricted(project_id):
+            continue
+        if len(page) == HOME_PAGE_SIZE:
+            return page, page[-1]
+        page.append(project_id)
+
+    return page, None
+
+
+def page_projects_by_update(restrictions, prefix="", contains="", after=""):
+    """
+    One page of the `ProjectSummary` of each project, most recently updated
+    first (and then in name order), filtered as for `page_projects_by_name`.
+    `after` is a cursor of the form `<last update>/<project_id>`.
+
+    The page is read from the project index, using its (collection,
+    last_updated, project_id) index, so projects that are not in the index are
+    not listed.
+    """
+    summaries = ProjectSummary.objects.filter(
+        collection=index.get_collection_key(),
+        file_count__gt=0,
+        last_updated__isnull=False,
+    )
+    if prefix:
+        summaries = summaries.filter(project_id__startswith=prefix)
+    if contains:
+        summaries = summaries.filter(project_id__icontains=contains)
+    if after:
+        last_updated, _, project_id = after.partition("/")
+        try:
+            last_updated = datetime.datetime.fromisoformat(last_updated)
+        except ValueError:
+            last_updated = None
+        if last_updated is not None:
+            summaries = summaries.filter(
+                Q(last_updated__lt=last_updated)
+                | Q(last_updated=last_updated, project_id__gt=project_id)
+            )
+
+    page = []
+    summaries = summaries.order_by("-last_updated", "project_id")
+    for summary in summaries.iterator(chunk_size=HOME_PAGE_SIZE + 1):
+        if restrictions.is_restricted(summary.project_id):
+            continue
+        if len(page) == HOME_PAGE_SIZE:
+            return page, f"{page[-1].last_updated.isoformat()}/{page[-1].project_id}"
+        page.append(summary)
+
+    return page, None
+
+
+def list_projects(project_collection):
+    """
+    The names of the entries in the project collection; hidden entries (such
+    as the `.snapshots` directory, see `contented.snapshots`) are left out.
+
+    If the collection's storage is not responding, the last listing that this
+    process made is returned instead (if there is one).
+    """
+    try:
+        projects = [
+            entry
+            for entry in storage.listdir(project_collection)
+            if not entry.startswith(".")
+        ]
+    except storage.StorageUnavailable:
+        if str(project_collection) not in _project_listings:
+            raise
+        return list(_project_listings[str(project_collection)])
+
+    _project_listings[str(project_collection)] = projects
+    return projects
+
+
+def open_deliverable(file_path, mode):
+    """
+    Open a file in the project collection, and return it with its size.
+
+    If the local read-through cache is in use (see `contented.local_cache`),
+    the file is opened from its local copy, if that is valid; otherwise it is
+    opened from the collection, and a job to copy it to local disk is queued.
+    """
+    if settings.LOCAL_CACHE_DIR:
+        source_stat = storage.run(file_path, os.stat, file_path)
+        local_path = local_cache.find_local_copy(file_path, source_stat)
+        if local_path is not None:
+            return open(local_path, mode), source_stat.st_size
+        if local_cache.should_cache(source_stat):
+            jobs.enqueue("local_cache", file_path, version=source_stat.st_mtime_ns)
+
+    file_object = storage.open_file(file_path, mode)
+    return file_object, file_object.fstat().st_size
+
+
+def get_file_response(file_object, content_type=None):
+    """
+    A FileResponse for a file from `storage.open_file`. The file is sent in
+    large blocks, since each block is read in the storage executor.
+    """
+    response = FileResponse(file_object, content_type=content_type)
+    response.block_size = FILE_BLOCK_SIZE
+    return response
+
+
+def stream_project_events(project_id, generation, projects_dir, restrictions):
+    """
+    Yield server-sent events for the changes to a project after `generation`,
+    for up to `EVENT_STREAM_SECONDS`; changes to files that are restricted by
+    `restrictions` are left out.
+    """
+    deadline = time.monotonic() + EVENT_STREAM_SECONDS
+    yield f"retry: {int(EVENT_POLL_INTERVAL * 1000)}\n\n"
+
+    while True:
+        for event in index.get_events_since(generation, project_id, projects_dir):
+            generation = event.id
+            if restrictions.is_restricted_file(project_id, event.path):
+                continue
+            data = json.dumps({"path": event.path})
+            yield f"id: {event.id}\nevent: {event.kind}\ndata: {data}\n\n"
+
+        if time.monotonic() >= deadline:
+            return
+        time.sleep(EVENT_POLL_INTERVAL)
+
+
+def stream_appended_text(file_path, offset):
+    """
+    Yield server-sent events for the text appended to a file after byte
+    `offset`, for up to `EVENT_STREAM_SECONDS`.
+    """
+    yield f"retry: {int(EVENT_POLL_INTERVAL * 1000)}\n\n"
+
+    for offset, data in tail.iter_appended(
+        file_path, offset, EVENT_STREAM_SECONDS, EVENT_POLL_INTERVAL
+    ):
+        if data is None:
+            yield f"id: {offset}\nevent: reset\ndata: \n\n"
+            continue
+        text = json.dumps(data.decode("utf-8", errors="replace"))
+        yield f"id: {offset}\nevent: append\ndata: {text}\n\n"
+
+
+@csrf_protect
+def receive_upload_chunk(request, upload, handler):
+    """
+    Read the chunk in a request for `upload_page` (using `handler`), and
+    commit the upload once it is complete.
+    """
+    request.FILES  # Parsing the request writes the chunk to disk
+    if handler.too_large:
+        return HttpResponseBadRequest("The chunk runs past the size of the upload")
+    if not uploads.record_chunk(
+        upload, handler.offset, handler.received, handler.hasher
+    ):
+        return JsonResponse(get_upload_status(upload), status=409)
+
+    if upload.received == upload.size:
+        try:
+            uploads.commit_upload(upload)
+        except uploads.ChecksumMismatch as error:
+            return JsonResponse({"error": str(error)}, status=422)
+        except uploads.UploadError as error:
+            return JsonResponse({"error": str(error)}, status=409)
+
+    return JsonResponse(get_upload_status(upload))
+
+
+def get_upload_status(upload):
+    return {
+        "id": str(upload.id),
+        "url": reverse("upload", args=[upload.id]),
+        "project_id": upload.project_id,
+        "path": upload.path,
+        "size": upload.size,
+        "offset": upload.received,
+        "complete": upload.completed,
+    }
+
+
+def stream_manifest(project_id, since, generation, complete, entries, restrictions):
+    """
+    Yield the JSON for a project manifest (see `manifest_page`) in pieces, so
+    that the manifest for a large project is never held in memory. Entries
+    for files that are restricted by `restrictions` are left out.
+    """
+    header = json.dumps(
+        {
+            "project_id": project_id,
+            "since": since,
+            "generation": generation,
+            "complete": complete,
+        }
+    )
+    yield header[:-1] + ', "files": ['
+
+    separator = ""
+    for entry in entries.iterator():
+        if restrictions.is_restricted_file(project_id, entry.path):
+            continue
+        if entry.removed:
+            file_details = {"path": entry.path, "removed": True}
+        else:
+            file_details = {
+                "path": entry.path,
+                "size": entry.size,
+                "mtime": entry.mtime_ns / 1e9,
+                "hash": entry.content_hash or None,
+                "hash_algorithm": entry.hash_algorithm or None,
+            }
+        yield separator + json.dumps(file_details)
+        separator = ", "
+
+    yield "]}"
+
+
+def iter_project_files(project_id):
+    """
+    Yield the paths of the files in a project (relative to the project
+    directory) from the shared index, the project index or, if neither is in
+    use, by walking the project directory. The files of a project that is
+    stored as an archive (which the project index does not hold) are read
+    from the archive.
+    """
+    shared = shared_index.get_shared_index()
+    if shared is not None and project_id in shared:
+        yield from shared.files(project_id)
+        return
+
+    if settings.CONTENTED_USE_INDEX:
+        project_files = iter(index.iter_indexed_files(project_id))
+    else:
+        project_collection = get_current_site().projects_dir
+        project_files = iter_relative_results_files(project_collection / project_id)
+    first_file = next(project_files, None)
+    if first_file is not None:
+        yield first_file
+        yield from project_files
+        return
+
+    # Either the project is empty, or it is not a directory: it may be an
+    # archive
+    archive_path = archives.find_archive(project_id)
+    if archive_path is not None:
+        yield from archives.get_members(archive_path)
+
+
+def stream_project_page(request, project_id, head, project_files, tail):
+    """
+    Yield a project page: `head`, then the rows of the results-table in
+    chunks of increasing size, then `tail`. Only one chunk of rows is held in
+    memory at a time.
+    """
+    yield head
+
+    rows_template = loader.get_template("project_rows.html")
+    chunk, chunk_size = [], ROWS_CHUNK_MIN
+    for project_file in project_files:
+        chunk.append(str(project_file))
+        if len(chunk) >= chunk_size:
+            yield rows_template.render(
+                {"project_id": project_id, "results_files": chunk}, request
+            )
+            chunk, chunk_size = [], min(2 * chunk_size, ROWS_CHUNK_MAX)
+
+    if chunk:
+        yield rows_template.render(
+            {"project_id": project_id, "results_files": chunk}, request
+        )
+
+    yield tail
+
+
 def get_relative_results_files(project_path):
     """
     For a given directory, `project_path`, return a list of `Path`s for all the
@@ -99,11 +1323,15 @@ def get_relative_results_files(project_path):
     get_relative_results_path(Path("a"))
     should return [Path("b/temp.txt"), Path("c.tsv")]
     """
-    result_files = []
+    return list(iter_relative_results_files(project_path))
 
-    for root, _, files in os.walk(project_path):
+
+def iter_relative_results_files(project_path):
+    """
+    Yield the same paths as `get_relative_results_files`, one directory at a
+    time, as the directory tree is walked.
+    """
+    for root, _, files in storage.walk(project_path):
         relative_root = Path(root).relative_to(project_path)
         for my_file in files:
-            result_files.append(relative_root / my_file)
-
-    return result_files
+            yield relative_root / my_file
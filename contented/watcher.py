@@ -0,0 +1,267 @@
+"""
+Watch a project collection for changes using Linux inotify, and pass those
+changes on to the project index.
+
+inotify is accessed through `ctypes`, so no extra packages are needed; the
+watcher only works on Linux. Note that inotify does not report changes that are
+made on other hosts of a network filesystem: in that case, run
+`./manage.py contented_index` periodically instead.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+from . import index, jobs, shared_index, snapshots
+from .sites import get_current_site
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    Recursive inotify watch over a directory tree.
+
+    `read_changes` returns the paths below the root that may have changed:
+    files that were created, written, moved or deleted, and directories that
+    were created, moved or deleted. New subdirectories are watched as soon as
+    they are seen.
+    """
+
+    def __init__(self, root):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number))
+
+        self.root = Path(root)
+        self.watched_dirs = {}
+        self.overflowed = False
+        self.watch_tree(self.root)
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def watch_dir(self, directory):
+        watch_descriptor = self._add_watch(
+            self.fd, os.fsencode(str(directory)), WATCH_MASK
+        )
+        if watch_descriptor < 0:
+            error_number = ctypes.get_errno()
+            if error_number in (errno.ENOENT, errno.ENOTDIR):
+                # The directory vanished before it could be watched
+                return
+            raise OSError(error_number, os.strerror(error_number), str(directory))
+        self.watched_dirs[watch_descriptor] = Path(directory)
+
+    def watch_tree(self, directory):
+        """
+        Watch `directory` and all directories below it; return the paths of the
+        files that are already present (these may have been created before the
+        watch was in place).
+        """
+        files = []
+        for root, _, file_names in os.walk(directory):
+            self.watch_dir(root)
+            files.extend(Path(root) / file_name for file_name in file_names)
+        return files
+
+    def read_changes(self, timeout=None):
+        """
+        Wait up to `timeout` seconds for events, and return the set of paths
+        that they refer to.
+
+        If the kernel's event queue overflowed, `self.overflowed` is set: some
+        changes were lost, so the caller should rescan the whole tree.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changes = set()
+        offset = 0
+        while offset < len(buffer):
+            watch_descriptor, mask, _, name_length = EVENT_HEADER.unpack_from(
+                buffer, offset
+            )
+            offset += EVENT_HEADER.size
+            name = buffer[offset : offset + name_length].rstrip(b"\0")
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+
+            directory = self.watched_dirs.get(watch_descriptor)
+            if directory is None:
+                continue
+
+            if mask & IN_IGNORED:
+                del self.watched_dirs[watch_descriptor]
+                continue
+
+            if not name:
+                # The watched directory itself was deleted or moved
+                continue
+
+            path = directory / os.fsdecode(name)
+            changes.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                changes.update(self.watch_tree(path))
+
+        return changes
+
+
+def split_collection_path(projects_dir, path):
+    """
+    Convert an absolute path within a collection into `(project_id,
+    relative_path)`; `relative_path` is None if `path` is a project directory.
+
+    Hidden entries of the collection are not projects, and give `(None,
+    None)`; except that a path in the latest snapshot of a project (see
+    `contented.snapshots`) is converted to its path within that project.
+    """
+    parts = Path(path).relative_to(projects_dir).parts
+    if parts and parts[0] == snapshots.SNAPSHOTS_DIR_NAME and len(parts) >= 3:
+        project_id, version = parts[1:3]
+        if version == snapshots.get_latest_version(project_id, projects_dir):
+            parts = parts[1:2] + parts[3:]
+    if not parts or parts[0].startswith("."):
+        return None, None
+    if len(parts) == 1:
+        return parts[0], None
+    return parts[0], str(Path(*parts[1:]))
+
+
+def apply_changes(projects_dir, changes):
+    """
+    Pass a set of changed paths on to the project index. Changed directories
+    (eg, a folder that was moved into, or out of, a project) are rescanned.
+    Each project with a changed file is queued for (re-)hashing. Returns the
+    events that were recorded.
+    """
+    events = []
+    for path in sorted(changes):
+        project_id, relative_path = split_collection_path(projects_dir, path)
+        if project_id is None:
+            continue
+        if relative_path is None or path.is_dir():
+            events.extend(index.scan_project(project_id, projects_dir))
+        elif not path.exists():
+            events.extend(
+                _remove_indexed_paths(projects_dir, project_id, relative_path)
+            )
+        else:
+            event = index.record_change(project_id, relative_path, projects_dir)
+            if event is not None:
+                events.append(event)
+
+    for project_id in {event.project_id for event in events}:
+        if (projects_dir / project_id).is_dir():
+            jobs.enqueue_project_hashing(project_id, projects_dir)
+
+    return events
+
+
+def _remove_indexed_paths(projects_dir, project_id, relative_path):
+    """
+    Record the removal of a file, or of every indexed file below a directory
+    that has been removed.
+    """
+    events = []
+    for indexed_path in index.get_indexed_files(project_id, projects_dir):
+        if indexed_path == relative_path or indexed_path.startswith(
+            relative_path + os.sep
+        ):
+            event = index.record_change(project_id, indexed_path, projects_dir)
+            if event is not None:
+                events.append(event)
+    return events
+
+
+def watch_collection(projects_dir=None, settle_time=0.5, stop=None):
+    """
+    Watch a collection and keep its project index up to date until `stop()`
+    returns True (or forever).
+
+    Changes are collected for `settle_time` seconds before being applied, so a
+    file that is being written in many small pieces results in a few
+    'modified' events rather than one per write. If a shared index is
+    configured, it is rebuilt (from the project index) after each batch of
+    changes.
+    """
+    projects_dir = Path(projects_dir or get_current_site().projects_dir).resolve()
+
+    with Inotify(projects_dir) as inotify:
+        index.scan_collection(projects_dir)
+        while stop is None or not stop():
+            changes = inotify.read_changes(timeout=1.0)
+            if not changes and not inotify.overflowed:
+                continue
+
+            deadline = time.monotonic() + settle_time
+            while time.monotonic() < deadline:
+                changes |= inotify.read_changes(
+                    timeout=max(deadline - time.monotonic(), 0)
+                )
+
+            if inotify.overflowed:
+                inotify.overflowed = False
+                inotify.watch_tree(projects_dir)
+                events = index.scan_collection(projects_dir)
+            else:
+                events = apply_changes(projects_dir, changes)
+
+            if events and get_current_site().shared_index:
+                shared_index.build_shared_index(
+                    projects_dir=projects_dir, from_project_index=True
+                )
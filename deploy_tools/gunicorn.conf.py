@@ -0,0 +1,43 @@
+"""
+gunicorn settings for `contented`; see gunicorn-systemd.template.service
+
+The application is loaded once, in the gunicorn master, before the workers
+are forked. If `CONTENTED_SHARED_INDEX` (or `CONTENTED_SITES_FILE`) is set in
+.env, the shared project listings are built at that point too, so each
+collection is crawled once rather than once per worker.
+
+One gunicorn service can serve every site in `CONTENTED_SITES_FILE`: size the
+number of workers for the combined traffic of the sites.
+
+Each open project page, and each log file that is being followed, keeps a
+request open for up to `EVENT_STREAM_SECONDS` (see `contented/views.py`) while
+it streams server-sent events. A sync worker would be tied up by each of them,
+so the workers are threaded: each worker serves up to `threads` requests at
+once, and a stream only holds one thread.
+"""
+
+import os
+
+preload_app = True
+
+worker_class = "gthread"
+threads = 16
+
+
+def on_starting(server):
+    """
+    Build the shared project listings before the application is loaded
+    """
+    if not (os.getenv("CONTENTED_SHARED_INDEX") or os.getenv("CONTENTED_SITES_FILE")):
+        return
+
+    # pylint: disable=import-outside-toplevel
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    django.setup()
+
+    from contented import shared_index
+
+    server.log.info("Building shared project indexes")
+    shared_index.build_site_indexes()